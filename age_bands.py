@@ -0,0 +1,129 @@
+# age band mapping layer - regroups data published in one set of age bands (5 year case bands, vaccination
+# bands, admissions bands) into the age groups used in the app. a scheme of source band -> target group shares,
+# including fractional splits of a band across groups, is turned once into a weight matrix, and regrouping is
+# then one matrix product over every date, region and dose at once
+
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from population import ADMISSIONS_AGE_GROUPS
+
+
+# 5 year age bands cases are published in
+CASE_AGE_BANDS = ['00_04', '05_09', '10_14', '15_19', '20_24', '25_29', '30_34', '35_39', '40_44', '45_49',
+                  '50_54', '55_59', '60_64', '65_69', '70_74', '75_79', '80_84', '85_89', '90+']
+
+# bands vaccinations are published in, from 18 upwards
+VAX_AGE_BANDS = ['18_24'] + CASE_AGE_BANDS[5:]
+
+# bands admissions are published in
+ADMISSIONS_AGE_BANDS = ['0_to_5', '6_to_17', '18_to_64', '65_to_84', '85+']
+
+
+class AgeBandMapping:
+    """
+    source age bands -> target age groups, as a (source, target) matrix of the share of each band's count going
+    to each group
+    """
+
+    def __init__(self, sources, targets, shares):
+        """
+        :param sources: List - source band labels
+        :param targets: List - target group labels
+        :param shares: Dict - source band -> Dict of target group -> share of the band's count. only the
+        non-zero shares are given, and bands not listed count towards no group
+        """
+        self.sources = list(sources)
+        self.targets = list(targets)
+
+        matrix = np.zeros((len(self.sources), len(self.targets)))
+        for source, groups in shares.items():
+            for target, share in groups.items():
+                matrix[self.sources.index(source), self.targets.index(target)] += share
+        matrix.flags.writeable = False
+        self.matrix = matrix
+
+    @classmethod
+    def from_bins(cls, sources, bins, labels):
+        """
+        mapping of each band to the age group its first age falls in
+        :param sources: List - band labels, the first 2 characters of which are the band's first age
+        :param bins: List - full list of age group edges including 0 and 120, as from create_bins_labels
+        :param labels: List - age group labels
+        :return: AgeBandMapping
+        """
+        start_ages = np.array([int(source[:2]) for source in sources])
+        groups = np.digitize(start_ages, bins[1:-1], right=False)
+
+        return cls(sources, labels, {source: {labels[group]: 1.0} for source, group in zip(sources, groups)})
+
+    def apply(self, values):
+        """
+        :param values: ndarray - counts with source bands along the last axis, in the order of self.sources, and
+        any number of leading axes (dates, regions, doses, ...)
+        :return: ndarray - counts with target groups along the last axis
+        """
+        return values @ self.matrix
+
+    def apply_frame(self, df, skipna=True):
+        """
+        :param df: DataFrame - a column per source band (other columns are ignored)
+        :param skipna: Boolean - if True, missing values count as 0. if False, a group is missing wherever any
+        band counting towards it is
+        :return: DataFrame - same index, a column per target group
+        """
+        values = df[self.sources].to_numpy(dtype='float64')
+        missing = np.isnan(values)
+        grouped = self.apply(np.where(missing, 0, values))
+        if not skipna:
+            grouped[(missing @ (self.matrix != 0)) > 0] = np.nan
+
+        return pd.DataFrame(grouped, index=df.index, columns=self.targets)
+
+    def group_codes(self, bands):
+        """
+        position of the target group of each band, for mappings sending each band wholly to one group
+        :param bands: array-like - source band labels
+        :return: ndarray - target group position of each, -1 for bands counting towards no group
+        """
+        codes = np.where(self.matrix.any(axis=1), self.matrix.argmax(axis=1), -1)
+
+        return codes[pd.Categorical(bands, categories=self.sources).codes]
+
+
+# 15-19 year old cases are split 60/40 between 15-17 and 18-19, as an approximation
+CASES_TO_ADMISSIONS = AgeBandMapping(CASE_AGE_BANDS, ADMISSIONS_AGE_GROUPS, {
+    **{band: {'0-17 yrs': 1.0} for band in CASE_AGE_BANDS[:3]},
+    '15_19': {'0-17 yrs': 0.6, '18-64 yrs': 0.4},
+    **{band: {'18-64 yrs': 1.0} for band in CASE_AGE_BANDS[4:13]},
+    **{band: {'65-84 yrs': 1.0} for band in CASE_AGE_BANDS[13:17]},
+    **{band: {'85+ yrs': 1.0} for band in CASE_AGE_BANDS[17:]},
+})
+
+# no vaccinations are published for under 18s, so 0-17 yrs is always 0
+VAX_TO_ADMISSIONS = AgeBandMapping(VAX_AGE_BANDS, ADMISSIONS_AGE_GROUPS, {
+    **{band: {'18-64 yrs': 1.0} for band in VAX_AGE_BANDS[:9]},
+    **{band: {'65-84 yrs': 1.0} for band in VAX_AGE_BANDS[9:13]},
+    **{band: {'85+ yrs': 1.0} for band in VAX_AGE_BANDS[13:]},
+})
+
+ADMISSIONS_TO_ADMISSIONS = AgeBandMapping(ADMISSIONS_AGE_BANDS, ADMISSIONS_AGE_GROUPS, {
+    '0_to_5': {'0-17 yrs': 1.0},
+    '6_to_17': {'0-17 yrs': 1.0},
+    '18_to_64': {'18-64 yrs': 1.0},
+    '65_to_84': {'65-84 yrs': 1.0},
+    '85+': {'85+ yrs': 1.0},
+})
+
+
+@lru_cache(maxsize=None)
+def bins_mapping(sources, bins):
+    """
+    :param sources: Tuple - band labels, the first 2 characters of which are the band's first age
+    :param bins: Tuple - full list of age group edges including 0 and 120
+    :return: AgeBandMapping - of each band to the age group it falls in, built once per (sources, bins)
+    """
+    # labels as from create_bins_labels
+    labels = [f'{bins[i]}-{bins[i + 1] - 1} yrs' for i in range(len(bins) - 2)] + [f'{bins[-2]}+ yrs']
+
+    return AgeBandMapping.from_bins(list(sources), list(bins), labels)
@@ -0,0 +1,337 @@
+# vectorized engine computing the series shown in the charts, shared by the dash callbacks and the export api.
+# regional cases are held once as a date x area x age band cube, so any set of age groups for any (or every)
+# region is a single matrix product, rather than re-binning and pivoting the long case data on every request
+
+import math
+import numpy as np
+import pandas as pd
+from age_bands import CASE_AGE_BANDS, bins_mapping
+from app_config import RT_GI_MEAN, RT_GI_SD, RT_GI_MAX_DAYS, RT_WINDOW, RT_MIN_CASES, RESULT_CACHE_SIZE
+from population import population_registry
+from result_cache import ResultCache, caches
+from smoothing import smooth_frame
+from utilities import create_bins_labels, get_ratio, get_rolling_total
+
+
+# first age of each 5 year age band cases are published in, as kept by clean_case_data
+BAND_START_AGES = np.array([int(band[:2]) for band in CASE_AGE_BANDS])
+BAND_BINS = BAND_START_AGES.tolist() + [120]
+
+window_index_cache = caches.setdefault('window_index', ResultCache(RESULT_CACHE_SIZE))
+case_rates_cache = caches.setdefault('case_rates', ResultCache(RESULT_CACHE_SIZE))
+
+
+class CaseCube:
+    """
+    daily cases by area and 5 year age band, held in one read-only array
+    """
+
+    def __init__(self, dates, areas, cases):
+        """
+        :param dates: DatetimeIndex - dates, in order
+        :param areas: List - area (region) names
+        :param cases: ndarray - cases of shape (dates, areas, age bands)
+        """
+        self.dates = dates
+        self.areas = list(areas)
+        cases.flags.writeable = False
+        self.cases = cases
+
+    @classmethod
+    def from_cases(cls, df):
+        """
+        :param df: DataFrame - cleaned cases by age and region, as from clean_case_data
+        :return: CaseCube
+        """
+        date_codes, dates = pd.factorize(df['date'], sort=True)
+        area_codes, areas = pd.factorize(df['areaName'])
+        band_codes = pd.Categorical(df['age'], categories=CASE_AGE_BANDS).codes
+
+        # sum rows into their (date, area, band) cell. dates or areas with no rows for a band stay 0
+        shape = (len(dates), len(areas), len(CASE_AGE_BANDS))
+        flat = np.ravel_multi_index((date_codes, area_codes, band_codes), shape)
+        cases = np.bincount(flat, weights=df['cases'].to_numpy(dtype='float64'), minlength=np.prod(shape))
+
+        return cls(pd.DatetimeIndex(dates, name='date'), areas, cases.reshape(shape))
+
+    def grouped(self, regions, bins):
+        """
+        :param regions: List - region names, 'England' for the sum of all regions
+        :param bins: List - full list of age group edges including 0 and 120, as from create_bins_labels
+        :return: ndarray - cases of shape (dates, regions, age groups)
+        """
+        # grouping every area is one matrix product
+        return self.select(self.cases @ band_to_group(bins), regions)
+
+    def select(self, values, regions):
+        """
+        :param values: ndarray - of shape (dates, areas, ...), in the order of self.areas
+        :param regions: List - region names, 'England' for the sum of all regions
+        :return: ndarray - of shape (dates, regions, ...)
+        """
+        if list(regions) == self.areas:
+            return values
+
+        return np.stack([values.sum(axis=1) if region == 'England' else values[:, self.areas.index(region)]
+                         for region in regions], axis=1)
+
+
+def band_to_group(bins):
+    """
+    :param bins: List - full list of age group edges including 0 and 120, as from create_bins_labels
+    :return: ndarray - one-hot matrix of shape (age bands, age groups) mapping each 5 year band to its age group
+    """
+    return bins_mapping(tuple(CASE_AGE_BANDS), tuple(bins)).matrix
+
+
+def standardisation_weights(regions, bins):
+    """
+    weights for direct age standardisation to the England population - each 5 year band's share of the age
+    group's population in the national population file, divided by the band's population in the region
+    :param regions: List - region names, 'England' for the sum of all regions
+    :param bins: List - full list of age group edges including 0 and 120
+    :return: ndarray - of shape (regions, age bands, age groups). cases by band times weights, summed over
+    bands, gives the age group's standardised rate per person
+    """
+    registry = population_registry()
+    mapping = band_to_group(bins)
+
+    # share of each age group's standard population in each of its bands
+    standard = registry.national_groups(BAND_BINS)
+    shares = standard[:, None] * mapping / (standard @ mapping)
+
+    # bands with no population in a region get no weight, rather than an infinite rate
+    band_pops = np.stack([registry.groups(region, BAND_BINS) for region in regions])[:, :, None]
+    weights = np.divide(shares, band_pops, out=np.zeros((len(regions),) + shares.shape), where=band_pops > 0)
+
+    return weights
+
+
+def standardised_rates(cube, regions, bins):
+    """
+    age standardised daily cases per person by age group, for every region and date in one batched matrix product
+    :param cube: CaseCube
+    :param regions: List - region names, 'England' for the sum of all regions
+    :param bins: List - full list of age group edges including 0 and 120
+    :return: ndarray - of shape (dates, regions, age groups)
+    """
+    cases = cube.select(cube.cases, regions)
+
+    # (regions, dates, bands) @ (regions, bands, groups), batched over regions
+    rates = np.matmul(cases.transpose(1, 0, 2), standardisation_weights(regions, bins))
+
+    return rates.transpose(1, 0, 2)
+
+
+def wide_frame(values, index, regions, labels):
+    """
+    :param values: ndarray - of shape (dates, regions, age groups)
+    :return: DataFrame - datetime index, columns are (region, age group)
+    """
+    columns = pd.MultiIndex.from_product([regions, labels], names=['region', 'age_group'])
+
+    return pd.DataFrame(values.reshape(len(index), -1), index=index, columns=columns)
+
+
+def case_rates(cube, regions, age_bins_list, rolling_avge_length=7, growth_rate_length=21,
+               growth_rate_average_length=5, standardised=False, smoothing='trailing'):
+    """
+    daily cases per 10,000 population and smoothed daily growth rates by age group, for any number of regions
+    :param cube: CaseCube
+    :param regions: List - region names, 'England' for the sum of all regions
+    :param age_bins_list: List - age group edges, excluding 0 (as from the age group checklists)
+    :param rolling_avge_length: Int - length of trailing rolling average of cases
+    :param growth_rate_length: Int - days over which growth rate is measured
+    :param growth_rate_average_length: Int - length of centred rolling average of growth rates
+    :param standardised: Boolean - if True, rates are directly age standardised to the England population
+    within each age group, so regions with different age structures can be compared
+    :param smoothing: Str - filter applied to cases in place of the trailing rolling average, one of
+    smoothing.FILTERS. growth rates are always smoothed with a centred mean
+    :return: 2 DataFrames - cases per 10,000 and growth rates, datetime index and (region, age group) columns.
+    cached and shared between callers, so not to be changed
+    """
+    key = (cube, tuple(regions), tuple(age_bins_list), rolling_avge_length, growth_rate_length,
+           growth_rate_average_length, standardised, smoothing)
+    hit, rates = case_rates_cache.get(key)
+    if hit:
+        return rates
+
+    bins, bin_labels = create_bins_labels(age_bins_list)
+
+    if standardised:
+        # already per person
+        values = standardised_rates(cube, regions, bins)
+        pops = 1
+    else:
+        # population of each (region, age group) column
+        registry = population_registry()
+        values = cube.grouped(regions, bins)
+        pops = np.concatenate([registry.groups(region, bins) for region in regions])
+
+    cases = wide_frame(values, cube.dates, regions, bin_labels)
+    cases_rolling = smooth_frame(cases, smoothing, rolling_avge_length)
+    per_pop = (cases_rolling / pops) * 10000
+
+    growth_rate = (cases_rolling / cases_rolling.shift(growth_rate_length)) ** (1 / growth_rate_length) - 1
+    growth_rate = smooth_frame(growth_rate, 'centered', growth_rate_average_length)
+    rates = per_pop, growth_rate
+    case_rates_cache.put(key, rates)
+
+    return rates
+
+
+def generation_interval(mean=RT_GI_MEAN, sd=RT_GI_SD, max_days=RT_GI_MAX_DAYS):
+    """
+    gamma distributed generation interval, discretised to whole days
+    :param mean: Float - mean in days
+    :param sd: Float - standard deviation in days
+    :param max_days: Int - longest interval kept
+    :return: ndarray - probability of an interval of 1, 2, ... max_days days, summing to 1
+    """
+    shape = (mean / sd) ** 2
+    scale = sd ** 2 / mean
+    days = np.arange(1, max_days + 1)
+
+    # density at each day, which is close enough to the integral over the day for the usual intervals
+    log_density = (shape - 1) * np.log(days) - days / scale - math.lgamma(shape) - shape * math.log(scale)
+    weights = np.exp(log_density)
+
+    return weights / weights.sum()
+
+
+def reproduction_number(cube, regions, age_bins_list, gi=None, window=RT_WINDOW, min_cases=RT_MIN_CASES,
+                        prior_shape=1.0, prior_scale=5.0):
+    """
+    instantaneous reproduction number by the renewal equation (as in Cori et al. 2013) for every region and age
+    group at once - cases over a trailing window divided by the infectiousness over the window, the sum of
+    earlier cases weighted by the generation interval. gives the mean of the gamma posterior of Rt
+    :param cube: CaseCube - daily cases, on consecutive dates
+    :param regions: List - region names, 'England' for the sum of all regions
+    :param age_bins_list: List - age group edges, excluding 0
+    :param gi: ndarray - generation interval, as from generation_interval. defaults to the configured one
+    :param window: Int - days in the trailing window Rt is taken as constant over
+    :param min_cases: Int - windows with fewer cases are left as NaN
+    :param prior_shape: Float - shape of the gamma prior of Rt
+    :param prior_scale: Float - scale of the gamma prior of Rt
+    :return: DataFrame - Rt, datetime index and (region, age group) columns
+    """
+    gi = generation_interval() if gi is None else gi
+    bins, bin_labels = create_bins_labels(age_bins_list)
+    cases = cube.grouped(regions, bins)
+
+    # infectiousness - convolution of earlier cases with the generation interval, over windows of the cases
+    # padded with zeros before the first date
+    padded = np.concatenate([np.zeros((len(gi),) + cases.shape[1:]), cases[:-1]])
+    earlier = np.lib.stride_tricks.sliding_window_view(padded, len(gi), axis=0)
+    infectiousness = earlier @ gi[::-1]
+
+    # trailing window sums of cases and infectiousness from cumulative sums
+    def window_sums(values):
+        totals = np.cumsum(values, axis=0)
+        sums = np.full(values.shape, np.nan)
+        sums[window - 1] = totals[window - 1]
+        sums[window:] = totals[window:] - totals[:-window]
+        return sums
+
+    case_sums = window_sums(cases)
+    infectiousness_sums = window_sums(infectiousness)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rt = (prior_shape + case_sums) / (1 / prior_scale + infectiousness_sums)
+
+    # too few cases for a meaningful estimate, and the first days where earlier cases aren't known
+    rt[(case_sums < min_cases) | np.isnan(case_sums)] = np.nan
+    rt[:len(gi)] = np.nan
+
+    return wide_frame(rt, cube.dates, regions, bin_labels)
+
+
+def admission_case_ratio(panel, start_date, rolling_avge_length=7, offset_days=7):
+    """
+    :param panel: TimeSeriesPanel
+    :param start_date: Datetime - first date to return
+    :param rolling_avge_length: Int - length of rolling average applied to both before taking the ratio
+    :param offset_days: Int - days admissions are taken after cases
+    :return: DataFrame - ratio of admissions to cases per age group, datetime index
+    """
+    return get_ratio(panel.frame('admissions').shift(-offset_days), panel.frame('cases'), start_date,
+                     rolling_avge_length)
+
+
+class WindowIndex:
+    """
+    rolling averages of admissions (taken a lag later) and cases for an age group over the whole history, with
+    prefix sums of each, so totals and the admissions to cases scale factor over any date range are O(1) lookups
+    """
+
+    def __init__(self, admissions, cases):
+        """
+        :param admissions: Series - rolling average of admissions, shifted back by the lag. datetime index
+        :param cases: Series - rolling average of cases, same index
+        """
+        self.dates = cases.index
+        self.series = {'admissions': admissions, 'cases': cases}
+
+        # running totals from the start, with a leading 0 so the total of [start, stop) is prefix[stop] -
+        # prefix[start]. missing values count as 0 towards totals, as pandas sums
+        self.prefix = {name: np.concatenate([[0.0], np.nancumsum(values.to_numpy(dtype='float64'))])
+                       for name, values in self.series.items()}
+
+    def positions(self, start_date, end_date):
+        """
+        :param start_date: Datetime - first date of the range
+        :param end_date: Datetime - last date of the range, inclusive as with .loc
+        :return: 2-tuple - start and stop positions of the range in the index, for slicing
+        """
+        return self.dates.searchsorted(start_date, side='left'), self.dates.searchsorted(end_date, side='right')
+
+    def total(self, name, start, stop):
+        """
+        :param name: Str - 'admissions' or 'cases'
+        :return: Float - total over positions [start, stop)
+        """
+        return self.prefix[name][stop] - self.prefix[name][start]
+
+    def scale_factor(self, start, stop):
+        """
+        :return: Float - total admissions over total cases over positions [start, stop)
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.total('admissions', start, stop) / self.total('cases', start, stop)
+
+    def window(self, name, start, stop):
+        """
+        :return: Series - values over positions [start, stop), a view of the series
+        """
+        return self.series[name].iloc[start:stop]
+
+
+def window_index(panel, age_group, rolling_avge_length=7, lag=0):
+    """
+    :param panel: TimeSeriesPanel - daily or weekly panel
+    :param age_group: Str - admissions age group
+    :param rolling_avge_length: Int - rolling average window, in steps of the panel
+    :param lag: Int - steps admissions are taken after cases
+    :return: WindowIndex - built once per (panel, age group, window, lag) and kept in a result cache
+    """
+    key = (panel, age_group, rolling_avge_length, lag)
+    hit, index = window_index_cache.get(key)
+    if not hit:
+        # totals of the rolling averages, as get_rolling_total gives for a range, over the whole history
+        admissions = panel.frame('admissions', [age_group]).shift(-lag)
+        cases = panel.frame('cases', [age_group])
+        index = WindowIndex(get_rolling_total(admissions, None, None, rolling_avge_length)['total'],
+                            get_rolling_total(cases, None, None, rolling_avge_length)['total'])
+        window_index_cache.put(key, index)
+
+    return index
+
+
+def vaccination_coverage(panel, start_date):
+    """
+    :param panel: TimeSeriesPanel
+    :param start_date: Datetime - first date to return
+    :return: DataFrame - cumulative people vaccinated per 10,000, datetime index and (dose, age group) columns
+    """
+    return pd.concat({dose: panel.frame(dose).loc[start_date:] for dose in ['dose1', 'dose2']}, axis=1,
+                     names=['dose', 'age_group'])
@@ -0,0 +1,148 @@
+# app-wide settings. everything is read from environment variables so behaviour can be changed per dyno
+# (or per local run) without code changes
+
+import os
+
+
+def env_flag(name, default=False):
+    """
+    read a boolean setting from the environment
+    :param name: Str - name of environment variable
+    :param default: Boolean - value to use if the variable is not set
+    :return: Boolean - True if variable is set to one of 1/true/yes/on (any case)
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_int(name, default):
+    """
+    read an integer setting from the environment
+    :param name: Str - name of environment variable
+    :param default: Int - value to use if the variable is not set
+    :return: Int
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+
+    return int(value)
+
+
+def env_float(name, default):
+    """
+    read a decimal setting from the environment
+    :param name: Str - name of environment variable
+    :param default: Float - value to use if the variable is not set
+    :return: Float
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+
+    return float(value)
+
+
+# folder of local csv files to use in place of the gov.uk api. file names are set in data_sources.py
+DATA_DIR = os.environ.get('COVID_DATA_DIR')
+
+# base url of the coronavirus dashboard api, eg to point at a local stand-in serving synthetic data
+API_BASE = os.environ.get('COVID_API_BASE', 'https://api.coronavirus.data.gov.uk')
+
+# incremental ingest - keep the last prepared data on disk and only process dates after the last ingested date
+INCREMENTAL_INGEST = env_flag('INCREMENTAL_INGEST')
+INGEST_STATE_DIR = os.environ.get('INGEST_STATE_DIR', '.ingest_state')
+
+# number of days before the last ingested date to re-read on each refresh, as specimen date cases (and
+# admissions) are back-filled for a while after first publication
+REVISION_WINDOW_DAYS = env_int('REVISION_WINDOW_DAYS', 14)
+
+# vintage store of every daily release of the raw data. unset to not keep releases
+VINTAGE_STORE_DIR = os.environ.get('VINTAGE_STORE_DIR')
+
+# release date (YYYY-MM-DD) to view the app as of, read from the vintage store. unset to use the latest data
+AS_OF_RELEASE = os.environ.get('AS_OF_RELEASE')
+if AS_OF_RELEASE and not VINTAGE_STORE_DIR:
+    raise ValueError('AS_OF_RELEASE is set but VINTAGE_STORE_DIR is not - set VINTAGE_STORE_DIR to the vintage '
+                     'store to read the release from')
+
+# year of ONS mid-year population estimates to use, from files named '<year>_England_pop.csv' and
+# '<year>_pop_by_region.csv'. unset to use the latest year available
+POPULATION_YEAR = os.environ.get('POPULATION_YEAR')
+
+# folder holding the population files, eg synthetic ones matching synthetic areas
+POPULATION_DIR = os.environ.get('POPULATION_DIR', '.')
+
+# bulk export of the computed series at /api/v1/series/<series>, streamed in chunks of this many rows. off unless
+# set, as anyone who can reach the app can ask it for series for every region
+EXPORT_API = env_flag('EXPORT_API')
+EXPORT_CHUNK_ROWS = env_int('EXPORT_CHUNK_ROWS', 50000)
+
+# bootstrap replicates for the growth rate confidence bands on tab 1. at or above BOOTSTRAP_POOL_REPLICATES the
+# replicates are split across a process pool of BOOTSTRAP_WORKERS processes
+BOOTSTRAP_REPLICATES = env_int('BOOTSTRAP_REPLICATES', 200)
+BOOTSTRAP_POOL_REPLICATES = env_int('BOOTSTRAP_POOL_REPLICATES', 2000)
+BOOTSTRAP_WORKERS = env_int('BOOTSTRAP_WORKERS', 2)
+
+# reproduction number (Rt) on tab 1 - generation interval as a gamma distribution with this mean and standard
+# deviation in days, cut off after RT_GI_MAX_DAYS, cases summed over windows of RT_WINDOW days, and no estimate
+# shown for windows with fewer than RT_MIN_CASES cases
+RT_GI_MEAN = env_float('RT_GI_MEAN', 5.0)
+RT_GI_SD = env_float('RT_GI_SD', 1.9)
+RT_GI_MAX_DAYS = env_int('RT_GI_MAX_DAYS', 21)
+RT_WINDOW = env_int('RT_WINDOW', 7)
+RT_MIN_CASES = env_int('RT_MIN_CASES', 10)
+
+# callback metrics at /metrics and Server-Timing headers on callback responses
+CALLBACK_METRICS = env_flag('CALLBACK_METRICS', True)
+
+# number of callback results kept in each callback's result cache
+RESULT_CACHE_SIZE = env_int('RESULT_CACHE_SIZE', 128)
+
+# coalesce concurrent calls of the heavy callbacks with identical inputs, so only one computes. with a folder
+# set, calls are also coalesced across gunicorn workers through lock files, and results shared for a number of
+# seconds
+SINGLE_FLIGHT = env_flag('SINGLE_FLIGHT', True)
+SINGLE_FLIGHT_DIR = os.environ.get('SINGLE_FLIGHT_DIR')
+SINGLE_FLIGHT_TTL = env_int('SINGLE_FLIGHT_TTL', 30)
+
+# background jobs for slow analyses - job status and results are kept in a folder shared by the gunicorn
+# workers, and run in a local process pool of this many processes per worker. jobs not finished within the
+# timeout are treated as failed, and the page polls for progress every JOB_POLL_MS milliseconds
+BACKGROUND_JOBS_DIR = os.environ.get('BACKGROUND_JOBS_DIR', '.jobs')
+BACKGROUND_WORKERS = env_int('BACKGROUND_WORKERS', 2)
+BACKGROUND_JOB_TIMEOUT = env_int('BACKGROUND_JOB_TIMEOUT', 600)
+JOB_POLL_MS = env_int('JOB_POLL_MS', 1000)
+
+# json lines file each startup's data preparation stage records are appended to, keeping the records of the
+# last PIPELINE_REPORT_MAX_RUNS runs. set to '' for no report
+PIPELINE_REPORT_FILE = os.environ.get('PIPELINE_REPORT_FILE', 'pipeline_report.jsonl') or None
+PIPELINE_REPORT_MAX_RUNS = env_int('PIPELINE_REPORT_MAX_RUNS', 100)
+
+# also record the memory allocated by each data preparation stage with tracemalloc, which slows the stages down.
+# the process's peak memory after each stage is always recorded
+PIPELINE_REPORT_MEMORY = env_flag('PIPELINE_REPORT_MEMORY')
+
+# serve the last data preparation report at /pipeline-report
+PIPELINE_REPORT_ENDPOINT = env_flag('PIPELINE_REPORT_ENDPOINT')
+
+# allow callback requests to be profiled. when on, requests with the PROFILE_HEADER header are run under
+# cProfile and a profile saved to PROFILE_DIR. when off, nothing is added to the request path
+PROFILE_CALLBACKS = env_flag('PROFILE_CALLBACKS')
+PROFILE_HEADER = os.environ.get('PROFILE_HEADER', 'X-Profile-Callback')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+# memory budget of the dyno in MB. memory use is compared against it (and logged) each time the data is loaded
+MEMORY_BUDGET_MB = env_int('MEMORY_BUDGET_MB', 512)
+
+# log the memory summary on every data load. otherwise it is only logged when over budget
+MEMORY_LOG = env_flag('MEMORY_LOG')
+
+# trace python allocations from startup so memory reports can list the top allocation sites. slows the app down
+MEMORY_TRACEMALLOC = env_flag('MEMORY_TRACEMALLOC')
+
+# serve the memory report at /admin/memory
+MEMORY_ENDPOINT = env_flag('MEMORY_ENDPOINT')
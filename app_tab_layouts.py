@@ -2,51 +2,120 @@
 
 # make necessary imports
 import dash
+import hashlib
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
+import tracemalloc
 from style_creator import create_div_style
 from utilities import *
 from info_boxes import *
-
-# read in Govt cases data
-cases_by_age_region = pd.read_csv("https://api.coronavirus.data.gov.uk/v2/data?areaType=region&metric=newCasesBySpecimenDateAgeDemographics&format=csv")
-
-# read in population data
-pop_by_region = pd.read_csv("2019_pop_by_region.csv")
-
-# data tidying
-cases_by_age_region = clean_case_data(cases_by_age_region)
-
-# read in Govt cases data for England not split by region
-cases_by_age = pd.read_csv("https://api.coronavirus.data.gov.uk/v2/data?areaType=nation&areaCode=E92000001&metric=newCasesBySpecimenDateAgeDemographics&format=csv")
-
-# read in Govt vaccines data for England
-vaccines_by_age = pd.read_csv("https://api.coronavirus.data.gov.uk/v2/data?areaType=nation&areaCode=E92000001&metric=vaccinationsAgeDemographics&format=csv")
-
-# read in Govt hospital admissions data for England
-cum_admissions_by_age = pd.read_csv("https://api.coronavirus.data.gov.uk/v2/data?areaType=nation&areaCode=E92000001&metric=cumAdmissionsByAge&format=csv")
-
-# data tidying
-cases_per_10k = prepare_case_data(cases_by_age)
-
-vax_per_10k = prepare_vax_data(vaccines_by_age)
-
-admissions_per_10k = prepare_admissions_data(cum_admissions_by_age)
-
-# equalise end dates
-df_list = equalise_end_dates(cases_per_10k, vax_per_10k, admissions_per_10k)
-cases_per_10k = df_list[0].copy()
-vax_per_10k = df_list[1].copy()
-admissions_per_10k = df_list[2].copy()
+from app_config import INCREMENTAL_INGEST, VINTAGE_STORE_DIR, AS_OF_RELEASE, MEMORY_TRACEMALLOC, JOB_POLL_MS
+from data_sources import read_source
+from incremental_ingest import IncrementalIngestor
+from vintage_store import VintageStore
+from population import population_registry
+from panel import TimeSeriesPanel
+from analysis_engine import CaseCube
+from smoothing import FILTERS
+from pipeline_report import PipelineRunner
+from memory_report import register_dataset, log_memory_report
+from trace_updates import update_stores
+
+# graphs updated a trace at a time, through update stores merged into the figure in the browser
+INCREMENTAL_GRAPHS = ['cases_per_10,000_by_age_group', 'daily_growth_rate_by_age_group',
+                      'reproduction_number_by_age_group', 'cumulative_vax_ppn']
+
+# trace allocations from the start, so memory reports can show where memory was allocated
+if MEMORY_TRACEMALLOC:
+    tracemalloc.start()
+
+# load population data once, for use by every pipeline
+population = population_registry()
+
+# choose where raw data is read from - a past release in the vintage store, the latest data (recording it as
+# today's release if there is a vintage store), or just the latest data
+if AS_OF_RELEASE:
+    read_source = VintageStore(VINTAGE_STORE_DIR).as_of_reader(AS_OF_RELEASE)
+elif VINTAGE_STORE_DIR:
+    read_source = VintageStore(VINTAGE_STORE_DIR).recording_reader()
+
+# time each stage of data preparation, for the pipeline report
+runner = PipelineRunner()
+
+if INCREMENTAL_INGEST and not AS_OF_RELEASE:
+    # restore last prepared data and only read and prepare dates since the last ingest
+    ingestor = IncrementalIngestor.load(reader=read_source, runner=runner)
+    ingestor.refresh()
+    cases_by_age_region = ingestor.frames['cases_by_age_region']
+    cases_per_10k = ingestor.frames['cases_per_10k']
+    vax_per_10k = ingestor.frames['vax_per_10k']
+    admissions_per_10k = ingestor.frames['admissions_per_10k']
+
+else:
+    # read in Govt cases data
+    cases_by_age_region = runner.read('cases_by_age_region', read_source)
+
+    # data tidying
+    cases_by_age_region = runner.run('clean_case_data', clean_case_data, cases_by_age_region)
+
+    # read in Govt cases data for England not split by region
+    cases_by_age = runner.read('cases_by_age', read_source)
+
+    # read in Govt vaccines data for England
+    vaccines_by_age = runner.read('vaccines_by_age', read_source)
+
+    # read in Govt hospital admissions data for England
+    cum_admissions_by_age = runner.read('cum_admissions_by_age', read_source)
+
+    # data tidying
+    cases_per_10k = runner.run('prepare_case_data', prepare_case_data, cases_by_age)
+
+    vax_per_10k = runner.run('prepare_vax_data', prepare_vax_data, vaccines_by_age)
+
+    admissions_per_10k = runner.run('prepare_admissions_data', prepare_admissions_data, cum_admissions_by_age)
+
+# equalise end dates and hold all national data in one aligned, read-only panel for the callbacks to take
+# views of
+df_list = runner.run('equalise_end_dates', equalise_end_dates, cases_per_10k, vax_per_10k, admissions_per_10k)
+panel = runner.run('build panel', TimeSeriesPanel.from_prepared, *df_list)
+
+# the same series aggregated to ISO weeks, for the weekly resolution on tabs 2 and 3. kept with the panel
+runner.run('build weekly panel', panel.at_resolution, 'weekly')
+
+# hold regional cases as a date x region x age band cube, for the engine to group by any age bins
+cube = runner.run('build case cube', CaseCube.from_cases, cases_by_age_region)
+
+# version of the data loaded, from its contents. things derived from the data and kept outside this process (eg
+# the trace uids held by the browser) include it, so they are not reused after a redeploy with new or revised data
+data_version = hashlib.blake2b(panel.data.tobytes() + cube.cases.tobytes(), digest_size=8).hexdigest()
+
+runner.write_report()
+
+# report memory held by each resident dataset, and log it against the memory budget
+register_dataset('cases_by_age_region', lambda: cases_by_age_region)
+# the weekly panel is registered first, so it is reported on its own rather than as part of the panel
+register_dataset('weekly panel', lambda: panel.weekly_panel)
+register_dataset('panel', lambda: panel)
+register_dataset('case cube', lambda: cube)
+register_dataset('prepared frames', lambda: df_list)
+register_dataset('population', lambda: population)
+register_dataset('raw national downloads', lambda: [globals().get(name) for name in
+                                                    ['cases_by_age', 'vaccines_by_age', 'cum_admissions_by_age']])
+if INCREMENTAL_INGEST and not AS_OF_RELEASE:
+    register_dataset('incremental ingest state', lambda: ingestor.frames)
+log_memory_report()
 
 # create list of region names
 region_names = cases_by_age_region['areaName'].unique().tolist()
 region_names.append('England')
 
+# region dropdown option showing every region side by side
+ALL_REGIONS = 'All regions'
+
 # create list of monthly date labels for starting date up to and including last available equalised dates
 start_date = pd.to_datetime("2020-08-01")
-end_date = cases_per_10k.index[-1]
+end_date = panel.index[-1]
 dates = get_month_starts(start_date, end_date)
 dates.append(end_date)
 
@@ -78,11 +147,22 @@ tab1_layout = html.Div([
                 # dropdown for choosing Region
                 dcc.Dropdown(
                     id='Region',
-                    options=[{'label': i, 'value': i} for i in region_names],
+                    options=[{'label': i, 'value': i} for i in region_names + [ALL_REGIONS]],
                     value='England',
                     style=create_div_style(mb=5, mr=10, w='90%', fs=16)
                 ),
 
+                # radio items for crude or age standardised rates, standardised to the England population within
+                # each age group so regions with different age structures can be compared
+                dcc.RadioItems(
+                    id='rate_type',
+                    options=[
+                        {'label': 'crude rates', 'value': 'crude'},
+                        {'label': 'age-standardised rates', 'value': 'standardised'}
+                    ],
+                    value='crude',
+                    style=create_div_style(mb=5, fs=16)),
+
                 # first create a div box for it as it seems to be the only way to set margins for it
                 html.Div([
                     # label for RangeSlider
@@ -112,7 +192,8 @@ tab1_layout = html.Div([
                                style=create_div_style(fs=18)),
 
                     dcc.Markdown('''
-                    Daily case numbers are averaged over the *previous* n days''',
+                    Daily case numbers are averaged over the *previous* n days, or smoothed over n days with
+                    one of the other filters''',
                                  style=create_div_style(fs=14)),
 
                     html.Div([
@@ -125,7 +206,14 @@ tab1_layout = html.Div([
                         marks={i*7: f'{str(i)} weeks' for i in range(1, 4)},
                         value=7
                     )
-                    ], style=create_div_style(mb=5))
+                    ], style=create_div_style(mb=5)),
+
+                    # radio items for the smoothing filter applied over the window
+                    dcc.RadioItems(
+                        id='smoothing',
+                        options=[{'label': label, 'value': value} for value, label in FILTERS.items()],
+                        value='trailing',
+                        style=create_div_style(mb=5, fs=16))
                 ]),
 
                 html.Div([
@@ -172,6 +260,27 @@ tab1_layout = html.Div([
                     ], style=create_div_style(mb=5))
                 ]),
 
+                html.Div([
+                    # label for radio items
+                    html.Label('Show growth rate uncertainty',
+                               style=create_div_style(fs=18)),
+
+                    dcc.Markdown('''
+                    95% bands from resampling the daily case counts, either as poisson counts or in blocks of a
+                    week. Shown for a single region''',
+                                 style=create_div_style(fs=14)),
+
+                    dcc.RadioItems(
+                        id='growth_bands',
+                        options=[
+                            {'label': 'none', 'value': 'none'},
+                            {'label': 'poisson bootstrap', 'value': 'poisson'},
+                            {'label': 'block bootstrap', 'value': 'block'}
+                        ],
+                        value='none',
+                        style=create_div_style(mb=5, fs=16))
+                ]),
+
                 html.Div([
                     # label for checklist
                     html.Label('Choose age group dividers',
@@ -251,7 +360,11 @@ tab1_layout = html.Div([
                 html.Div([
 
                     dcc.Graph(id='cases_per_10,000_by_age_group'),
-                    dcc.Graph(id='daily_growth_rate_by_age_group')
+                    dcc.Graph(id='daily_growth_rate_by_age_group'),
+                    dcc.Graph(id='reproduction_number_by_age_group'),
+                    *update_stores('cases_per_10,000_by_age_group'),
+                    *update_stores('daily_growth_rate_by_age_group'),
+                    *update_stores('reproduction_number_by_age_group')
                     ], style=create_div_style())
             ], style=create_div_style(w='66%')),
         ])
@@ -325,6 +438,21 @@ tab2_layout = html.Div([
             ], style=create_div_style(mb=20))
         ]),
 
+        html.Div([
+            # label for radio items
+            html.Label('Choose time resolution',
+                       style=create_div_style(fs=18)),
+
+            dcc.RadioItems(
+                id='resolution',
+                options=[
+                    {'label': 'daily', 'value': 'daily'},
+                    {'label': 'weekly (windows and lags rounded to whole weeks)', 'value': 'weekly'}
+                ],
+                value='daily'),
+
+        ], style=create_div_style(mb=20)),
+
         html.Div([
             # label for checklist
             html.Label('Choose age groups',
@@ -366,7 +494,8 @@ tab2_layout = html.Div([
         # graphs
         html.Div([
             dcc.Graph(id='cumulative_vax_ppn'),
-            dcc.Graph(id='compare_ratio')
+            dcc.Graph(id='compare_ratio'),
+            *update_stores('cumulative_vax_ppn')
             ], style=create_div_style())
     ], style=create_div_style(w='66%', borderl='black solid 1px'))
 ])
@@ -440,6 +569,21 @@ tab3_layout = html.Div([
             ], style=create_div_style(mb=20))
         ]),
 
+        html.Div([
+            # label for radio items
+            html.Label('Choose time resolution',
+                       style=create_div_style(fs=18)),
+
+            dcc.RadioItems(
+                id='resolution',
+                options=[
+                    {'label': 'daily', 'value': 'daily'},
+                    {'label': 'weekly (windows and lags rounded to whole weeks)', 'value': 'weekly'}
+                ],
+                value='daily'),
+
+        ], style=create_div_style(mb=20)),
+
         html.Div([
             # label for checklist
             html.Label('Choose age group',
@@ -510,6 +654,15 @@ tab3_layout = html.Div([
                 dcc.Graph(id='admission-case-overlay')
                 # set width of Div box to 49% and push to RHS
                 ], style=create_div_style(w='49%', display='inline-block', float='right'))
-            ])
+            ]),
+
+        # lag sweep - run as a background job, polling for progress until it is done
+        html.Div([
+            html.Button('Run lag sweep', id='lag-sweep-run', n_clicks=0),
+            html.Label(id='lag-sweep-progress', style=create_div_style(fs=16, ml=10, w='60%', display='inline-block')),
+            dcc.Graph(id='lag-sweep'),
+            dcc.Store(id='lag-sweep-job'),
+            dcc.Interval(id='lag-sweep-poll', interval=JOB_POLL_MS, disabled=True)
+        ], style=create_div_style(bordert='solid black 1px'))
         ], style=create_div_style(w='66%', borderl='black solid 1px'))
 ])
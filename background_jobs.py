@@ -0,0 +1,221 @@
+# background jobs for analyses too slow to run inside a callback request. a job runs in a local process pool,
+# reporting its progress to a job store on disk, while the page polls a cheap callback for progress and picks
+# up the result when done. the store is a folder shared by the gunicorn workers, so any worker can answer a
+# poll, and a job's id comes from its inputs and the data version, so asking again for a job queued or running
+# picks up that job. finished results go into the result cache, so repeat requests are served straight away. no
+# broker needed
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from app_config import BACKGROUND_JOBS_DIR, BACKGROUND_WORKERS, BACKGROUND_JOB_TIMEOUT, RESULT_CACHE_SIZE
+from result_cache import ResultCache, caches, cache_key
+
+
+# seconds finished jobs are kept in the store
+KEEP_FINISHED_SECONDS = 24 * 60 * 60
+
+
+class JobStore:
+    """
+    status (json) and result (pickle) of each job, kept as files in a folder
+    """
+
+    def __init__(self, root=BACKGROUND_JOBS_DIR):
+        """
+        :param root: Str - folder to keep jobs in
+        """
+        self.root = root
+
+    def path(self, job_id, extension):
+        return os.path.join(self.root, f'{job_id}.{extension}')
+
+    def write_atomic(self, path, data):
+        # write then rename, so readers in other processes never see a partly written file
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def status(self, job_id):
+        """
+        :return: Dict - status of the job, or None if there is no such job
+        """
+        try:
+            with open(self.path(job_id, 'json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id, **fields):
+        """
+        update fields of a job's status, creating it if needed
+        :return: Dict - the new status
+        """
+        status = self.status(job_id) or {'id': job_id}
+        status.update(fields, updated=time.time())
+        self.write_atomic(self.path(job_id, 'json'), json.dumps(status).encode())
+
+        return status
+
+    def write_result(self, job_id, result):
+        self.write_atomic(self.path(job_id, 'pkl'), pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def result(self, job_id):
+        with open(self.path(job_id, 'pkl'), 'rb') as f:
+            return pickle.load(f)
+
+    def remove_finished(self, older_than=KEEP_FINISHED_SECONDS):
+        """
+        delete jobs which finished more than older_than seconds ago
+        """
+        if not os.path.isdir(self.root):
+            return
+
+        now = time.time()
+        for entry in os.scandir(self.root):
+            if not entry.name.endswith('.json'):
+                continue
+            job_id = entry.name[:-len('.json')]
+            status = self.status(job_id)
+            if status is not None and now - status.get('finished', now) > older_than:
+                for extension in ['json', 'pkl']:
+                    try:
+                        os.remove(self.path(job_id, extension))
+                    except OSError:
+                        pass
+
+
+def run_job(root, job_id, func, args):
+    """
+    run a job in a pool process, recording its progress, result or error in the job store
+    :param root: Str - job store folder
+    :param job_id: Str - id of the job
+    :param func: function - the analysis. called as func(*args, progress=progress), where progress(fraction,
+    message) can be called to report progress. must be importable by name, to be sent to the pool
+    :param args: Tuple - inputs of the analysis
+    """
+    store = JobStore(root)
+    store.update(job_id, status='running', pid=os.getpid(), started=time.time())
+
+    def progress(fraction, message=''):
+        store.update(job_id, progress=round(fraction, 4), message=message)
+
+    try:
+        result = func(*args, progress=progress)
+    except Exception as error:
+        store.update(job_id, status='failed', error=repr(error), finished=time.time())
+        return
+
+    store.write_result(job_id, result)
+    store.update(job_id, status='done', progress=1.0, message='done', finished=time.time())
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+pool = None
+pool_lock = threading.Lock()
+
+
+def job_pool():
+    """
+    :return: ProcessPoolExecutor - this process's job pool, created on first use
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=BACKGROUND_WORKERS)
+
+    return pool
+
+
+class BackgroundTask:
+    """
+    an analysis run as background jobs, one per distinct set of inputs, with finished results kept in a result
+    cache under the task name
+    """
+
+    def __init__(self, name, func, store=None, timeout=BACKGROUND_JOB_TIMEOUT, version=None):
+        """
+        :param name: Str - task name, used for the result cache and job ids
+        :param func: function - the analysis. see run_job
+        :param store: JobStore - where jobs are kept. defaults to a store in BACKGROUND_JOBS_DIR
+        :param timeout: Int - seconds after which an unfinished job is treated as failed
+        :param version: Str - version of the data the analysis runs on. part of every job id, so jobs finished
+        against earlier data, which outlive a restart in the store, are not picked up again
+        """
+        self.name = name
+        self.func = func
+        self.version = version
+        self.store = store if store is not None else JobStore()
+        self.timeout = timeout
+        self.cache = caches.setdefault(name, ResultCache(RESULT_CACHE_SIZE))
+
+    def job_id(self, *args):
+        return hashlib.sha1(f'{self.name}:{self.version}:{cache_key(*args)}'.encode()).hexdigest()[:20]
+
+    def cached_result(self, *args):
+        """
+        :return: 2-tuple - (True, result) if the result for these inputs is in the result cache, else (False, None)
+        """
+        return self.cache.get(cache_key(*args))
+
+    def submit(self, *args):
+        """
+        start a job for a set of inputs, unless one is already queued, running or done
+        :return: Str - job id
+        """
+        job_id = self.job_id(*args)
+        status = self.status(job_id)
+        if status is not None and status['status'] in ('queued', 'running', 'done'):
+            return job_id
+
+        self.store.remove_finished()
+        self.store.update(job_id, name=self.name, status='queued', progress=0.0, message='queued',
+                          created=time.time(), pid=None, error=None)
+        job_pool().submit(run_job, self.store.root, job_id, self.func, args)
+
+        return job_id
+
+    def status(self, job_id):
+        """
+        :return: Dict - status of the job, with 'status' one of 'queued', 'running', 'done' or 'failed', progress
+        from 0 to 1 and a message. jobs whose process has died or which have run over the timeout are failed
+        """
+        status = self.store.status(job_id)
+        if status is None or status['status'] in ('done', 'failed'):
+            return status
+
+        if status['status'] == 'running' and status.get('pid') and not process_alive(status['pid']):
+            return self.store.update(job_id, status='failed', error='job process exited', finished=time.time())
+        if time.time() - status['created'] > self.timeout:
+            return self.store.update(job_id, status='failed', error='timed out', finished=time.time())
+
+        return status
+
+    def collect(self, job_id, *args):
+        """
+        load the result of a finished job, and put it in the result cache
+        :param job_id: Str - id of a finished job
+        :param args: the job's inputs, to cache the result by
+        :return: the job's result
+        """
+        result = self.store.result(job_id)
+        self.cache.put(cache_key(*args), result)
+
+        return result
@@ -0,0 +1,304 @@
+# benchmark suite for the data utilities and every dash callback, run offline against synthetic data shaped
+# like the api downloads. reports p50 / p95 times and peak memory per case, and saves results as json so two
+# runs can be compared:
+#
+#   python benchmarks.py run [--repeat 20] [--days 500] [--areas 50] [--filter update_graphs1] [--output out.json]
+#   python benchmarks.py compare old.json new.json [--threshold 0.1]
+
+import argparse
+import datetime
+import glob
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+
+# where results are saved unless an output file is given
+RESULTS_DIR = 'benchmark_results'
+
+
+def time_case(func, setup, repeat):
+    """
+    time a function, and measure its peak memory in one further (traced) run
+    :param func: function - the code being benchmarked
+    :param setup: function - returns the args tuple for func. called before each run, and not timed
+    :param repeat: Int - number of timed runs
+    :return: Dict - p50, p95, mean and min time in seconds, number of runs and peak memory in bytes
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    func(*args)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times = np.array(times)
+
+    return {'p50': float(np.percentile(times, 50)),
+            'p95': float(np.percentile(times, 95)),
+            'mean': float(times.mean()),
+            'min': float(times.min()),
+            'runs': repeat,
+            'peak_memory_bytes': int(peak_memory)}
+
+
+def utility_cases(app_module, raw):
+    """
+    :param app_module: module - the loaded covid_analysis_app
+    :param raw: Dict - raw source name -> DataFrame, as read from the synthetic data
+    :return: List - of (case name, function, setup function) for the functions in utilities.py
+    """
+    import utilities
+
+    panel = app_module.panel
+    cases_by_age_region = app_module.cases_by_age_region
+    start_date = app_module.dates[3]
+    end_date = app_module.dates[-1]
+
+    cases = [
+        ('utilities.clean_case_data', utilities.clean_case_data,
+         lambda: (raw['cases_by_age_region'].copy(),)),
+        ('utilities.prepare_case_data', utilities.prepare_case_data, lambda: (raw['cases_by_age'].copy(),)),
+        ('utilities.prepare_vax_data', utilities.prepare_vax_data, lambda: (raw['vaccines_by_age'].copy(),)),
+        ('utilities.prepare_admissions_data', utilities.prepare_admissions_data,
+         lambda: (raw['cum_admissions_by_age'].copy(),)),
+    ]
+
+    for bins in [[20, 40, 60], [5 * i for i in range(1, 19)]]:
+        cases.append((f'utilities.bin_ages_from_list bins={len(bins)}', utilities.bin_ages_from_list,
+                      lambda bins=bins: (cases_by_age_region.copy(), bins)))
+        for region in ['England', app_module.region_names[0]]:
+            cases.append((f'utilities.get_region_pop {region} bins={len(bins)}', utilities.get_region_pop,
+                          lambda region=region, bins=bins: (region, bins)))
+
+    for rolling in [7, 21]:
+        cases.append((f'utilities.get_ratio rolling={rolling}', utilities.get_ratio,
+                      lambda rolling=rolling: (panel.frame('admissions').shift(-7), panel.frame('cases'),
+                                               start_date, rolling)))
+        cases.append((f'utilities.get_rolling_total rolling={rolling}', utilities.get_rolling_total,
+                      lambda rolling=rolling: (panel.frame('cases', ['65-84 yrs']), start_date, end_date, rolling)))
+
+    return cases
+
+
+def callback_cases(app_module):
+    """
+    :param app_module: module - the loaded covid_analysis_app
+    :return: List - of (case name, function, setup function) sweeping each callback over representative inputs
+    """
+    last = len(app_module.dates) - 1
+    regions = ['England'] + app_module.region_names[:2]
+    bin_sets = {'default': ([20], [40], [60], [], []),
+                'none': ([], [], [], [], []),
+                'all': ([5, 10, 15, 20], [25, 30, 35, 40], [45, 50, 55, 60], [65, 70, 75, 80], [85, 90])}
+    age_gp_sets = [['65-84 yrs'], ['0-17 yrs', '18-64 yrs', '65-84 yrs', '85+ yrs']]
+
+    def callback(name):
+        return getattr(app_module, name).__wrapped__
+
+    cases = []
+    for region, (bins_name, bins), start, rolling, growth_length, growth_avge in itertools.product(
+            regions, bin_sets.items(), [0, last - 1], [7, 21], [7, 42], [1, 10]):
+        args = (region, start, rolling, growth_length, growth_avge) + bins
+        cases.append((f'update_graphs1 {region} bins={bins_name} start={start} rolling={rolling} '
+                      f'growth={growth_length}/{growth_avge}', callback('update_graphs1'), lambda args=args: args))
+
+    for region, (bins_name, bins), rate_type in itertools.product(
+            [regions[0], app_module.ALL_REGIONS], bin_sets.items(), ['crude', 'standardised']):
+        args = (region, 0, 7, 21, 5) + bins + (rate_type,)
+        cases.append((f'update_graphs1 {region} bins={bins_name} rates={rate_type}', callback('update_graphs1'),
+                      lambda args=args: args))
+
+    for region, (bins_name, bins), start in itertools.product(
+            regions + [app_module.ALL_REGIONS], bin_sets.items(), [0, last - 1]):
+        args = (region, start) + bins
+        cases.append((f'update_graph1_3 {region} bins={bins_name} start={start}', callback('update_graph1_3'),
+                      lambda args=args: args))
+
+    for start, age_gps in itertools.product([0, last - 1], age_gp_sets):
+        cases.append((f'update_graph2_1 start={start} groups={len(age_gps)}', callback('update_graph2_1'),
+                      lambda args=(start, age_gps): args))
+
+    for start, rolling, offset, age_gps in itertools.product([0, last - 1], [7, 21], [1, 15], age_gp_sets):
+        cases.append((f'update_graph2_2 start={start} rolling={rolling} offset={offset} groups={len(age_gps)}',
+                      callback('update_graph2_2'), lambda args=(start, rolling, offset, age_gps): args))
+
+    for date_range, rolling, lag, age_gp, colour in itertools.product(
+            [[0, last], [last - 2, last]], [7, 21], [1, 15], ['18-64 yrs', '85+ yrs'], ['date', 'dose1']):
+        cases.append((f'update_graphs3 range={date_range} rolling={rolling} lag={lag} group={age_gp} '
+                      f'colour={colour}', callback('update_graphs3'),
+                      lambda args=(date_range, rolling, lag, age_gp, colour): args))
+
+    # weekly resolution of tabs 2 and 3
+    for start, age_gps in itertools.product([0, last - 1], age_gp_sets):
+        cases.append((f'update_graph2_2 weekly start={start} groups={len(age_gps)}', callback('update_graph2_2'),
+                      lambda args=(start, 14, 7, age_gps, 'weekly'): args))
+    for date_range, lag in itertools.product([[0, last], [last - 2, last]], [0, 7, 14]):
+        cases.append((f'update_graphs3 weekly range={date_range} lag={lag}', callback('update_graphs3'),
+                      lambda args=(date_range, 14, lag, '65-84 yrs', 'date', 'weekly'): args))
+
+    # trace updates on ticking one more age group, against the figures shown for the age groups before
+    from trace_updates import rendered_state
+
+    def add_group_setup(name, before, after):
+        def setup():
+            updates = callback(name)(*before)
+            updates = updates if isinstance(updates, tuple) else (updates,)
+            return after + tuple(rendered_state(update) for update in updates)
+        return setup
+
+    for region in regions[:2]:
+        cases.append((f'update_graphs1 {region} add age group', callback('update_graphs1'),
+                      add_group_setup('update_graphs1', (region, 0, 7, 21, 5, [20], [40], [60], [], []),
+                                      (region, 0, 7, 21, 5, [20], [40], [60], [70], [], 'crude', 'none', 'trailing'))))
+        cases.append((f'update_graph1_3 {region} add age group', callback('update_graph1_3'),
+                      add_group_setup('update_graph1_3', (region, 0, [20], [40], [60], [], []),
+                                      (region, 0, [20], [40], [60], [70], []))))
+    cases.append(('update_graph2_1 add age group', callback('update_graph2_1'),
+                  add_group_setup('update_graph2_1', (0, age_gp_sets[0]), (0, age_gp_sets[0] + ['85+ yrs'], 'daily'))))
+
+    return cases
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(repeat=20, days=500, seed=0, areas=None, extra_age_bands=0, name_filter=None, output=None, data_dir=None):
+    """
+    run the benchmark suite and save the results
+    :param repeat: Int - timed runs per case
+    :param days: Int - days of synthetic data
+    :param seed: Int - random seed for synthetic data
+    :param areas: Int - number of synthetic areas. None to use the real regions
+    :param extra_age_bands: Int - extra aggregate age bands in the synthetic case data
+    :param name_filter: Str - only run cases with this in their name
+    :param output: Str - json file to save results to. defaults to a timestamped file in RESULTS_DIR
+    :param data_dir: Str - folder of data files (and population files, if named as population expects) to use
+    instead of generating synthetic data
+    :return: Dict - the results
+    """
+    # data and settings must be in place before the app is imported, as it loads its data on import. the result
+    # cache is turned off so every call computes. settings are read when app_config is first imported, so they
+    # are set before importing anything from the app (including synthetic_data)
+    generate = data_dir is None
+    if generate:
+        data_dir = tempfile.mkdtemp(prefix='covid_benchmark_')
+    os.environ['COVID_DATA_DIR'] = data_dir
+    has_population = generate or glob.glob(os.path.join(data_dir, '[0-9][0-9][0-9][0-9]_pop_by_region.csv'))
+    os.environ['POPULATION_DIR'] = data_dir if has_population else '.'
+    os.environ['RESULT_CACHE_SIZE'] = '0'
+    os.environ['PIPELINE_REPORT_FILE'] = ''
+    os.environ['INCREMENTAL_INGEST'] = '0'
+
+    if generate:
+        from synthetic_data import write_synthetic_data
+        write_synthetic_data(data_dir, days=days, seed=seed, areas=areas, extra_age_bands=extra_age_bands)
+
+    import covid_analysis_app
+    from data_sources import read_source, SOURCE_URLS
+
+    raw = {name: read_source(name) for name in SOURCE_URLS}
+    cases = utility_cases(covid_analysis_app, raw) + callback_cases(covid_analysis_app)
+    if name_filter:
+        cases = [case for case in cases if name_filter in case[0]]
+
+    results = {}
+    for i, (name, func, setup) in enumerate(cases):
+        results[name] = time_case(func, setup, repeat)
+        print(f'[{i + 1}/{len(cases)}] {name}: p50 {results[name]["p50"] * 1000:.1f}ms '
+              f'p95 {results[name]["p95"] * 1000:.1f}ms peak {results[name]["peak_memory_bytes"] / 2 ** 20:.1f}MB')
+
+    report = {'timestamp': datetime.datetime.utcnow().isoformat(timespec='seconds'),
+              'git_revision': git_revision(),
+              'settings': {'repeat': repeat, 'days': days, 'seed': seed, 'areas': areas,
+                           'extra_age_bands': extra_age_bands, 'data_dir': data_dir},
+              'results': results}
+
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f'{report["timestamp"].replace(":", "")}_{report["git_revision"]}.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f'results saved to {output}')
+
+    return report
+
+
+def compare(old_file, new_file, threshold=0.1):
+    """
+    print a comparison of two saved benchmark runs, flagging cases whose p50 changed by more than threshold
+    :param old_file: Str - json results of the baseline run
+    :param new_file: Str - json results of the run to compare
+    :param threshold: Float - relative p50 change to flag as a regression or improvement
+    :return: List - names of cases which regressed
+    """
+    with open(old_file) as f:
+        old = json.load(f)['results']
+    with open(new_file) as f:
+        new = json.load(f)['results']
+
+    regressions = []
+    print(f'{"case":<100} {"old p50":>9} {"new p50":>9} {"change":>8} {"old p95":>9} {"new p95":>9} '
+          f'{"peak MB":>8}')
+    for name in sorted(set(old) & set(new)):
+        change = new[name]['p50'] / old[name]['p50'] - 1
+        flag = ''
+        if change > threshold:
+            flag = ' REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = ' improved'
+        print(f'{name[:100]:<100} {old[name]["p50"] * 1000:>7.1f}ms {new[name]["p50"] * 1000:>7.1f}ms '
+              f'{change:>+8.1%} {old[name]["p95"] * 1000:>7.1f}ms {new[name]["p95"] * 1000:>7.1f}ms '
+              f'{new[name]["peak_memory_bytes"] / 2 ** 20:>8.1f}{flag}')
+
+    for name in sorted(set(old) ^ set(new)):
+        print(f'{name[:100]:<100} only in {"old" if name in old else "new"} run')
+
+    print(f'{len(regressions)} regressions of more than {threshold:.0%}')
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark data utilities and dash callbacks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmark suite')
+    run_parser.add_argument('--repeat', type=int, default=20, help='timed runs per case')
+    run_parser.add_argument('--days', type=int, default=500, help='days of synthetic data')
+    run_parser.add_argument('--seed', type=int, default=0, help='random seed for synthetic data')
+    run_parser.add_argument('--areas', type=int, help='number of synthetic areas, instead of the real regions')
+    run_parser.add_argument('--extra-age-bands', type=int, default=0, help='extra aggregate age bands in cases')
+    run_parser.add_argument('--filter', dest='name_filter', help='only run cases with this in their name')
+    run_parser.add_argument('--output', help='json file to save results to')
+    run_parser.add_argument('--data-dir', help='folder of data files to use instead of synthetic data')
+
+    compare_parser = commands.add_parser('compare', help='compare two saved runs')
+    compare_parser.add_argument('old_file')
+    compare_parser.add_argument('new_file')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='relative p50 change to flag')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args.repeat, args.days, args.seed, args.areas, args.extra_age_bands, args.name_filter, args.output,
+            args.data_dir)
+    else:
+        sys.exit(1 if compare(args.old_file, args.new_file, args.threshold) else 0)
@@ -0,0 +1,145 @@
+# bootstrap confidence bands for the smoothed growth rates on tab 1. daily counts of a region's 5 year age bands
+# are resampled (poisson, or moving blocks of day to day noise around the weekly trend), and every replicate is
+# taken through the same smoothing filters and growth rate as the chart line in one set of array operations on
+# a replicate x date x age group array. large replicate counts are split across a process pool
+
+import concurrent.futures
+import threading
+import warnings
+import numpy as np
+import pandas as pd
+from analysis_engine import band_to_group, standardisation_weights
+from app_config import BOOTSTRAP_REPLICATES, BOOTSTRAP_POOL_REPLICATES, BOOTSTRAP_WORKERS, RESULT_CACHE_SIZE
+from result_cache import ResultCache, caches, cache_key
+from smoothing import apply_kernel
+from utilities import create_bins_labels
+
+
+METHODS = ['poisson', 'block']
+
+# days in each resampled block, and quantiles of the replicates shown as the band
+BLOCK_LENGTH = 7
+QUANTILES = (0.025, 0.975)
+
+band_cache = caches.setdefault('growth_rate_bands', ResultCache(RESULT_CACHE_SIZE))
+
+
+def growth_curves(counts, weights, rolling_avge_length, growth_rate_length, growth_rate_average_length,
+                  smoothing='trailing'):
+    """
+    smoothed growth rates of every replicate, as in case_rates
+    :param counts: ndarray - daily cases of shape (replicates, dates, age bands)
+    :param weights: ndarray - of shape (age bands, age groups), grouping (and standardising) bands
+    :param smoothing: Str - filter applied to cases, one of smoothing.FILTERS
+    :return: ndarray - growth rates of shape (replicates, dates, age groups)
+    """
+    rolling = apply_kernel(counts @ weights, smoothing, rolling_avge_length, axis=1)
+
+    growth = np.full(rolling.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth[:, growth_rate_length:] = ((rolling[:, growth_rate_length:] / rolling[:, :-growth_rate_length])
+                                          ** (1 / growth_rate_length) - 1)
+
+    return apply_kernel(growth, 'centered', growth_rate_average_length, axis=1)
+
+
+def resample(counts, method, replicates, rng):
+    """
+    :param counts: ndarray - daily cases of shape (dates, age bands)
+    :param method: Str - 'poisson' or 'block'
+    :return: ndarray - resampled cases of shape (replicates, dates, age bands)
+    """
+    if method == 'poisson':
+        return rng.poisson(counts, size=(replicates,) + counts.shape).astype('float64')
+
+    # moving block bootstrap of the ratio of each day to its centred weekly average, so the trend is kept and
+    # day of week effects and runs of noise are resampled together
+    trend = apply_kernel(counts, 'centered', BLOCK_LENGTH)
+    noise = np.ones(counts.shape)
+    np.divide(counts, trend, out=noise, where=trend > 0)
+
+    dates = counts.shape[0]
+    n_blocks = -(-dates // BLOCK_LENGTH)
+    starts = rng.integers(0, max(dates - BLOCK_LENGTH, 0) + 1, size=(replicates, n_blocks))
+    days = (starts[:, :, None] + np.arange(BLOCK_LENGTH)).reshape(replicates, -1)[:, :dates]
+    days = np.minimum(days, dates - 1)
+
+    return np.where(trend > 0, trend, counts)[None] * noise[days]
+
+
+def replicate_growth(counts, weights, method, replicates, seed, params):
+    """
+    resample and compute growth rates for a number of replicates. runs in the calling process or a pool process
+    :param seed: SeedSequence or Int - seed for this set of replicates
+    :param params: Tuple - (rolling_avge_length, growth_rate_length, growth_rate_average_length, smoothing)
+    :return: ndarray - growth rates of shape (replicates, dates, age groups)
+    """
+    rng = np.random.default_rng(seed)
+
+    return growth_curves(resample(counts, method, replicates, rng), weights, *params)
+
+
+pool = None
+pool_lock = threading.Lock()
+
+
+def bootstrap_pool():
+    """
+    :return: ProcessPoolExecutor - this process's bootstrap pool, created on first use
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=BOOTSTRAP_WORKERS)
+
+    return pool
+
+
+def growth_rate_bands(cube, region, age_bins_list, rolling_avge_length=7, growth_rate_length=21,
+                      growth_rate_average_length=5, standardised=False, method='poisson',
+                      replicates=BOOTSTRAP_REPLICATES, seed=0, smoothing='trailing'):
+    """
+    bootstrap confidence band of the smoothed daily growth rate of each age group in a region. results are
+    cached by input
+    :param cube: CaseCube
+    :param region: Str - region name, or 'England' for the sum of all regions
+    :param age_bins_list: List - age group edges, excluding 0
+    :param standardised: Boolean - if True, bands are for age standardised rates as in case_rates
+    :param method: Str - 'poisson' or 'block'
+    :param replicates: Int - number of bootstrap replicates
+    :param seed: Int - random seed, so a band is the same each time it is computed
+    :param smoothing: Str - filter applied to cases, one of smoothing.FILTERS
+    :return: 2 DataFrames - lower and upper bounds, datetime index and a column per age group
+    """
+    key = cache_key(region, sorted(age_bins_list), rolling_avge_length, growth_rate_length,
+                    growth_rate_average_length, standardised, method, replicates, seed, smoothing)
+    hit, bands = band_cache.get(key)
+    if hit:
+        return bands
+
+    bins, bin_labels = create_bins_labels(age_bins_list)
+    counts = cube.select(cube.cases, [region])[:, 0]
+    weights = standardisation_weights([region], bins)[0] if standardised else band_to_group(bins)
+    params = (rolling_avge_length, growth_rate_length, growth_rate_average_length, smoothing)
+
+    if replicates >= BOOTSTRAP_POOL_REPLICATES and BOOTSTRAP_WORKERS > 1:
+        # split replicates across the pool, each share with its own independent random stream
+        shares = np.array_split(np.arange(replicates), BOOTSTRAP_WORKERS)
+        seeds = np.random.SeedSequence(seed).spawn(len(shares))
+        futures = [bootstrap_pool().submit(replicate_growth, counts, weights, method, len(share), share_seed,
+                                           params)
+                   for share, share_seed in zip(shares, seeds)]
+        growth = np.concatenate([future.result() for future in futures])
+    else:
+        growth = replicate_growth(counts, weights, method, replicates, seed, params)
+
+    # replicates with no cases at the start of a growth period have no growth rate on those dates
+    growth[~np.isfinite(growth)] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        lower, upper = np.nanquantile(growth, QUANTILES, axis=0)
+
+    bands = tuple(pd.DataFrame(bound, index=cube.dates, columns=bin_labels) for bound in (lower, upper))
+    band_cache.put(key, bands)
+
+    return bands
@@ -2,11 +2,28 @@
 
 # make necessary imports
 import dash
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+import plotly.colors
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 import datetime
+from functools import lru_cache
 from style_creator import create_div_style, create_graph_layout
 from app_tab_layouts import *
+from app_config import CALLBACK_METRICS, PIPELINE_REPORT_ENDPOINT, PROFILE_CALLBACKS, MEMORY_ENDPOINT, EXPORT_API
+from instrumentation import instrument, mark_stage, register_metrics
+from pipeline_report import register_pipeline_report
+from profiling import register_profiler
+from memory_report import register_memory_endpoint
+from export_api import register_export_api
+from result_cache import cached
+from single_flight import coalesced
+from background_jobs import BackgroundTask
+from analysis_engine import case_rates, admission_case_ratio, reproduction_number, window_index
+from bootstrap import growth_rate_bands
+from trace_updates import (update_id, rendered_id, register_incremental_graph, trace_uid, graph_layout,
+                           figure_update, figure_parts)
 
 # create app
 
@@ -18,6 +35,26 @@ app = dash.Dash(__name__, external_stylesheets=external_stylesheets, suppress_ca
 
 server = app.server
 
+# per-callback latency and payload metrics at /metrics, and Server-Timing headers on callback responses
+if CALLBACK_METRICS:
+    register_metrics(server)
+
+# report on startup data preparation stages at /pipeline-report
+if PIPELINE_REPORT_ENDPOINT:
+    register_pipeline_report(server, runner)
+
+# profile callback requests sent with the profile header (see profiling.py)
+if PROFILE_CALLBACKS:
+    register_profiler(app)
+
+# memory used by datasets and caches at /admin/memory
+if MEMORY_ENDPOINT:
+    register_memory_endpoint(server)
+
+# serve the computed series behind the charts at /api/v1/series/<series>
+if EXPORT_API:
+    register_export_api(server, cube, panel, region_names, data_version)
+
 app.layout = html.Div([
     html.Div([
         # heading and blurb
@@ -45,9 +82,14 @@ app.layout = html.Div([
     ], style=create_div_style(fs=16))
 ])
 
+# merge trace updates into the graphs on tabs 1 and 2 in the browser
+for graph_id in INCREMENTAL_GRAPHS:
+    register_incremental_graph(app, graph_id)
+
 # set callback to choose tab
 @app.callback(Output('tabs-content', 'children'),
               Input('tabs', 'value'))
+@instrument('render_content')
 def render_content(tab):
     if tab == 'tab-0':
         return tab0_layout
@@ -59,10 +101,48 @@ def render_content(tab):
         return tab3_layout
 
 
-# set callback to populate graphs 1_1 and 1_2
+def small_multiples_figure(df, title, ytitle, cols=3):
+    """
+    grid of one small graph per region, each with a line per age group, on shared axes
+    :param df: DataFrame - datetime index, (region, age group) columns
+    :param title: Str - figure title
+    :param ytitle: Str - y-axis title, shown on the left hand column
+    :param cols: Int - graphs per row
+    :return: Figure
+    """
+    regions = df.columns.unique(level='region').tolist()
+    rows = -(-len(regions) // cols)
+    colours = plotly.colors.qualitative.Plotly
+
+    fig = make_subplots(rows=rows, cols=cols, shared_xaxes=True, shared_yaxes=True, subplot_titles=regions,
+                        vertical_spacing=0.08, horizontal_spacing=0.03)
+
+    # same colour for an age group in every region, with a single legend entry for it
+    for i, region in enumerate(regions):
+        for j, col in enumerate(df[region].columns):
+            fig.add_trace(go.Scatter(
+                x=df.index,
+                y=df[(region, col)],
+                mode='lines',
+                name=col,
+                legendgroup=col,
+                showlegend=i == 0,
+                line={'color': colours[j % len(colours)]}
+            ), row=i // cols + 1, col=i % cols + 1)
+
+    fig.update_layout(create_graph_layout(title=title, xtitle='', ytitle='', height=220 * rows + 80, margint=80))
+    fig.update_layout(legend={'orientation': 'h', 'yanchor': 'bottom', 'y': 1.04, 'xanchor': 'left', 'x': 0})
+    fig.update_xaxes(gridcolor='lightgrey')
+    fig.update_yaxes(gridcolor='lightgrey')
+    fig.update_yaxes(title_text=ytitle, col=1)
+
+    return fig
+
+
+# set callback to populate graphs 1_1 and 1_2, a trace at a time (see trace_updates.py)
 @app.callback(
-    [Output('cases_per_10,000_by_age_group', 'figure'),
-     Output('daily_growth_rate_by_age_group', 'figure')],
+    [Output(update_id('cases_per_10,000_by_age_group'), 'data'),
+     Output(update_id('daily_growth_rate_by_age_group'), 'data')],
     [Input('Region', 'value'),
      Input('start_date', 'value'),
      Input('rolling_avge_length', 'value'),
@@ -72,125 +152,292 @@ def render_content(tab):
      Input('age_bins_list2', 'value'),
      Input('age_bins_list3', 'value'),
      Input('age_bins_list4', 'value'),
-     Input('age_bins_list5', 'value')])
+     Input('age_bins_list5', 'value'),
+     Input('rate_type', 'value'),
+     Input('growth_bands', 'value'),
+     Input('smoothing', 'value')],
+    [State(rendered_id('cases_per_10,000_by_age_group'), 'data'),
+     State(rendered_id('daily_growth_rate_by_age_group'), 'data')])
+@instrument('update_graphs1')
+@cached('update_graphs1')
+@coalesced('update_graphs1', version=data_version)
 def update_graphs1(Region, start_date, rolling_avge_length, growth_rate_length, growth_rate_average_length,
-                  age_bins_list1, age_bins_list2, age_bins_list3, age_bins_list4, age_bins_list5):
+                  age_bins_list1, age_bins_list2, age_bins_list3, age_bins_list4, age_bins_list5, rate_type='crude',
+                  growth_bands='none', smoothing='trailing', rendered1_1=None, rendered1_2=None):
 
-    fig1_1 = go.Figure()
-    fig1_2 = go.Figure()
-
-    df = cases_by_age_region.copy()
     age_bins_list = age_bins_list1 + age_bins_list2 + age_bins_list3 + age_bins_list4 + age_bins_list5
+    _, bin_labels = create_bins_labels(age_bins_list)
 
-    # aggregate age groups
-    df = bin_ages_from_list(df, age_bins_list)
+    standardised = rate_type == 'standardised'
+    rates = 'Age-standardised daily cases' if standardised else 'Daily cases'
+    start = pd.to_datetime(dates[start_date])
 
-    # turn into required pivot
-    if Region == 'England':
-        df = df[national_groups_and_cases].groupby(by=national_groupings).sum().unstack()
-        df.columns = df.columns.droplevel()
-    else:
-        df = df[groups_and_cases].groupby(by=groupings).sum().unstack().unstack()
-        df.columns = df.columns.droplevel()
+    # cases per 10,000 and growth rates by age group from the case cube, filtered to start date - every region
+    # in one pass for the all regions view. only computed if a trace the browser doesn't have needs them
+    @lru_cache(maxsize=None)
+    def rates_data():
+        regions = cube.areas if Region == ALL_REGIONS else [Region]
+        df_per_pop, growth_rate = case_rates(cube, regions, age_bins_list, rolling_avge_length, growth_rate_length,
+                                             growth_rate_average_length, standardised, smoothing)
 
-    # filter by region
-    if Region == 'England':
-        pass
-    else:
-        df = df[Region].copy()
+        mark_stage('compute')
 
-    df_rolling = df.rolling(rolling_avge_length).mean()
+        return df_per_pop.loc[start:], growth_rate.loc[start:]
 
+    if Region == ALL_REGIONS:
+        df_per_pop, growth_rate = rates_data()
+        fig1_1 = small_multiples_figure(df_per_pop, f'{rates} per 10,000 population over time by region',
+                                        'daily cases per 10,000')
+        fig1_2 = small_multiples_figure(growth_rate, 'Smoothed daily growth rate by age over time by region',
+                                        'smoothed growth rate')
 
-    # create region population by age group
-    region_pop = pop_by_region.copy()
-    region_pop = get_region_pop(region_pop, Region, age_bins_list)
+        mark_stage('figure')
 
-    # turn df into per 10,000 population
-    df_per_pop = get_df_per_pop(df_rolling, region_pop)
+        inputs = (start_date, rolling_avge_length, growth_rate_length, growth_rate_average_length, age_bins_list,
+                  rate_type, smoothing)
+        return (figure_update(rendered1_1, *figure_parts(fig1_1, data_version, 'cases by region', *inputs)),
+                figure_update(rendered1_2, *figure_parts(fig1_2, data_version, 'growth by region', *inputs)))
 
-    # calculate growth rates
-    growth_rate = (df_rolling / df_rolling.shift(growth_rate_length)).apply(lambda x: x ** (1 / growth_rate_length) - 1)
-    growth_rate = growth_rate.rolling(growth_rate_average_length, center=True).mean()
+    # bootstrap confidence bands for the growth rates
+    show_bands = growth_bands != 'none'
 
-    # filter to start date
-    df_per_pop = df_per_pop.loc[pd.to_datetime(dates[start_date]):]
-    growth_rate = growth_rate.loc[pd.to_datetime(dates[start_date]):]
+    @lru_cache(maxsize=None)
+    def bands():
+        lower, upper = growth_rate_bands(cube, Region, age_bins_list, rolling_avge_length, growth_rate_length,
+                                         growth_rate_average_length, standardised, growth_bands,
+                                         smoothing=smoothing)
+
+        mark_stage('compute')
+
+        return lower.loc[start:], upper.loc[start:]
 
     # create traces for fig 1_1
-    for col in df_per_pop.columns:
-        fig1_1.add_trace(go.Scatter(
+    def case_trace(col):
+        df_per_pop = rates_data()[0][Region]
+        return go.Scatter(
             x=df_per_pop.index,
             y=df_per_pop[col],
             mode='lines',
             name=col
         )
-        )
 
-    # set fig1_1 layout
-    fig1_1.update_layout(create_graph_layout(title=f'Daily cases per 10,000 population over time in {Region}',
-                                           xtitle='date',
-                                           ytitle='daily cases per 10,000 population'))
+    # traces are the same for an age group whatever the other age groups are, so each is identified by the data
+    # version, the inputs it depends on and its age group
+    case_inputs = (Region, start_date, rolling_avge_length, rate_type, smoothing)
+    traces1_1 = [(trace_uid(data_version, 'cases', *case_inputs, col), lambda col=col: case_trace(col))
+                 for col in bin_labels]
 
+    # set fig1_1 layout
+    layout1_1 = (trace_uid(data_version, 'cases layout', Region, rate_type),
+                 lambda: graph_layout(create_graph_layout(title=f'{rates} per 10,000 population over time in '
+                                                                f'{Region}',
+                                                          xtitle='date',
+                                                          ytitle='daily cases per 10,000 population')))
+
+    # create traces for fig1_2 - bands are shaded between the bounds, in the colour of the age group's line,
+    # which is set by the age group's position when bands are shown
+    colours = plotly.colors.qualitative.Plotly
+
+    def band_trace(col, i, bound):
+        lower, upper = bands()
+        if bound == 'upper':
+            return go.Scatter(
+                x=upper.index,
+                y=upper[col],
+                mode='lines',
+                line={'width': 0},
+                legendgroup=col,
+                showlegend=False,
+                hoverinfo='skip'
+            )
+
+        return go.Scatter(
+            x=lower.index,
+            y=lower[col],
+            mode='lines',
+            line={'width': 0},
+            fill='tonexty',
+            fillcolor=f'rgba{plotly.colors.hex_to_rgb(colours[i % len(colours)]) + (0.2,)}',
+            legendgroup=col,
+            showlegend=False,
+            hoverinfo='skip'
+        )
 
-    # create traces for fig1_2
-    for col in growth_rate.columns:
-        fig1_2.add_trace(go.Scatter(
+    def growth_trace(col, i):
+        growth_rate = rates_data()[1][Region]
+        return go.Scatter(
             x=growth_rate.index,
             y=growth_rate[col],
             mode='lines',
-            name=col
-        )
+            name=col,
+            legendgroup=col if show_bands else None,
+            line={'color': colours[i % len(colours)]} if show_bands else None
         )
 
+    growth_inputs = (Region, start_date, rolling_avge_length, growth_rate_length, growth_rate_average_length,
+                     rate_type, smoothing, growth_bands)
+    traces1_2 = []
+    for i, col in enumerate(bin_labels):
+        position = i if show_bands else None
+        if show_bands:
+            traces1_2 += [(trace_uid(data_version, 'growth', bound, *growth_inputs, col, i),
+                           lambda col=col, i=i, bound=bound: band_trace(col, i, bound))
+                          for bound in ('upper', 'lower')]
+        traces1_2.append((trace_uid(data_version, 'growth', *growth_inputs, col, position),
+                          lambda col=col, i=i: growth_trace(col, i)))
+
     # set layout for fig1_2
-    fig1_2.update_layout(create_graph_layout(title=f'Smoothed daily growth rate by age over time in {Region}',
-                                           xtitle='date',
-                                           ytitle='smoothed growth rate'))
+    layout1_2 = (trace_uid(data_version, 'growth layout', Region),
+                 lambda: graph_layout(create_graph_layout(title=f'Smoothed daily growth rate by age over time in '
+                                                                f'{Region}',
+                                                          xtitle='date',
+                                                          ytitle='smoothed growth rate')))
+
+    update1_1 = figure_update(rendered1_1, layout1_1, traces1_1)
+    update1_2 = figure_update(rendered1_2, layout1_2, traces1_2)
+
+    mark_stage('figure')
 
-    return fig1_1, fig1_2
+    return update1_1, update1_2
 
-# set callback to populate graph2_1
+# set callback to populate graph 1_3, a trace at a time
 @app.callback(
-    Output('cumulative_vax_ppn', 'figure'),
-    [Input('start_date', 'value'),
-     Input('age_gps', 'value')])
-def update_graph2_1(start_date, age_gps):
+    Output(update_id('reproduction_number_by_age_group'), 'data'),
+    [Input('Region', 'value'),
+     Input('start_date', 'value'),
+     Input('age_bins_list1', 'value'),
+     Input('age_bins_list2', 'value'),
+     Input('age_bins_list3', 'value'),
+     Input('age_bins_list4', 'value'),
+     Input('age_bins_list5', 'value')],
+    [State(rendered_id('reproduction_number_by_age_group'), 'data')])
+@instrument('update_graph1_3')
+@cached('update_graph1_3')
+def update_graph1_3(Region, start_date, age_bins_list1, age_bins_list2, age_bins_list3, age_bins_list4,
+                    age_bins_list5, rendered=None):
 
-    fig2_1 = go.Figure()
+    age_bins_list = age_bins_list1 + age_bins_list2 + age_bins_list3 + age_bins_list4 + age_bins_list5
+    _, bin_labels = create_bins_labels(age_bins_list)
 
-    df = vax_per_10k.copy()
+    # reproduction number by age group from the case cube, for every region at once in the all regions view.
+    # only computed if a trace the browser doesn't have needs it
+    @lru_cache(maxsize=None)
+    def rt_data():
+        regions = cube.areas if Region == ALL_REGIONS else [Region]
+        rt = reproduction_number(cube, regions, age_bins_list)
 
-    # convert start_date to datetime and pad df to start_date
-    start_date = pd.to_datetime(dates[start_date])
-    df = backfill_start(df, start_date)
+        mark_stage('compute')
 
-    # create col names and traces for fig2_1
-    for col in age_gps:
-        col1 = col + ' dose1'
-        col2 = col + ' dose2'
-        fig2_1.add_trace(go.Scatter(
-            x=df.index,
-            y=df[col1],
+        return rt.loc[pd.to_datetime(dates[start_date]):]
+
+    if Region == ALL_REGIONS:
+        fig1_3 = small_multiples_figure(rt_data(), 'Reproduction number (Rt) by age over time by region', 'Rt')
+
+        mark_stage('figure')
+
+        return figure_update(rendered, *figure_parts(fig1_3, data_version, 'rt by region', start_date,
+                                                     age_bins_list))
+
+    # create traces for fig1_3
+    def rt_trace(col):
+        rt = rt_data()[Region]
+        return go.Scatter(
+            x=rt.index,
+            y=rt[col],
             mode='lines',
-            name=col1
-        )
+            name=col
         )
 
-        fig2_1.add_trace(go.Scatter(
-            x=df.index,
-            y=df[col2],
+    traces = [(trace_uid(data_version, 'rt', Region, start_date, col), lambda col=col: rt_trace(col))
+              for col in bin_labels]
+
+    # line at Rt = 1, between growth and decline, and layout for fig1_3
+    def rt_layout():
+        fig1_3 = go.Figure()
+        fig1_3.add_hline(y=1, line={'color': 'black', 'width': 1, 'dash': 'dot'})
+        fig1_3.update_layout(create_graph_layout(title=f'Reproduction number (Rt) by age over time in {Region}',
+                                               xtitle='date',
+                                               ytitle='Rt'))
+        return fig1_3.layout
+
+    update = figure_update(rendered, (trace_uid(data_version, 'rt layout', Region), rt_layout), traces)
+
+    mark_stage('figure')
+
+    return update
+
+
+def resolution_steps(resolution, days, minimum=0):
+    """
+    convert a window or lag set in days on the sliders to steps of the chosen resolution
+    :param resolution: Str - 'daily' or 'weekly'
+    :param days: Int - a window or lag in days, as set on the sliders
+    :param minimum: Int - fewest steps, eg 1 for a rolling window
+    :return: Int - the window or lag in steps of the resolution, rounded to whole weeks for weekly
+    """
+    if resolution == 'weekly':
+        return max(int(round(days / 7)), minimum)
+
+    return days
+
+
+def resolution_label(resolution, steps):
+    """
+    label a window or lag for graph titles, in the unit of the resolution
+    :param resolution: Str - 'daily' or 'weekly'
+    :param steps: Int - the window or lag in steps of the resolution, as from resolution_steps
+    :return: Str - eg '1 day' or '3 weeks'
+    """
+    unit = 'week' if resolution == 'weekly' else 'day'
+
+    return f'{steps} {unit}' + ('' if steps == 1 else 's')
+
+
+# set callback to populate graph2_1, a trace at a time
+@app.callback(
+    Output(update_id('cumulative_vax_ppn'), 'data'),
+    [Input('start_date', 'value'),
+     Input('age_gps', 'value'),
+     Input('resolution', 'value')],
+    [State(rendered_id('cumulative_vax_ppn'), 'data')])
+@instrument('update_graph2_1')
+@cached('update_graph2_1')
+def update_graph2_1(start_date, age_gps, resolution='daily', rendered=None):
+
+    # daily or weekly series
+    data = panel.at_resolution(resolution)
+
+    # convert start_date to datetime, from the start of the week it falls in for weekly series
+    start = data.period_start(pd.to_datetime(dates[start_date]))
+
+    mark_stage('compute')
+
+    # create traces for fig2_1, from views of the panel starting at start_date. only built for the age groups
+    # the browser doesn't have
+    def dose_trace(col, dose):
+        series = data.series(dose, col).loc[start:]
+        return go.Scatter(
+            x=series.index,
+            y=series,
             mode='lines',
-            name=col2
-        )
+            name=f'{col} {dose}'
         )
 
+    traces = [(trace_uid(data_version, 'doses', start_date, resolution, col, dose),
+               lambda col=col, dose=dose: dose_trace(col, dose))
+              for col in age_gps for dose in ('dose1', 'dose2')]
+
     # update layout for fig2_1
-    fig2_1.update_layout(create_graph_layout(title='Cumulative vaccinations dose 1 and dose 2',
-                                           xtitle='date',
-                                           ytitle='Vaccinate per 10,000'))
+    layout = (trace_uid(data_version, 'doses layout'),
+              lambda: graph_layout(create_graph_layout(title='Cumulative vaccinations dose 1 and dose 2',
+                                                       xtitle='date',
+                                                       ytitle='Vaccinate per 10,000')))
+
+    update = figure_update(rendered, layout, traces)
 
-    return fig2_1
+    mark_stage('figure')
+
+    return update
 
 # set callback to populate fig2_2
 @app.callback(
@@ -198,22 +445,26 @@ def update_graph2_1(start_date, age_gps):
     [Input('start_date', 'value'),
      Input('rolling_avge_length', 'value'),
      Input('offset_days', 'value'),
-     Input('age_gps', 'value')])
-def update_graph2_2(start_date, rolling_avge_length, offset_days, age_gps):
+     Input('age_gps', 'value'),
+     Input('resolution', 'value')])
+@instrument('update_graph2_2')
+@cached('update_graph2_2')
+def update_graph2_2(start_date, rolling_avge_length, offset_days, age_gps, resolution='daily'):
 
     fig2_2 = go.Figure()
 
-    # bring in admissions and cases date
-    df1 = admissions_per_10k.copy()
-    df2 = cases_per_10k.copy()
+    # daily or weekly series, with the window and offset in steps of the resolution
+    data = panel.at_resolution(resolution)
+    rolling_avge_length = resolution_steps(resolution, rolling_avge_length, minimum=1)
+    offset_days = resolution_steps(resolution, offset_days)
 
-    # shift admissions data by lag
-    df1 = df1.shift(-offset_days)
+    # turn start_date to datetime, from the start of the week it falls in for weekly series
+    start_date = data.period_start(pd.to_datetime(dates[start_date]))
 
-    # turn start_date to datetime
-    start_date = pd.to_datetime(dates[start_date])
+    # ratio of admissions to cases, with admissions shifted by the offset
+    df = admission_case_ratio(data, start_date, rolling_avge_length, offset_days)
 
-    df = get_ratio(df1, df2, start_date, rolling_avge_length)
+    mark_stage('compute')
 
     # create traces for fig2_2
     for col in age_gps:
@@ -230,6 +481,8 @@ def update_graph2_2(start_date, rolling_avge_length, offset_days, age_gps):
                                            xtitle='Date',
                                            ytitle='Admissions to cases ratio'))
 
+    mark_stage('figure')
+
     return fig2_2
 
 # set callback to populate fig3_1 to fig3_3
@@ -241,48 +494,50 @@ def update_graph2_2(start_date, rolling_avge_length, offset_days, age_gps):
      Input('rolling_avge_length', 'value'),
      Input('admission_lag', 'value'),
      Input('age_gps', 'value'),
-     Input('scatter_colour', 'value')])
-def update_graphs3(date_range, rolling_avge_length, admission_lag, age_gps, scatter_colour):
-
-    # get dfs filtered to just chose age_gps
-    df1 = admissions_per_10k[age_gps].copy()
-    df2 = cases_per_10k[age_gps].copy()
-
-    # shift admissions by chosen lag
-    df1 = df1.shift(-admission_lag)
-
-    # turn start_date and end_date to datetime
-    start_date = pd.to_datetime(dates[date_range[0]])
+     Input('scatter_colour', 'value'),
+     Input('resolution', 'value')])
+@instrument('update_graphs3')
+@cached('update_graphs3')
+@coalesced('update_graphs3', version=data_version)
+def update_graphs3(date_range, rolling_avge_length, admission_lag, age_gps, scatter_colour, resolution='daily'):
+
+    # daily or weekly series, with the window and lag in steps of the resolution
+    data = panel.at_resolution(resolution)
+    rolling_avge_length = resolution_steps(resolution, rolling_avge_length, minimum=1)
+    admission_lag = resolution_steps(resolution, admission_lag)
+    lag_label = resolution_label(resolution, admission_lag)
+
+    # turn start_date and end_date to datetime, from the start of the week start_date falls in for weekly series
+    start_date = data.period_start(pd.to_datetime(dates[date_range[0]]))
     end_date = pd.to_datetime(dates[date_range[1]])
 
-    final_admissions = get_rolling_total(df1, start_date=start_date, end_date=end_date, rolling=rolling_avge_length)
-    final_cases = get_rolling_total(df2, start_date=start_date, end_date=end_date, rolling=rolling_avge_length)
+    # rolling averages of admissions shifted by chosen lag and of cases, with prefix sums, built once per
+    # (age group, window, lag) - a date range is then a slice, and its totals lookups
+    index = window_index(data, age_gps, rolling_avge_length, admission_lag)
+    start, stop = index.positions(start_date, end_date)
+    final_admissions = index.window('admissions', start, stop)
+    final_cases = index.window('cases', start, stop)
 
     # create vaccinated per population for given age group
-    vax = vax_per_10k.copy()
-
-    # convert start_date to datetime and pad df to start_date
-    vax = backfill_start(vax, start_date)
-    vax = vax.loc[:end_date]
-    dose1_col = f'{age_gps} dose1'
-    dose2_col = f'{age_gps} dose2'
+    dose1 = data.series('dose1', age_gps).loc[start_date:end_date]
+    dose2 = data.series('dose2', age_gps).loc[start_date:end_date]
 
     # bring together all data for graphs
     graph_data = pd.DataFrame(data={'date': final_cases.index,
-                                    'cases': final_cases['total'],
-                                    'admissions': final_admissions['total'],
-                                    'dose1': vax[dose1_col],
-                                    'dose2': vax[dose2_col]})
+                                    'cases': final_cases,
+                                    'admissions': final_admissions,
+                                    'dose1': dose1,
+                                    'dose2': dose2})
 
     # add a ratio column
     graph_data['ratio'] = graph_data['admissions'] / graph_data['cases']
 
     # add a rescaled cases column
-    scale_factor = graph_data['admissions'].sum() / graph_data['cases'].sum()
+    scale_factor = index.scale_factor(start, stop)
     graph_data['scaled_cases'] = graph_data['cases'] * scale_factor
 
     # cut off the last 'lag' days to avoid NANs at end
-    graph_data = graph_data.iloc[:-admission_lag]
+    graph_data = graph_data.iloc[:len(graph_data) - admission_lag]
 
     # really convoluted way to create a list of dates (as strings) to use as colorbar tick labels
     min_date = graph_data['date'].min()
@@ -314,6 +569,8 @@ def update_graphs3(date_range, rolling_avge_length, admission_lag, age_gps, scat
         min_colour = 0
         max_colour = 10000
 
+    mark_stage('compute')
+
     # create traces and layouts for fig3_1 to fig3_3
     fig3_1 = go.Figure()
 
@@ -337,7 +594,7 @@ def update_graphs3(date_range, rolling_avge_length, admission_lag, age_gps, scat
     )
     )
 
-    fig3_1.update_layout(create_graph_layout(title=f'Admissions vs cases for lag {admission_lag} days',
+    fig3_1.update_layout(create_graph_layout(title=f'Admissions vs cases for lag {lag_label}',
                                              xtitle='Cases',
                                              ytitle='Admissions',
                                              height=600))
@@ -351,7 +608,7 @@ def update_graphs3(date_range, rolling_avge_length, admission_lag, age_gps, scat
     )
     )
 
-    fig3_2.update_layout(create_graph_layout(title=f'Admissions to cases ratio for lag {admission_lag} days',
+    fig3_2.update_layout(create_graph_layout(title=f'Admissions to cases ratio for lag {lag_label}',
                                              xtitle='Date',
                                              ytitle='Admission to case ratio',
                                              height=300))
@@ -370,14 +627,95 @@ def update_graphs3(date_range, rolling_avge_length, admission_lag, age_gps, scat
         name='scaled cases',
         fill='tonexty'))
 
-    fig3_3.update_layout(create_graph_layout(title=f'Relative change in admissions to cases over time for lag {admission_lag} days',
+    fig3_3.update_layout(create_graph_layout(title=f'Relative change in admissions to cases over time for lag {lag_label}',
                                              xtitle='Date',
                                              ytitle='Admission and rescaled cases',
                                              height=300))
 
+    mark_stage('figure')
+
     return fig3_1, fig3_2, fig3_3
 
-if __name__ == '__main__':
-    app.run_server(debug=True)
 
+# lags tried by the lag sweep on tab 3
+LAG_SWEEP_LAGS = list(range(0, 29))
 
+
+def lag_sweep_data(date_range, rolling_avge_length, age_gps, progress=None):
+    """
+    correlation of admissions with lagged cases for each lag, run as a background job
+    """
+    df1 = panel.frame('admissions', [age_gps])
+    df2 = panel.frame('cases', [age_gps])
+    start_date = pd.to_datetime(dates[date_range[0]])
+    end_date = pd.to_datetime(dates[date_range[1]])
+
+    return get_lag_correlations(df1, df2, start_date, end_date, LAG_SWEEP_LAGS, rolling_avge_length, progress)
+
+
+lag_sweep = BackgroundTask('lag_sweep', lag_sweep_data, version=data_version)
+
+
+def lag_sweep_figure(sweep, age_gps):
+    fig = go.Figure()
+
+    fig.add_trace(go.Scatter(
+        x=sweep.index,
+        y=sweep['correlation'],
+        mode='lines+markers',
+        name='correlation'))
+
+    # mark the lag at which cases best predict admissions
+    best_lag = sweep['correlation'].idxmax()
+    fig.add_vline(x=best_lag, line_dash='dash', annotation_text=f'best lag {best_lag} days')
+
+    fig.update_layout(create_graph_layout(title=f'Correlation of admissions with earlier cases for {age_gps}',
+                                          xtitle='Lag (days)',
+                                          ytitle='Correlation',
+                                          height=300))
+
+    return fig
+
+
+# start the lag sweep when the button is pressed, then poll it for progress until done
+@app.callback(
+    [Output('lag-sweep-job', 'data'),
+     Output('lag-sweep-poll', 'disabled'),
+     Output('lag-sweep-progress', 'children'),
+     Output('lag-sweep', 'figure')],
+    [Input('lag-sweep-run', 'n_clicks'),
+     Input('lag-sweep-poll', 'n_intervals')],
+    [State('date_range', 'value'),
+     State('rolling_avge_length', 'value'),
+     State('age_gps', 'value'),
+     State('lag-sweep-job', 'data')])
+@instrument('update_lag_sweep')
+def update_lag_sweep(n_clicks, n_intervals, date_range, rolling_avge_length, age_gps, job):
+
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+
+    if 'lag-sweep-run.n_clicks' in triggered and n_clicks:
+        args = (date_range, rolling_avge_length, age_gps)
+        hit, sweep = lag_sweep.cached_result(*args)
+        if hit:
+            return None, True, 'Lag sweep done', lag_sweep_figure(sweep, age_gps)
+
+        return {'id': lag_sweep.submit(*args), 'args': args}, False, 'Lag sweep queued', dash.no_update
+
+    if job is None:
+        raise PreventUpdate
+
+    status = lag_sweep.status(job['id'])
+    if status is None or status['status'] == 'failed':
+        error = 'job not found' if status is None else status['error']
+        return None, True, f'Lag sweep failed: {error}', dash.no_update
+
+    if status['status'] == 'done':
+        sweep = lag_sweep.collect(job['id'], *job['args'])
+        return None, True, 'Lag sweep done', lag_sweep_figure(sweep, job['args'][2])
+
+    return dash.no_update, False, f'Lag sweep {status["progress"]:.0%} - {status["message"]}', dash.no_update
+
+
+if __name__ == '__main__':
+    app.run_server(debug=True)
@@ -0,0 +1,111 @@
+# locations of the raw data used by the app and helpers to read them, either in full or just recent dates
+
+import io
+import os
+import time
+import urllib.request
+import pandas as pd
+from app_config import DATA_DIR, API_BASE
+
+
+# gov.uk coronavirus dashboard api query for each download used by the app
+SOURCE_QUERIES = {
+    'cases_by_age_region': "areaType=region&metric=newCasesBySpecimenDateAgeDemographics&format=csv",
+    'cases_by_age': "areaType=nation&areaCode=E92000001&metric=newCasesBySpecimenDateAgeDemographics&format=csv",
+    'vaccines_by_age': "areaType=nation&areaCode=E92000001&metric=vaccinationsAgeDemographics&format=csv",
+    'cum_admissions_by_age': "areaType=nation&areaCode=E92000001&metric=cumAdmissionsByAge&format=csv",
+}
+
+SOURCE_URLS = {name: f'{API_BASE}/v2/data?{query}' for name, query in SOURCE_QUERIES.items()}
+
+# file names expected in DATA_DIR when reading local copies instead of the api
+SOURCE_FILES = {name: f'{name}.csv' for name in SOURCE_URLS}
+
+
+def source_path(name):
+    """
+    get location of a raw data source - local file if COVID_DATA_DIR is set, else the api url
+    :param name: Str - key of SOURCE_URLS
+    :return: Str - path or url that can be passed to pd.read_csv
+    """
+    if DATA_DIR:
+        return os.path.join(DATA_DIR, SOURCE_FILES[name])
+
+    return SOURCE_URLS[name]
+
+
+class CountingStream(io.RawIOBase):
+    """
+    read-only stream wrapper counting bytes read, and time spent waiting on the underlying file or download
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+        self.io_seconds = 0.0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        start = time.perf_counter()
+        data = self.raw.read(len(buffer))
+        self.io_seconds += time.perf_counter() - start
+
+        buffer[:len(data)] = data
+        self.bytes_read += len(data)
+
+        return len(data)
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+# bytes read and time spent reading (rather than parsing) for the last read of each source
+read_stats = {}
+
+
+def open_source(name):
+    """
+    open a raw data source for reading, counting bytes read
+    :param name: Str - key of SOURCE_URLS
+    :return: CountingStream
+    """
+    path = source_path(name)
+    if DATA_DIR:
+        return CountingStream(open(path, 'rb'))
+
+    return CountingStream(urllib.request.urlopen(path))
+
+
+def read_source(name, since=None, chunksize=50000):
+    """
+    read a raw data source, optionally keeping only rows dated after a given date.
+    the api returns rows newest first, so when reading recent dates only the read stops at the first chunk
+    which reaches back past 'since', making the cost proportional to the number of new dates
+    :param name: Str - key of SOURCE_URLS
+    :param since: Datetime - if given, only rows with date strictly after this are returned
+    :param chunksize: Int - rows parsed at a time when reading recent dates
+    :return: DataFrame - raw data in the form downloaded from the .gov website
+    """
+    with open_source(name) as stream:
+        if since is None:
+            df = pd.read_csv(io.BufferedReader(stream))
+
+        else:
+            since = pd.to_datetime(since)
+            chunks = []
+            for chunk in pd.read_csv(io.BufferedReader(stream), chunksize=chunksize):
+                chunk_dates = pd.to_datetime(chunk['date'])
+                chunks.append(chunk[chunk_dates > since])
+
+                # can only stop early if the file really is newest first, otherwise keep scanning
+                if chunk_dates.min() <= since and chunk_dates.is_monotonic_decreasing:
+                    break
+
+            df = pd.concat(chunks, ignore_index=True)
+
+        read_stats[name] = {'bytes': stream.bytes_read, 'io_seconds': stream.io_seconds}
+
+    return df
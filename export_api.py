@@ -0,0 +1,228 @@
+# bulk export of the computed series behind the charts, so they can be used directly rather than scraped from
+# figures. series come from the same engine as the charts, in long form (one row per date, region, age group,
+# ...) and are streamed in chunks as csv, or as arrow ipc or parquet if pyarrow is installed:
+#
+#   /api/v1/series/cases?region=London,England&bins=20,40,60&rolling=7&start=2021-01-01&format=csv
+#   /api/v1/series/growth?region=all&bins=20,40,60&rolling=7&growth_length=21&growth_avge=5&format=parquet
+#   /api/v1/series/cases?region=all&bins=20,40,60&standardised=1
+#   /api/v1/series/rt?region=all&bins=20,40,60
+#   /api/v1/series/ratio?rolling=14&offset=7&format=arrow
+#   /api/v1/series/vaccination?start=2021-01-01
+#
+# like the callbacks, series are cached by their query and identical requests in flight are computed once
+
+import io
+import flask
+import pandas as pd
+from analysis_engine import case_rates, admission_case_ratio, vaccination_coverage, reproduction_number
+from app_config import EXPORT_CHUNK_ROWS
+from result_cache import cached
+from single_flight import coalesced
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+SERIES = ['cases', 'growth', 'rt', 'ratio', 'vaccination']
+
+# query parameters the series depend on. others (eg format, or cache busting parameters) are left out of the
+# cache key
+QUERY_ARGS = ['region', 'bins', 'rolling', 'growth_length', 'growth_avge', 'standardised', 'offset', 'start']
+
+# format -> mimetype of the response
+FORMATS = {
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class BadRequest(ValueError):
+    """
+    invalid query parameter, answered with a 400
+    """
+
+
+def int_arg(args, name, default, low, high):
+    """
+    :return: Int - query parameter, checked to be between low and high
+    """
+    try:
+        value = int(args.get(name, default))
+    except ValueError:
+        raise BadRequest(f'{name} must be an integer')
+    if not low <= value <= high:
+        raise BadRequest(f'{name} must be between {low} and {high}')
+
+    return value
+
+
+def parse_regions(args, region_names):
+    regions = args.get('region', 'England')
+    if regions == 'all':
+        return region_names
+
+    regions = regions.split(',')
+    unknown = [region for region in regions if region not in region_names]
+    if unknown:
+        raise BadRequest(f'unknown regions: {", ".join(unknown)}')
+
+    return regions
+
+
+def parse_bins(args):
+    try:
+        bins = sorted({int(edge) for edge in args.get('bins', '20,40,60').split(',')})
+    except ValueError:
+        raise BadRequest('bins must be a comma separated list of integers')
+    if any(edge <= 0 or edge > 90 or edge % 5 for edge in bins):
+        raise BadRequest('bins must be multiples of 5 between 5 and 90')
+
+    return bins
+
+
+def long_form(df, value_name='value'):
+    """
+    :param df: DataFrame - datetime index, columns with one or more named levels
+    :return: DataFrame - one row per date and column, with a column per column level and a value column. dates
+    with no value (eg before the first full rolling average window) are left out
+    """
+    df = df.stack(list(range(df.columns.nlevels))).rename(value_name).reset_index()
+
+    return df.rename(columns={df.columns[0]: 'date'})
+
+
+def compute_series(series, args, cube, panel, region_names):
+    """
+    :param series: Str - one of SERIES
+    :param args: Dict - query parameters
+    :param cube: CaseCube
+    :param panel: TimeSeriesPanel
+    :param region_names: List - regions available, including 'England'
+    :return: DataFrame - the series in long form
+    """
+    start = pd.to_datetime(args.get('start', panel.index[0]))
+    rolling = int_arg(args, 'rolling', 7, 1, 28)
+
+    if series in ('cases', 'growth'):
+        per_pop, growth_rate = case_rates(cube, parse_regions(args, region_names), parse_bins(args), rolling,
+                                          int_arg(args, 'growth_length', 21, 1, 56),
+                                          int_arg(args, 'growth_avge', 5, 1, 28),
+                                          args.get('standardised', '0') in ('1', 'true'))
+        df = per_pop if series == 'cases' else growth_rate
+        df = df.loc[start:]
+
+    elif series == 'rt':
+        df = reproduction_number(cube, parse_regions(args, region_names), parse_bins(args)).loc[start:]
+
+    elif series == 'ratio':
+        df = admission_case_ratio(panel, start, rolling, int_arg(args, 'offset', 7, 0, 28))
+        df.columns.name = 'age_group'
+
+    else:
+        df = vaccination_coverage(panel, start)
+
+    return long_form(df)
+
+
+def csv_chunks(df, chunk_rows):
+    yield df.iloc[:0].to_csv(index=False)
+    for i in range(0, len(df), chunk_rows):
+        yield df.iloc[i:i + chunk_rows].to_csv(index=False, header=False)
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    write-only stream collecting bytes written, to pass on as they are produced
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def arrow_chunks(df, chunk_rows, file_format):
+    """
+    :param file_format: Str - 'arrow' for an ipc stream, or 'parquet' (one row group per chunk)
+    :return: generator of bytes of the file, yielded as each chunk is written
+    """
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    sink = ChunkSink()
+
+    if file_format == 'arrow':
+        writer = pyarrow.ipc.new_stream(sink, table.schema)
+    else:
+        writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+
+    for batch in table.to_batches(max_chunksize=chunk_rows):
+        if file_format == 'arrow':
+            writer.write_batch(batch)
+        else:
+            writer.write_table(pyarrow.Table.from_batches([batch]))
+        yield sink.take()
+
+    writer.close()
+    yield sink.take()
+
+
+def register_export_api(server, cube, panel, region_names, version=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    add the series export endpoints to the flask server
+    :param server: Flask - app.server of the dash app
+    :param cube: CaseCube - regional cases
+    :param panel: TimeSeriesPanel - national series
+    :param region_names: List - regions available, including 'England'
+    :param version: Str - version of the data loaded, so workers only share series computed from the same data
+    :param chunk_rows: Int - rows per streamed chunk
+    """
+    @cached('export_series')
+    @coalesced('export_series', version=version)
+    def series_frame(series, query):
+        return compute_series(series, query, cube, panel, region_names)
+
+    @server.route('/api/v1/series/<series>')
+    def export_series(series):
+        args = flask.request.args
+        file_format = args.get('format', 'csv')
+
+        if series not in SERIES:
+            return flask.jsonify(error=f'unknown series {series}, expected one of {", ".join(SERIES)}'), 404
+        if file_format not in FORMATS:
+            return flask.jsonify(error=f'unknown format {file_format}, expected one of {", ".join(FORMATS)}'), 400
+        if file_format != 'csv' and pyarrow is None:
+            return flask.jsonify(error=f'{file_format} needs pyarrow, which is not installed - use csv'), 406
+
+        try:
+            df = series_frame(series, {name: args[name] for name in QUERY_ARGS if name in args})
+        except ValueError as error:
+            return flask.jsonify(error=str(error)), 400
+
+        if file_format == 'csv':
+            chunks = csv_chunks(df, chunk_rows)
+        else:
+            chunks = arrow_chunks(df, chunk_rows, file_format)
+
+        extension = {'csv': 'csv', 'arrow': 'arrows', 'parquet': 'parquet'}[file_format]
+        headers = {'Content-Disposition': f'attachment; filename={series}.{extension}'}
+
+        return flask.Response(flask.stream_with_context(chunks), mimetype=FORMATS[file_format], headers=headers)
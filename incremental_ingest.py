@@ -0,0 +1,187 @@
+# incremental ingest of the gov.uk data. rather than rebuilding everything from the full history on every load,
+# the last prepared state is kept (in memory and on disk) and only dates after the last ingested date, plus a
+# revision window for back-filled dates, are read and prepared on each refresh
+
+import fcntl
+import os
+import tempfile
+from contextlib import contextmanager
+import pandas as pd
+from app_config import INGEST_STATE_DIR, REVISION_WINDOW_DAYS
+from data_sources import read_source
+from pipeline_report import PipelineRunner
+from population import population_registry
+from utilities import clean_case_data, prepare_case_data, prepare_vax_data, prepare_admissions_data
+
+
+# prepared dataset name -> (raw source name, function preparing raw rows, days of earlier raw data needed
+# to prepare a date). admissions need the previous day as they come cumulative and are differenced
+DATASETS = {
+    'cases_by_age_region': ('cases_by_age_region', clean_case_data, 0),
+    'cases_per_10k': ('cases_by_age', prepare_case_data, 0),
+    'vax_per_10k': ('vaccines_by_age', prepare_vax_data, 0),
+    'admissions_per_10k': ('cum_admissions_by_age', prepare_admissions_data, 1),
+}
+
+
+def frame_dates(df):
+    """
+    get the dates of each row of a prepared dataframe, whether held in the index (wide, prepared data)
+    or a 'date' column (long, cleaned data)
+    :param df: DataFrame - prepared or cleaned data
+    :return: DatetimeIndex or Series of dates, one per row
+    """
+    if isinstance(df.index, pd.DatetimeIndex):
+        return df.index
+
+    return df['date']
+
+
+class IncrementalIngestor:
+    """
+    keeps the prepared datasets used by the app, and brings them up to date by reading and preparing only the
+    dates that can have changed since the last refresh
+    """
+
+    state_file = 'prepared_state.pkl'
+
+    def __init__(self, state_dir=INGEST_STATE_DIR, revision_window=REVISION_WINDOW_DAYS, reader=read_source,
+                 runner=None):
+        """
+        :param state_dir: Str - folder to persist prepared state in between runs. None to keep in memory only
+        :param revision_window: Int - number of days before the last ingested date to re-read on each refresh
+        :param reader: function - called as reader(source_name, since=None) to get raw data
+        :param runner: PipelineRunner - runs and records the read and prepare stages of each refresh
+        """
+        self.state_dir = state_dir
+        self.revision_window = pd.Timedelta(days=revision_window)
+        self.reader = reader
+        self.runner = runner if runner is not None else PipelineRunner(report_file=None, trace_memory=False)
+
+        # prepared dataset name -> DataFrame
+        self.frames = {}
+
+    @classmethod
+    def load(cls, state_dir=INGEST_STATE_DIR, **kwargs):
+        """
+        create an ingestor, restoring the last prepared state from state_dir if one has been saved
+        :param state_dir: Str - folder prepared state is persisted in
+        :param kwargs: passed on to IncrementalIngestor
+        :return: IncrementalIngestor
+        """
+        ingestor = cls(state_dir=state_dir, **kwargs)
+        ingestor.restore()
+
+        return ingestor
+
+    def restore(self):
+        """
+        take the last prepared state saved in state_dir, if there is one and it was prepared with the populations
+        loaded now. per 10k rates in state prepared with other populations (eg after a change to POPULATION_YEAR)
+        are not mixed with new ones, and everything is prepared again
+        """
+        path = self.state_path()
+        if path is None or not os.path.exists(path):
+            return
+
+        state = pd.read_pickle(path)
+        if state.get('population') == population_registry().version:
+            self.frames = state['frames']
+
+    def state_path(self):
+        if self.state_dir is None:
+            return None
+
+        return os.path.join(self.state_dir, self.state_file)
+
+    def save(self):
+        """
+        persist prepared state so the next run only has to ingest new dates
+        """
+        path = self.state_path()
+        if path is None:
+            return
+
+        # write then rename, so a worker starting meanwhile never reads a partly written state
+        os.makedirs(self.state_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.state_dir)
+        with os.fdopen(fd, 'wb') as f:
+            pd.to_pickle({'frames': self.frames, 'population': population_registry().version}, f)
+        os.replace(tmp_path, path)
+
+    @contextmanager
+    def locked(self):
+        """
+        hold an exclusive lock on the saved state, so workers starting together refresh it one at a time
+        """
+        if self.state_dir is None:
+            yield
+            return
+
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(os.path.join(self.state_dir, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def last_date(self, name):
+        """
+        :param name: Str - prepared dataset name (key of DATASETS)
+        :return: Datetime - last date ingested for the dataset, or None if nothing ingested yet
+        """
+        if name not in self.frames:
+            return None
+
+        return frame_dates(self.frames[name]).max()
+
+    def refresh(self):
+        """
+        bring every dataset up to date. the first refresh (with no saved state) reads the full history,
+        subsequent ones only read dates after (last ingested date - revision window)
+        :return: Boolean - True if any dataset changed
+        """
+        with self.locked():
+            # another worker may have saved newer state since this one loaded. saved state is never older than
+            # what is held here, as every change is saved
+            self.restore()
+
+            changed = False
+            for name in DATASETS:
+                changed = self.refresh_dataset(name) or changed
+
+            if changed:
+                self.save()
+
+        return changed
+
+    def refresh_dataset(self, name):
+        """
+        bring a single dataset up to date
+        :param name: Str - prepared dataset name (key of DATASETS)
+        :return: Boolean - True if new rows were ingested
+        """
+        source, prepare, lookback_days = DATASETS[name]
+        old = self.frames.get(name)
+
+        if old is None:
+            since = None
+            new = self.runner.run(prepare.__name__, prepare, self.runner.read(source, self.reader))
+        else:
+            since = self.last_date(name) - self.revision_window
+            raw = self.runner.read(source, self.reader, since=since - pd.Timedelta(days=lookback_days))
+            if raw.empty:
+                return False
+
+            # prepare just the recent rows, then replace everything after 'since' with them
+            new = self.runner.run(prepare.__name__, prepare, raw)
+            new = new[frame_dates(new) > since]
+            new = pd.concat([old[frame_dates(old) <= since], new])
+
+        if not isinstance(new.index, pd.DatetimeIndex):
+            new = new.reset_index(drop=True)
+
+        self.frames[name] = new
+
+        return True
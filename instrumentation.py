@@ -0,0 +1,225 @@
+# per-callback latency and payload metrics. callbacks record wall time by stage (compute, figure build), the
+# flask request hooks add serialization time (everything dash does outside the callback, mostly json encoding)
+# and response size, and the results are served in prometheus text format at /metrics and as a Server-Timing
+# header on each callback response. metrics are held per process, so with several gunicorn workers each scrape
+# sees one worker
+
+import threading
+import time
+from functools import wraps
+import flask
+
+
+# histogram bucket upper bounds for stage times (seconds) and response sizes (bytes)
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6)
+
+DASH_UPDATE_PATH = '/_dash-update-component'
+
+
+class Histogram:
+    """
+    prometheus style histogram - cumulative bucket counts, sum and count per set of label values
+    """
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total = self.series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.series[key] = (counts, total + value)
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, (counts, total) in sorted(self.series.items()):
+                labels = ','.join(f'{k}="{v}"' for k, v in key)
+                for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_sum{{{labels}}} {total}')
+                lines.append(f'{self.name}_count{{{labels}}} {counts[-1]}')
+
+        return lines
+
+
+class Counter:
+    """
+    prometheus style counter per set of label values
+    """
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.series.items()):
+                labels = ','.join(f'{k}="{v}"' for k, v in key)
+                lines.append(f'{self.name}{{{labels}}} {value}')
+
+        return lines
+
+
+stage_seconds = Histogram('dash_callback_stage_seconds',
+                          'Wall time of each stage of a Dash callback (compute, figure, serialize, total)',
+                          TIME_BUCKETS)
+response_bytes = Histogram('dash_callback_response_bytes', 'Size of Dash callback responses', BYTES_BUCKETS)
+cache_results = Counter('dash_callback_cache_total', 'Result cache lookups by Dash callback, hit or miss')
+coalesced_calls = Counter('dash_callback_coalesced_total',
+                          'Dash callback calls which shared the result of an identical call in progress, by where '
+                          'the result came from (process or worker)')
+callback_errors = Counter('dash_callback_errors_total', 'Dash callbacks which raised an exception')
+
+METRICS = [stage_seconds, response_bytes, cache_results, coalesced_calls, callback_errors]
+
+# record of the callback running in this thread - name, stage times, cache result, where a coalesced result came
+# from and time of last mark
+current = threading.local()
+
+
+def mark_stage(stage):
+    """
+    record the time since the callback started (or since the last mark) against a stage. does nothing
+    when called outside an instrumented callback
+    :param stage: Str - stage name, eg 'compute' or 'figure'
+    """
+    record = getattr(current, 'record', None)
+    if record is not None:
+        add_stage_time(record, stage)
+
+
+def add_stage_time(record, stage):
+    now = time.perf_counter()
+    record['stages'][stage] = record['stages'].get(stage, 0.0) + now - record['last']
+    record['last'] = now
+
+
+def record_cache_result(hit):
+    """
+    record whether the running callback was served from the result cache
+    :param hit: Boolean - True for a cache hit
+    """
+    record = getattr(current, 'record', None)
+    if record is not None:
+        record['cache'] = 'hit' if hit else 'miss'
+
+
+def record_coalesced(source):
+    """
+    record that the running callback shared the result of an identical call already in progress
+    :param source: Str - 'process' if the call was in this process, 'worker' if in another worker
+    """
+    record = getattr(current, 'record', None)
+    if record is not None:
+        record['coalesced'] = source
+
+
+def instrument(name):
+    """
+    decorator recording stage times and cache use of a callback. place below @app.callback
+    :param name: Str - callback name to label metrics with
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            current.record = {'callback': name, 'stages': {}, 'cache': None, 'coalesced': None, 'last': start}
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                callback_errors.inc(callback=name)
+                raise
+            finally:
+                record = current.record
+                current.record = None
+
+                # callbacks which don't mark stages (and cache hits) are all compute
+                if not record['stages']:
+                    add_stage_time(record, 'compute')
+                record['callback_seconds'] = time.perf_counter() - start
+
+                for stage, seconds in record['stages'].items():
+                    stage_seconds.observe(seconds, callback=name, stage=stage)
+                if record['cache'] is not None:
+                    cache_results.inc(callback=name, result=record['cache'])
+                if record['coalesced'] is not None:
+                    coalesced_calls.inc(callback=name, source=record['coalesced'])
+
+                # hand over to the request hooks to add serialization time and response size
+                if flask.has_request_context():
+                    flask.g.callback_record = record
+
+        return wrapper
+
+    return decorator
+
+
+def server_timing(record, total, serialize):
+    """
+    :return: Str - Server-Timing header value for a callback response
+    """
+    parts = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in record['stages'].items()]
+    parts.append(f'serialize;dur={serialize * 1000:.1f}')
+    parts.append(f'total;dur={total * 1000:.1f}')
+    if record['cache'] is not None:
+        parts.append(f'cache;desc={record["cache"]}')
+    if record['coalesced'] is not None:
+        parts.append(f'coalesced;desc={record["coalesced"]}')
+
+    return ', '.join(parts)
+
+
+def register_metrics(server):
+    """
+    add request hooks timing dash callback requests, and a /metrics endpoint, to the flask server
+    :param server: Flask - app.server of the dash app
+    """
+    @server.before_request
+    def start_timer():
+        if flask.request.path == DASH_UPDATE_PATH:
+            flask.g.request_start = time.perf_counter()
+
+    @server.after_request
+    def record_request(response):
+        record = flask.g.pop('callback_record', None)
+        start = flask.g.pop('request_start', None)
+        if record is None or start is None:
+            return response
+
+        total = time.perf_counter() - start
+        serialize = max(total - record['callback_seconds'], 0.0)
+        name = record['callback']
+
+        stage_seconds.observe(serialize, callback=name, stage='serialize')
+        stage_seconds.observe(total, callback=name, stage='total')
+        response_bytes.observe(response.calculate_content_length() or 0, callback=name)
+
+        response.headers['Server-Timing'] = server_timing(record, total, serialize)
+
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        lines = []
+        for metric in METRICS:
+            lines.extend(metric.exposition())
+
+        return flask.Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
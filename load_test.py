@@ -0,0 +1,452 @@
+# http load test of the dash callback endpoint. starts the app locally (under gunicorn if installed, else the
+# werkzeug server) on synthetic data, then simulated users replay the _dash-update-component requests the
+# browser sends for tab switches and bursts of slider drags on tabs 1 and 3, at a set concurrency. reports
+# throughput, latency percentiles and error rates per callback:
+#
+#   python load_test.py [--concurrency 8] [--duration 60] [--workers 4] [--areas 50] [--output results.json]
+#   python load_test.py --url http://127.0.0.1:8000   (test an already running server)
+
+import argparse
+import glob
+import http.client
+import importlib.util
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import numpy as np
+
+
+CALLBACK_PATH = '/_dash-update-component'
+
+DEPENDENCIES_PATH = '/_dash-dependencies'
+
+# callbacks of the app, as read from the server by load_callbacks - name -> outputs, inputs and state as
+# (component id, property). callbacks are named by their first output component, or its graph for update stores
+# (see trace_updates.py). clientside callbacks (eg merging trace updates) run in the browser, so are left out
+CALLBACKS = {}
+
+# suffix of the ids of the stores graphs updated a trace at a time take their updates from
+UPDATE_SUFFIX = '-update'
+
+# callback rendering the content of the chosen tab
+TABS_CALLBACK = 'tabs-content'
+
+# statuses of successful callback requests - callbacks raising PreventUpdate answer with no content
+OK_STATUSES = (200, 204)
+
+
+def split_output(output):
+    """
+    :param output: Str - output of a callback as dash gives it, 'id.property' or '..id.property...id.property..'
+    :return: List - of (component id, property)
+    """
+    return [tuple(part.rsplit('.', 1)) for part in output.strip('.').split('...')]
+
+
+def load_callbacks(host, port):
+    """
+    read the outputs, inputs and state of the app's callbacks into CALLBACKS, as the dash renderer does on
+    loading the page
+    :param host: Str - server host
+    :param port: Int - server port
+    """
+    connection = http.client.HTTPConnection(host, port, timeout=120)
+    try:
+        connection.request('GET', DEPENDENCIES_PATH)
+        dependencies = json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+    CALLBACKS.clear()
+    for dependency in dependencies:
+        if dependency.get('clientside_function'):
+            continue
+        outputs = split_output(dependency['output'])
+        name = outputs[0][0]
+        if name.endswith(UPDATE_SUFFIX):
+            name = name[:-len(UPDATE_SUFFIX)]
+        CALLBACKS[name] = (outputs,
+                           [(item['id'], item['property']) for item in dependency['inputs']],
+                           [(item['id'], item['property']) for item in dependency['state']])
+
+
+def callback_body(name, values, changed=None):
+    """
+    :param name: Str - callback name (key of CALLBACKS)
+    :param values: Dict - component id -> current value
+    :param changed: Str - id of the component whose change triggered the callback. None for the initial call
+    :return: Dict - request body the dash renderer posts for the callback
+    """
+    outputs, inputs, states = CALLBACKS[name]
+    outputs = [{'id': component, 'property': prop} for component, prop in outputs]
+
+    if len(outputs) == 1:
+        output = f'{outputs[0]["id"]}.{outputs[0]["property"]}'
+        outputs = outputs[0]
+    else:
+        output = '..' + '...'.join(f'{o["id"]}.{o["property"]}' for o in outputs) + '..'
+
+    return {'output': output,
+            'outputs': outputs,
+            'inputs': [{'id': component, 'property': prop, 'value': values.get(component)}
+                       for component, prop in inputs],
+            'state': [{'id': component, 'property': prop, 'value': values.get(component)}
+                      for component, prop in states],
+            'changedPropIds': [] if changed is None else [f'{changed}.value']}
+
+
+def find_components(tree, found=None):
+    """
+    :param tree: Dict or List - serialised dash layout
+    :param found: Dict - components found so far
+    :return: Dict - component id -> props, for every component in the layout with an id
+    """
+    if found is None:
+        found = {}
+
+    if isinstance(tree, list):
+        for child in tree:
+            find_components(child, found)
+    elif isinstance(tree, dict) and 'props' in tree:
+        props = tree['props']
+        if 'id' in props:
+            found[props['id']] = props
+        find_components(props.get('children'), found)
+
+    return found
+
+
+class Session:
+    """
+    one simulated user, keeping component values as the browser would and recording every request made
+    """
+
+    def __init__(self, host, port, records, rng):
+        """
+        :param host: Str - server host
+        :param port: Int - server port
+        :param records: List - shared list to append (callback name, seconds, status, response bytes) to
+        :param rng: random.Random
+        """
+        self.host = host
+        self.port = port
+        self.records = records
+        self.rng = rng
+        self.connection = None
+        self.values = {}
+        self.components = {}
+        self.tab = None
+
+    def post(self, name, body):
+        """
+        post a callback request, reconnecting if the connection has dropped
+        :return: Dict - decoded response, or None if the request failed
+        """
+        data = json.dumps(body).encode()
+        headers = {'Content-Type': 'application/json'}
+
+        start = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=120)
+            self.connection.request('POST', CALLBACK_PATH, data, headers)
+            response = self.connection.getresponse()
+            content = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            content, status = b'', 0
+        seconds = time.perf_counter() - start
+
+        self.records.append((name, seconds, status, len(content)))
+
+        if status != 200:
+            return None
+
+        return json.loads(content)
+
+    def fire(self, changed=None):
+        """
+        fire the callbacks on the current tab (those with every input on it) taking the changed component as
+        input, or all of them on first showing the tab, as the renderer does
+        """
+        for name, (_, inputs, _) in CALLBACKS.items():
+            components = [component for component, _ in inputs]
+            if not all(component in self.components for component in components):
+                continue
+            if changed is None or changed in components:
+                response = self.post(name, callback_body(name, self.values, changed))
+
+                # keep the uids of the figures shown, as the browser does on merging trace updates
+                for component, update in (response or {}).get('response', {}).items():
+                    if component.endswith(UPDATE_SUFFIX):
+                        self.values[component[:-len(UPDATE_SUFFIX)] + '-rendered'] = {
+                            'layout': update['data']['layout'], 'traces': update['data']['traces']}
+
+    def open_tab(self, tab):
+        """
+        switch tab, picking up the default value of each control from the returned layout
+        """
+        response = self.post(TABS_CALLBACK, callback_body(TABS_CALLBACK, {'tabs': tab}, 'tabs'))
+        if response is None:
+            return
+
+        self.tab = tab
+        self.components = find_components(response['response']['tabs-content']['children'])
+        self.values = {component: props.get('value') for component, props in self.components.items()}
+        self.fire()
+
+    def drag(self, component, steps):
+        """
+        drag a slider step by step from its current value towards a random value, firing callbacks at each step
+        :param component: Str - slider id
+        :param steps: Int - most values to pass through
+        """
+        props = self.components[component]
+        step = props.get('step') or 1
+        value = self.values[component]
+
+        # range sliders are dragged by one of their handles
+        handle = self.rng.randrange(len(value)) if isinstance(value, list) else None
+        current = value[handle] if handle is not None else value
+        target = self.rng.randrange(props['min'], props['max'] + 1, step)
+        direction = step if target >= current else -step
+
+        for position in range(current + direction, target + direction, direction)[:steps]:
+            if handle is not None:
+                value = list(value)
+                value[handle] = position
+                value = sorted(value)
+            else:
+                value = position
+            self.values[component] = value
+            self.fire(component)
+
+    def choose(self, component):
+        """
+        pick a random option of a dropdown or radio items component
+        """
+        options = [option['value'] for option in self.components[component]['options']]
+        self.values[component] = self.rng.choice(options)
+        self.fire(component)
+
+
+def tab_switching(session):
+    for tab in ['tab-1', 'tab-2', 'tab-3', 'tab-1']:
+        session.open_tab(tab)
+
+
+def tab1_slider_drags(session):
+    session.open_tab('tab-1')
+    if session.tab != 'tab-1':
+        return
+    session.drag('start_date', 8)
+    session.drag('growth_rate_length', 5)
+    session.choose('Region')
+    session.drag('start_date', 8)
+
+
+def tab3_slider_drags(session):
+    session.open_tab('tab-3')
+    if session.tab != 'tab-3':
+        return
+    session.drag('date_range', 8)
+    session.drag('admission_lag', 6)
+    session.choose('age_gps')
+    session.drag('admission_lag', 6)
+
+
+# scenario name -> (function running a session, relative weight in the mix)
+SCENARIOS = {
+    'tab_switching': (tab_switching, 1),
+    'tab1_slider_drags': (tab1_slider_drags, 2),
+    'tab3_slider_drags': (tab3_slider_drags, 2),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, data_dir, population_dir, server='gunicorn', workers=4, threads=1, cache=True):
+    """
+    start the app in a subprocess, serving on localhost, and wait until it answers
+    :param port: Int - port to serve on
+    :param data_dir: Str - COVID_DATA_DIR for the app
+    :param population_dir: Str - POPULATION_DIR for the app
+    :param server: Str - 'gunicorn' or 'werkzeug'
+    :param workers: Int - gunicorn worker processes
+    :param threads: Int - gunicorn threads per worker
+    :param cache: Boolean - keep the app's callback result caches on
+    :return: Popen - the server process
+    """
+    env = dict(os.environ, COVID_DATA_DIR=data_dir, POPULATION_DIR=population_dir, PIPELINE_REPORT_FILE='',
+               INCREMENTAL_INGEST='0')
+    if not cache:
+        env['RESULT_CACHE_SIZE'] = '0'
+
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', 'covid_analysis_app:server', '--bind', f'127.0.0.1:{port}',
+                   '--workers', str(workers), '--threads', str(threads), '--timeout', '300']
+    else:
+        command = [sys.executable, '-c', 'from covid_analysis_app import server; '
+                                         f'server.run(host="127.0.0.1", port={port}, threaded=True)']
+
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with code {process.returncode} before starting')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/_dash-layout')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.5)
+
+    process.terminate()
+    raise RuntimeError('server did not start within 300 seconds')
+
+
+def run_load(host, port, concurrency=8, duration=60, seed=0):
+    """
+    run simulated users against a server
+    :param host: Str - server host
+    :param port: Int - server port
+    :param concurrency: Int - number of simultaneous users
+    :param duration: Float - seconds to run for. sessions in progress at the end are finished
+    :param seed: Int - random seed for choosing scenarios and slider values
+    :return: 2-tuple - list of (callback name, seconds, status, response bytes) records, and seconds taken
+    """
+    load_callbacks(host, port)
+
+    records = []
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[name][1] for name in names]
+
+    def user(i):
+        rng = random.Random(seed * 1000 + i)
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            session = Session(host, port, records, rng)
+            SCENARIOS[rng.choices(names, weights)[0]][0](session)
+            if session.connection is not None:
+                session.connection.close()
+
+    users = [threading.Thread(target=user, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+
+    return records, time.perf_counter() - start
+
+
+def summarise(records, seconds):
+    """
+    :param records: List - (callback name, seconds, status, response bytes) of each request
+    :param seconds: Float - wall time of the run
+    :return: Dict - callback name (and 'all') -> requests, throughput, error rate and latency percentiles
+    """
+    summary = {}
+    names = sorted({record[0] for record in records})
+    for name in names + ['all']:
+        selected = [record for record in records if name in ('all', record[0])]
+        latencies = np.array([record[1] for record in selected])
+        errors = [record[2] for record in selected if record[2] not in OK_STATUSES]
+
+        summary[name] = {'requests': len(selected),
+                         'requests_per_second': len(selected) / seconds,
+                         'error_rate': len(errors) / len(selected),
+                         'errors_by_status': {str(status): errors.count(status) for status in set(errors)},
+                         'mean_response_bytes': float(np.mean([record[3] for record in selected])),
+                         'max': float(latencies.max())}
+        for q in [50, 90, 95, 99]:
+            summary[name][f'p{q}'] = float(np.percentile(latencies, q))
+
+    return summary
+
+
+def print_summary(summary, seconds):
+    print(f'{summary["all"]["requests"]} requests in {seconds:.1f}s')
+    print(f'{"callback":<32} {"requests":>8} {"req/s":>7} {"errors":>7} {"p50":>8} {"p90":>8} {"p95":>8} '
+          f'{"p99":>8} {"max":>8}')
+    for name, row in summary.items():
+        print(f'{name:<32} {row["requests"]:>8} {row["requests_per_second"]:>7.1f} {row["error_rate"]:>7.1%} '
+              + ' '.join(f'{row[q] * 1000:>6.0f}ms' for q in ['p50', 'p90', 'p95', 'p99', 'max']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='load test the dash callback endpoint')
+    parser.add_argument('--url', help='test an already running server instead of starting one')
+    parser.add_argument('--concurrency', type=int, default=8, help='simultaneous simulated users')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run for')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for users and synthetic data')
+    parser.add_argument('--server', choices=['gunicorn', 'werkzeug'], help='server to start the app under. '
+                        'defaults to gunicorn if installed')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--no-cache', action='store_true', help="turn off the app's callback result caches")
+    parser.add_argument('--data-dir', help='folder of data files to serve instead of generating synthetic data')
+    parser.add_argument('--days', type=int, default=500, help='days of synthetic data')
+    parser.add_argument('--areas', type=int, help='number of synthetic areas, instead of the real regions')
+    parser.add_argument('--output', help='json file to save the summary to')
+    args = parser.parse_args()
+
+    process = None
+    data_dir = None
+    try:
+        if args.url:
+            url = urllib.parse.urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            from synthetic_data import write_synthetic_data
+
+            data_dir = args.data_dir
+            population_dir = '.'
+            if data_dir is not None and glob.glob(os.path.join(data_dir, '[0-9][0-9][0-9][0-9]_pop_by_region.csv')):
+                population_dir = data_dir
+            if data_dir is None:
+                data_dir = population_dir = tempfile.mkdtemp(prefix='covid_load_test_')
+                write_synthetic_data(data_dir, days=args.days, seed=args.seed, areas=args.areas)
+
+            server = args.server
+            if server is None:
+                server = 'gunicorn' if importlib.util.find_spec('gunicorn') else 'werkzeug'
+
+            host, port = '127.0.0.1', free_port()
+            process = start_server(port, data_dir, population_dir, server, args.workers, args.threads,
+                                   not args.no_cache)
+            print(f'started app under {server} on port {port}')
+
+        records, seconds = run_load(host, port, args.concurrency, args.duration, args.seed)
+        if not records:
+            sys.exit('no requests were made')
+        summary = summarise(records, seconds)
+        print_summary(summary, seconds)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'settings': vars(args), 'seconds': seconds, 'summary': summary}, f, indent=1)
+
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if data_dir is not None and args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
@@ -0,0 +1,160 @@
+# memory accounting for the app - deep size of each named resident dataset, occupancy of the result caches,
+# process memory against a budget and (if tracing) the top allocation sites. available as a log line after each
+# data load (when over budget, or with MEMORY_LOG set), a json admin endpoint, or from the command line with:
+# python memory_report.py
+
+import json
+import logging
+import sys
+import tracemalloc
+import flask
+import numpy as np
+import pandas as pd
+from app_config import MEMORY_BUDGET_MB, MEMORY_LOG
+from result_cache import caches
+
+
+logger = logging.getLogger(__name__)
+
+# named resident datasets to report on - name -> function returning the object (so it is looked up when the
+# report is made, and never kept alive by the report)
+datasets = {}
+
+
+def register_dataset(name, get_object):
+    """
+    add a dataset to the memory report
+    :param name: Str - name to report it under
+    :param get_object: function - takes no arguments and returns the dataset
+    """
+    datasets[name] = get_object
+
+
+def deep_size(obj, seen=None):
+    """
+    estimate memory held by an object, including everything it refers to. dataframes and arrays are measured
+    with pandas / numpy, plotly figures by their json size, and other objects by walking their contents
+    :param obj: object to measure
+    :param seen: Set - ids of objects already counted, so shared objects are only counted once
+    :return: Int - bytes
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True, index=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        # views share memory with their base, which is counted where it is held
+        return sys.getsizeof(obj) if obj.base is not None else int(obj.nbytes)
+    if hasattr(obj, 'to_plotly_json'):
+        return len(obj.to_json()) if hasattr(obj, 'to_json') else sys.getsizeof(obj)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_size(vars(obj), seen)
+
+    return size
+
+
+def process_memory():
+    """
+    :return: Dict - current and peak resident set size of this process in bytes (where available)
+    """
+    memory = {'rss_bytes': None, 'peak_rss_bytes': None}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    memory['rss_bytes'] = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    memory['peak_rss_bytes'] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return memory
+
+
+def top_allocations(limit=10):
+    """
+    :param limit: Int - number of allocation sites to return
+    :return: List - of dicts with file, line, bytes and count, largest first. empty if not tracing
+    """
+    if not tracemalloc.is_tracing():
+        return []
+
+    stats = tracemalloc.take_snapshot().statistics('lineno')
+
+    return [{'file': stat.traceback[0].filename, 'line': stat.traceback[0].lineno,
+             'bytes': stat.size, 'count': stat.count} for stat in stats[:limit]]
+
+
+def memory_report(budget_mb=MEMORY_BUDGET_MB, allocation_sites=10):
+    """
+    :param budget_mb: Int - memory budget in MB to compare process memory against
+    :param allocation_sites: Int - number of top allocation sites to include (if tracing)
+    :return: Dict - datasets and caches (bytes), process memory and budget, and top allocation sites
+    """
+    seen = set()
+    dataset_sizes = {name: deep_size(get_object(), seen) for name, get_object in datasets.items()}
+
+    cache_sizes = {name: {'entries': len(cache), 'maxsize': cache.maxsize,
+                          'bytes': deep_size(list(cache.results.values()), seen)}
+                   for name, cache in caches.items()}
+
+    process = process_memory()
+    budget_bytes = budget_mb * 1024 * 1024
+    used = process['rss_bytes']
+    if used is None:
+        used = sum(dataset_sizes.values()) + sum(cache['bytes'] for cache in cache_sizes.values())
+
+    return {'datasets': dataset_sizes,
+            'caches': cache_sizes,
+            'process': process,
+            'budget_bytes': budget_bytes,
+            'budget_used': round(used / budget_bytes, 3),
+            'top_allocations': top_allocations(allocation_sites)}
+
+
+def log_memory_report(budget_mb=MEMORY_BUDGET_MB, always=MEMORY_LOG):
+    """
+    log a one line summary of the memory report if over budget, or always if asked. logged as a warning, so it
+    is shown even though the app sets up no logging
+    :param budget_mb: Int - memory budget in MB
+    :param always: Boolean - log the summary even when within budget
+    :return: Dict - the full report
+    """
+    report = memory_report(budget_mb, allocation_sites=0)
+    largest = sorted(report['datasets'].items(), key=lambda item: -item[1])[:5]
+    summary = ', '.join(f'{name}={size / 2 ** 20:.1f}MB' for name, size in largest)
+    message = f'memory {report["budget_used"]:.0%} of {budget_mb}MB budget; largest datasets: {summary}'
+
+    if report['budget_used'] > 1 or always:
+        logger.warning(message)
+
+    return report
+
+
+def register_memory_endpoint(server):
+    """
+    serve the memory report as json at /admin/memory on the flask server
+    :param server: Flask - app.server of the dash app
+    """
+    @server.route('/admin/memory')
+    def admin_memory():
+        return flask.Response(json.dumps(memory_report(), indent=1), mimetype='application/json')
+
+
+if __name__ == '__main__':
+    # load the app (and so all its data), then print the report. the app registers its datasets with the
+    # imported memory_report module rather than this __main__ one, so report from there
+    import covid_analysis_app  # noqa: F401
+    import memory_report as app_memory
+    print(json.dumps(app_memory.memory_report(), indent=1))
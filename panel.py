@@ -0,0 +1,151 @@
+# read-only panel holding all prepared national time series (cases, admissions and vaccinations per 10k by age
+# group) on one shared daily date index. built once after the data is loaded, so callbacks can take views of it
+# rather than copying and re-aligning the separate prepared dataframes on every request
+
+import warnings
+import numpy as np
+import pandas as pd
+
+
+# first date held in the panel - all series are padded with nans back to this date
+PANEL_START = pd.Timestamp('2020-08-01')
+
+# how each metric's days are aggregated to weeks. means keep daily rates (and coverage) in the same units
+WEEKLY_AGGREGATION = {'cases': 'mean', 'admissions': 'mean', 'dose1': 'mean', 'dose2': 'mean'}
+
+
+class TimeSeriesPanel:
+    """
+    metric x age group columns of daily data held in a single read-only, column-contiguous numpy array
+    """
+
+    def __init__(self, frames, start_date=PANEL_START, freq='D'):
+        """
+        :param frames: Dict - metric name -> DataFrame with datetime index and a column per age group. end dates
+        are expected to already be equalised
+        :param start_date: Datetime - first date of the shared index
+        :param freq: Str - frequency of the shared index, 'D' for daily or '7D' for weekly
+        """
+        end_date = min(df.index[-1] for df in frames.values())
+        self.freq = freq
+        self.index = pd.date_range(start=start_date, end=end_date, freq=freq)
+
+        # column position of each (metric, age group), with each metric's columns kept next to each other
+        self.columns = {}
+        for metric, df in frames.items():
+            for group in df.columns:
+                self.columns[(metric, group)] = len(self.columns)
+        self.groups = {metric: list(df.columns) for metric, df in frames.items()}
+
+        # fortran order so each column is contiguous, and a metric's columns form one contiguous block
+        data = np.full((len(self.index), len(self.columns)), np.nan, order='F')
+        for metric, df in frames.items():
+            aligned = df.reindex(self.index)
+            for group in df.columns:
+                data[:, self.columns[(metric, group)]] = aligned[group].to_numpy(dtype='float64')
+
+        data.flags.writeable = False
+        self.data = data
+
+        # the same series aggregated to weeks, built from this panel on first use
+        self.weekly_panel = None
+
+    @classmethod
+    def from_prepared(cls, cases_per_10k, vax_per_10k, admissions_per_10k, start_date=PANEL_START):
+        """
+        build panel from the outputs of prepare_case_data, prepare_vax_data and prepare_admissions_data
+        :return: TimeSeriesPanel - with metrics 'cases', 'admissions', 'dose1' and 'dose2'
+        """
+        dose1 = vax_per_10k[[col for col in vax_per_10k.columns if col.endswith(' dose1')]]
+        dose2 = vax_per_10k[[col for col in vax_per_10k.columns if col.endswith(' dose2')]]
+
+        frames = {'cases': cases_per_10k,
+                  'admissions': admissions_per_10k,
+                  'dose1': dose1.rename(columns=lambda col: col[:-len(' dose1')]),
+                  'dose2': dose2.rename(columns=lambda col: col[:-len(' dose2')])}
+
+        return cls(frames, start_date=start_date)
+
+    def column_positions(self, metric, groups=None):
+        """
+        :return: slice if the columns are contiguous (so selecting them gives a view), else list of positions
+        """
+        groups = self.groups[metric] if groups is None else groups
+        positions = [self.columns[(metric, group)] for group in groups]
+
+        if positions == list(range(positions[0], positions[0] + len(positions))):
+            return slice(positions[0], positions[0] + len(positions))
+
+        return positions
+
+    def frame(self, metric, groups=None):
+        """
+        get a metric as a dataframe on the shared date index, without copying where possible
+        :param metric: Str - 'cases', 'admissions', 'dose1' or 'dose2'
+        :param groups: List - age groups to include, in order. all groups if None
+        :return: DataFrame - read-only, datetime index and a column per age group
+        """
+        groups = self.groups[metric] if groups is None else list(groups)
+
+        return pd.DataFrame(self.data[:, self.column_positions(metric, groups)], index=self.index,
+                            columns=groups, copy=False)
+
+    def series(self, metric, group):
+        """
+        :param metric: Str - 'cases', 'admissions', 'dose1' or 'dose2'
+        :param group: Str - age group
+        :return: Series - read-only view of a single column on the shared date index
+        """
+        return pd.Series(self.data[:, self.columns[(metric, group)]], index=self.index, name=group, copy=False)
+
+    def weekly(self, aggregation=WEEKLY_AGGREGATION):
+        """
+        aggregate every series to ISO weeks (monday to sunday) in one reshape of the panel's array. weeks only
+        partly covered, at either end, are aggregated over the days there are
+        :param aggregation: Dict - metric -> 'mean' or 'sum'
+        :return: TimeSeriesPanel - with the same metrics and age groups, indexed by the monday of each week
+        """
+        # pad with missing days to whole weeks, starting on a monday
+        lead = self.index[0].dayofweek
+        weeks = -(-(lead + len(self.index)) // 7)
+        padded = np.full((weeks * 7, self.data.shape[1]), np.nan)
+        padded[lead:lead + len(self.index)] = self.data
+        days = padded.reshape(weeks, 7, -1)
+
+        with warnings.catch_warnings():
+            # weeks with no data for a series are left missing
+            warnings.simplefilter('ignore', RuntimeWarning)
+            means = np.nanmean(days, axis=1)
+        sums = np.where(np.isnan(days).all(axis=1), np.nan, np.nansum(days, axis=1))
+
+        start_date = self.index[0] - pd.Timedelta(days=lead)
+        index = pd.date_range(start=start_date, periods=weeks, freq='7D')
+        frames = {}
+        for metric, groups in self.groups.items():
+            values = means if aggregation[metric] == 'mean' else sums
+            frames[metric] = pd.DataFrame(values[:, self.column_positions(metric)], index=index, columns=groups)
+
+        return TimeSeriesPanel(frames, start_date=start_date, freq='7D')
+
+    def at_resolution(self, resolution):
+        """
+        :param resolution: Str - 'daily' or 'weekly'
+        :return: TimeSeriesPanel - this panel, or its weekly aggregate. the weekly panel is kept with the daily one
+        it was built from, so it is always rebuilt along with it
+        """
+        if resolution != 'weekly' or self.freq == '7D':
+            return self
+        if self.weekly_panel is None:
+            self.weekly_panel = self.weekly()
+
+        return self.weekly_panel
+
+    def period_start(self, date):
+        """
+        :param date: Datetime - a day
+        :return: Datetime - first date of the step of the index holding it (the monday of its week for a weekly
+        panel), so selecting from it keeps the partial week the day falls in
+        """
+        position = self.index.searchsorted(date, side='right') - 1
+
+        return self.index[max(position, 0)]
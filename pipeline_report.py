@@ -0,0 +1,151 @@
+# instrumented runner for the data preparation pipeline run at startup. each stage (reading a source, or a
+# preparation step) is timed and its rows in and out, peak memory and, for reads, bytes downloaded and parse
+# time are recorded. records are appended as json lines to a report file, so the history across deploys shows
+# which stage is getting slower as the data grows, and can be served on the flask server. the file keeps the
+# last runs only, so it doesn't grow with every deploy
+
+import datetime
+import fcntl
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+import flask
+import pandas as pd
+from app_config import PIPELINE_REPORT_FILE, PIPELINE_REPORT_MAX_RUNS, PIPELINE_REPORT_MEMORY
+from data_sources import read_source, read_stats
+from memory_report import process_memory
+
+
+def count_rows(*objects):
+    """
+    :return: Int - total rows of all dataframes / series passed, looking inside lists and tuples
+    """
+    rows = 0
+    for obj in objects:
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            rows += len(obj)
+        elif isinstance(obj, (list, tuple)):
+            rows += count_rows(*obj)
+
+    return rows
+
+
+class PipelineRunner:
+    """
+    runs pipeline stages, keeping a record of each for the report
+    """
+
+    def __init__(self, report_file=PIPELINE_REPORT_FILE, trace_memory=PIPELINE_REPORT_MEMORY,
+                 max_runs=PIPELINE_REPORT_MAX_RUNS):
+        """
+        :param report_file: Str - json lines file to append stage records to. None to not write a report
+        :param trace_memory: Boolean - record peak memory of each stage with tracemalloc, which slows stages down
+        :param max_runs: Int - runs kept in the report file, oldest dropped first
+        """
+        self.report_file = report_file
+        self.trace_memory = trace_memory
+        self.max_runs = max_runs
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records = []
+
+    def run(self, stage, func, *args, **kwargs):
+        """
+        run one pipeline stage and record it
+        :param stage: Str - stage name
+        :param func: function - the stage
+        :param args: passed on to func. rows in are counted from any dataframes in here
+        :param kwargs: passed on to func
+        :return: whatever func returns
+        """
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        wall_seconds = time.perf_counter() - start
+
+        record = {'run_id': self.run_id,
+                  'timestamp': datetime.datetime.utcnow().isoformat(timespec='seconds'),
+                  'stage': stage,
+                  'rows_in': count_rows(*args),
+                  'rows_out': count_rows(result),
+                  'wall_seconds': round(wall_seconds, 4),
+                  'peak_rss_bytes': process_memory()['peak_rss_bytes'],
+                  'peak_memory_bytes': None}
+
+        if self.trace_memory:
+            record['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1] - memory_before
+        if started_tracing:
+            tracemalloc.stop()
+
+        self.records.append(record)
+
+        return result
+
+    def read(self, name, reader=read_source, **kwargs):
+        """
+        read a raw data source as a pipeline stage, adding bytes downloaded and parse time to its record
+        :param name: Str - source name (key of data_sources.SOURCE_URLS)
+        :param reader: function - called as reader(name, **kwargs), normally data_sources.read_source or a
+        reader wrapping it
+        :return: DataFrame - raw data
+        """
+        read_stats.pop(name, None)
+        df = self.run(f'read {name}', reader, name, **kwargs)
+
+        # readers not going through read_source (eg reading from the vintage store) don't download anything
+        stats = read_stats.get(name, {'bytes': 0, 'io_seconds': 0.0})
+        record = self.records[-1]
+        record['bytes'] = stats['bytes']
+        record['parse_seconds'] = round(max(record['wall_seconds'] - stats['io_seconds'], 0.0), 4)
+
+        return df
+
+    def write_report(self):
+        """
+        append this run's stage records to the report file, dropping the records of runs before the last max_runs
+        """
+        if self.report_file is None:
+            return
+
+        # workers starting together write their reports one at a time
+        with open(self.report_file + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                lines = []
+                if os.path.exists(self.report_file):
+                    with open(self.report_file) as f:
+                        lines = [line for line in f if line.strip()]
+                lines += [json.dumps(record) + '\n' for record in self.records]
+
+                runs = list(dict.fromkeys(json.loads(line)['run_id'] for line in lines))
+                keep = set(runs[-self.max_runs:])
+                lines = [line for line in lines if json.loads(line)['run_id'] in keep]
+
+                # write then rename, so the report is never left partly written
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.report_file)))
+                with os.fdopen(fd, 'w') as f:
+                    f.writelines(lines)
+                os.replace(tmp_path, self.report_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def register_pipeline_report(server, runner):
+    """
+    serve the records of a pipeline run at /pipeline-report on the flask server
+    :param server: Flask - app.server of the dash app
+    :param runner: PipelineRunner - the run to report on
+    """
+    @server.route('/pipeline-report')
+    def pipeline_report():
+        lines = [json.dumps(record) for record in runner.records]
+
+        return flask.Response('\n'.join(lines) + '\n', mimetype='application/x-ndjson')
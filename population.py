@@ -0,0 +1,144 @@
+# population registry - loads the ONS mid-year population estimates once, and holds national and regional
+# populations by single year of age together with the age group populations used throughout the app
+
+import glob
+import hashlib
+import os
+import re
+import numpy as np
+import pandas as pd
+from app_config import POPULATION_YEAR, POPULATION_DIR
+
+
+# single years of age held, with the last one being 90+
+AGES = np.arange(91)
+
+# age groups hospital admissions are provided in, as bin edges and labels
+ADMISSIONS_BINS = [0, 18, 65, 85, 120]
+ADMISSIONS_AGE_GROUPS = ['0-17 yrs', '18-64 yrs', '65-84 yrs', '85+ yrs']
+
+
+def find_population_files(year=None, folder='.'):
+    """
+    find the national and regional population files for a given mid-year estimate, expected to be named
+    '<year>_England_pop.csv' and '<year>_pop_by_region.csv'
+    :param year: Int or Str - year of estimates. if None, the latest year available for both files is used
+    :param folder: Str - folder to look in
+    :return: 2 Strs - paths of national and regional population files
+    """
+    if year is None:
+        years = [re.match(r'(\d{4})_England_pop\.csv', os.path.basename(path)).group(1)
+                 for path in glob.glob(os.path.join(folder, '[0-9][0-9][0-9][0-9]_England_pop.csv'))]
+        years = [y for y in years if os.path.exists(os.path.join(folder, f'{y}_pop_by_region.csv'))]
+        if not years:
+            raise FileNotFoundError(f'no population files found in {folder}')
+        year = max(years)
+
+    return os.path.join(folder, f'{year}_England_pop.csv'), os.path.join(folder, f'{year}_pop_by_region.csv')
+
+
+class PopulationRegistry:
+    """
+    national and regional populations by single year of age, with group populations for any set of age
+    group bin edges computed once and kept
+    """
+
+    def __init__(self, national_file, regional_file):
+        """
+        :param national_file: Str - csv with 'age' and 'population' columns, in the form of '2019_England_pop.csv'
+        :param regional_file: Str - csv with a 'Name' column and a column per age, in the form
+        of '2019_pop_by_region.csv'
+        """
+        self.national_file = national_file
+        self.regional_file = regional_file
+
+        # national population by single year of age
+        national = pd.read_csv(national_file)
+        national['age'] = national['age'].replace('90+', 90).astype('int64')
+        self.national = national.set_index('age')['population'].reindex(AGES).to_numpy(dtype='float64')
+
+        # regional populations - one row per region, one column per single year of age
+        regional = pd.read_csv(regional_file)
+        age_cols = [str(age) for age in AGES[:-1]] + ['90+']
+        self.region_names = regional['Name'].tolist()
+        self.regional = regional[age_cols].to_numpy(dtype='float64')
+
+        # version of the populations loaded, from their contents, for data prepared with them and kept on disk
+        self.version = hashlib.blake2b(self.national.tobytes() + self.regional.tobytes()
+                                       + '\n'.join(self.region_names).encode(), digest_size=8).hexdigest()
+
+        # (region, bins) -> group populations, and bins -> age group of each single year of age
+        self.group_pops = {}
+        self.bin_lookups = {}
+
+        # population in the age groups hospital admissions come in, used to put all national data per 10k
+        self.admissions_pop = pd.Series(self.national_groups(ADMISSIONS_BINS), index=ADMISSIONS_AGE_GROUPS)
+
+    def single_year(self, region):
+        """
+        :param region: Str - region name, or 'England' for the sum of all regions
+        :return: ndarray - population for each single year of age
+        """
+        if region == 'England':
+            return self.regional.sum(axis=0)
+
+        return self.regional[self.region_names.index(region)]
+
+    def bin_lookup(self, bins):
+        """
+        :param bins: List - full list of age group edges including 0 and 120, as from create_bins_labels
+        :return: ndarray - index of the age group each single year of age falls in
+        """
+        key = tuple(bins)
+        if key not in self.bin_lookups:
+            self.bin_lookups[key] = np.digitize(AGES, bins[1:-1], right=False)
+
+        return self.bin_lookups[key]
+
+    def groups(self, region, bins):
+        """
+        :param region: Str - region name, or 'England' for the sum of all regions
+        :param bins: List - full list of age group edges including 0 and 120
+        :return: ndarray - population of each age group
+        """
+        key = (region, tuple(bins))
+        if key not in self.group_pops:
+            self.group_pops[key] = np.bincount(self.bin_lookup(bins), weights=self.single_year(region),
+                                               minlength=len(bins) - 1)
+
+        return self.group_pops[key]
+
+    def national_groups(self, bins):
+        """
+        :param bins: List - full list of age group edges including 0 and 120
+        :return: ndarray - population of each age group from the national population file
+        """
+        return np.bincount(self.bin_lookup(bins), weights=self.national, minlength=len(bins) - 1)
+
+
+registry = None
+
+
+def population_registry():
+    """
+    get the population registry, loading it on first use
+    :return: PopulationRegistry
+    """
+    global registry
+    if registry is None:
+        load_population_registry()
+
+    return registry
+
+
+def load_population_registry(year=POPULATION_YEAR, folder=POPULATION_DIR):
+    """
+    (re)load the population registry, eg to switch to a later mid-year estimate
+    :param year: Int or Str - year of estimates. if None, the latest year available is used
+    :param folder: Str - folder holding the population files
+    :return: PopulationRegistry
+    """
+    global registry
+    registry = PopulationRegistry(*find_population_files(year, folder))
+
+    return registry
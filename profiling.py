@@ -0,0 +1,87 @@
+# opt-in profiling of individual dash callback requests. when enabled, the dash callback endpoint is wrapped so
+# that requests carrying the profile header run under cProfile, and a profile for each is saved, tagged with the
+# callback name and inputs. when disabled nothing is wrapped, so there is no cost on the request path
+
+import cProfile
+import datetime
+import hashlib
+import io
+import json
+import os
+import pstats
+import flask
+from app_config import PROFILE_HEADER, PROFILE_DIR
+
+
+DASH_UPDATE_ENDPOINT = '/_dash-update-component'
+
+
+def callback_name(app, body):
+    """
+    :param app: Dash - the app
+    :param body: Dict - json body of a dash callback request
+    :return: Str - name of the python function handling the callback
+    """
+    callback = app.callback_map.get(body.get('output'), {}).get('callback')
+
+    return getattr(callback, '__name__', 'unknown')
+
+
+def save_profile(profile, name, inputs, profile_dir=PROFILE_DIR):
+    """
+    save a profile as a .prof file (for snakeviz / flameprof / gprof2dot flame graphs), a plain text call tree
+    sorted by cumulative time, and a .json file with the callback name and inputs
+    :param profile: cProfile.Profile - finished profile
+    :param name: Str - callback name
+    :param inputs: List - dash 'inputs' of the request, each a dict with id, property and value
+    :param profile_dir: Str - folder to save to
+    :return: Str - path of the saved files, without extension
+    """
+    os.makedirs(profile_dir, exist_ok=True)
+
+    inputs_json = json.dumps(inputs, sort_keys=True)
+    inputs_hash = hashlib.sha1(inputs_json.encode()).hexdigest()[:8]
+    timestamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+    path = os.path.join(profile_dir, f'{timestamp}_{name}_{inputs_hash}')
+
+    profile.dump_stats(path + '.prof')
+
+    text = io.StringIO()
+    stats = pstats.Stats(profile, stream=text).sort_stats('cumulative')
+    stats.print_stats(40)
+    stats.print_callees(20)
+    with open(path + '.txt', 'w') as f:
+        f.write(text.getvalue())
+
+    with open(path + '.json', 'w') as f:
+        json.dump({'callback': name, 'inputs': inputs, 'timestamp': timestamp}, f, indent=1)
+
+    return path
+
+
+def register_profiler(app, header=PROFILE_HEADER, profile_dir=PROFILE_DIR):
+    """
+    wrap the dash callback endpoint so requests with the profile header are profiled
+    :param app: Dash - the app
+    :param header: Str - request header which turns on profiling for a request
+    :param profile_dir: Str - folder to save profiles to
+    """
+    view_functions = app.server.view_functions
+    endpoint = app.config.routes_pathname_prefix.rstrip('/') + DASH_UPDATE_ENDPOINT
+    dispatch = view_functions[endpoint]
+
+    def profiled_dispatch(*args, **kwargs):
+        if not flask.request.headers.get(header):
+            return dispatch(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return dispatch(*args, **kwargs)
+        finally:
+            profile.disable()
+            body = flask.request.get_json()
+            path = save_profile(profile, callback_name(app, body), body.get('inputs', []), profile_dir)
+            app.logger.info(f'saved callback profile to {path}')
+
+    view_functions[endpoint] = profiled_dispatch
@@ -0,0 +1,189 @@
+# headless report generator - renders the app's views for a grid of parameters (every region x age grouping
+# on tab 1, every age group x lag on tab 3, plus the tab 2 views) straight from the callbacks, without starting
+# a server, across a pool of processes, and writes an index page linking them all:
+#
+#   python report_generator.py [--output reports/2021-07-20] [--bins 20,40,60 --bins 10,20,...] [--lags 7,14]
+#                              [--regions London,England] [--format html|png|svg] [--workers 8]
+#
+# html pages load plotly.js from a single copy written to the output folder, so the report works offline.
+# png and svg images need the kaleido package
+
+import argparse
+import datetime
+import html
+import importlib.util
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+# set before the app is imported - a report run is not a deploy, so it doesn't add to the pipeline report
+os.environ.setdefault('PIPELINE_REPORT_FILE', '')
+
+import plotly.offline
+import covid_analysis_app as app_module
+from trace_updates import update_figure
+
+
+def slug(text):
+    return re.sub(r'[^a-z0-9]+', '-', str(text).lower()).strip('-')
+
+
+def report_grid(regions, bin_sets, age_groups, lags, start_date=3, rolling_avge_length=7, growth_rate_length=21,
+                growth_rate_average_length=5, ratio_rolling=14, offset_days=7):
+    """
+    list the views to render
+    :param regions: List - regions for tab 1
+    :param bin_sets: List - of lists of age group edges for tab 1
+    :param age_groups: List - admissions age groups for tabs 2 and 3
+    :param lags: List - admission lags for tab 3
+    :param start_date: Int - index of first month shown, as from the start date slider
+    :return: List - of (section, title, callback name, callback args) for each view
+    """
+    last = len(app_module.dates) - 1
+    views = []
+
+    for region in regions:
+        for bins in bin_sets:
+            views.append(('Cases and growth by region and age group', f'{region} - age bins {bins}',
+                          'update_graphs1', (region, start_date, rolling_avge_length, growth_rate_length,
+                                             growth_rate_average_length, list(bins), [], [], [], [])))
+            views.append(('Cases and growth by region and age group', f'{region} - Rt, age bins {bins}',
+                          'update_graph1_3', (region, start_date, list(bins), [], [], [], [])))
+
+    views.append(('Vaccination and admissions to cases ratio', 'Cumulative vaccinations', 'update_graph2_1',
+                  (start_date, age_groups)))
+    views.append(('Vaccination and admissions to cases ratio', f'Admissions to cases ratio, offset {offset_days} days',
+                  'update_graph2_2', (start_date, ratio_rolling, offset_days, age_groups)))
+
+    for age_group in age_groups:
+        for lag in lags:
+            views.append(('Admissions against cases by lag', f'{age_group} - lag {lag} days', 'update_graphs3',
+                          ([start_date, last], ratio_rolling, lag, age_group, 'date')))
+
+    return views
+
+
+def render_view(view, folder, file_format):
+    """
+    render one view's figures to files. runs in a pool process
+    :param view: Tuple - (section, title, callback name, callback args), as from report_grid
+    :param folder: Str - folder to write to
+    :param file_format: Str - 'html', 'png' or 'svg'
+    :return: Tuple - the view, with the list of files written and seconds taken
+    """
+    section, title, name, args = view
+    start = time.perf_counter()
+
+    # the callback as decorated for the app, under dash's own wrapper which needs a request
+    figures = getattr(app_module, name).__wrapped__(*args)
+    if not isinstance(figures, (list, tuple)):
+        figures = [figures]
+
+    # graphs updated a trace at a time give update messages, which are whole figures with no figure to update
+    figures = [update_figure(figure) if isinstance(figure, dict) else figure for figure in figures]
+
+    base = slug(f'{name} {title}')
+    if file_format == 'html':
+        divs = [figure.to_html(full_html=False, include_plotlyjs=False) for figure in figures]
+        files = [f'{base}.html']
+        with open(os.path.join(folder, files[0]), 'w') as f:
+            f.write(f'<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+                    f'<script src="plotly.min.js"></script></head><body><h2>{html.escape(title)}</h2>'
+                    + ''.join(divs) + '</body></html>')
+    else:
+        files = [f'{base}-{i + 1}.{file_format}' for i in range(len(figures))]
+        for figure, file in zip(figures, files):
+            figure.write_image(os.path.join(folder, file))
+
+    return section, title, files, time.perf_counter() - start
+
+
+def write_index(folder, results, seconds):
+    """
+    write index.html linking every rendered view, grouped by section
+    :param results: List - of (section, title, files, seconds) from render_view
+    """
+    sections = {}
+    for section, title, files, _ in results:
+        sections.setdefault(section, []).append((title, files))
+
+    lines = ['<html><head><meta charset="utf-8"><title>Covid analysis report</title></head><body>',
+             '<h1>Covid analysis report</h1>',
+             f'<p>Data to {app_module.end_date:%d %B %Y}. Generated {datetime.datetime.now():%d %B %Y %H:%M} '
+             f'({len(results)} views in {seconds:.0f} seconds).</p>']
+    for section, views in sections.items():
+        lines.append(f'<h2>{html.escape(section)}</h2><ul>')
+        for title, files in views:
+            links = ' '.join(f'<a href="{file}">{html.escape(title) if len(files) == 1 else i + 1}</a>'
+                             for i, file in enumerate(files))
+            lines.append(f'<li>{links if len(files) == 1 else html.escape(title) + ": " + links}</li>')
+        lines.append('</ul>')
+    lines.append('</body></html>')
+
+    with open(os.path.join(folder, 'index.html'), 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def generate_report(folder, views, file_format='html', workers=None):
+    """
+    render views across a process pool and write the index page
+    :param folder: Str - folder to write the report to
+    :param views: List - as from report_grid
+    :param file_format: Str - 'html', 'png' or 'svg'
+    :param workers: Int - pool processes. defaults to the number of cores
+    :return: List - of (section, title, files, seconds) for each view
+    """
+    os.makedirs(folder, exist_ok=True)
+    if file_format == 'html':
+        with open(os.path.join(folder, 'plotly.min.js'), 'w') as f:
+            f.write(plotly.offline.get_plotlyjs())
+
+    # the app's data is loaded on import, above, so forked pool processes start with it already in memory
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        results = list(pool.map(render_view, views, [folder] * len(views), [file_format] * len(views)))
+    seconds = time.perf_counter() - start
+
+    write_index(folder, results, seconds)
+
+    return results
+
+
+def parse_list(text, convert=str):
+    return [convert(item.strip()) for item in text.split(',') if item.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='render the app views for a grid of parameters to a static report')
+    parser.add_argument('--output', help='folder to write to. defaults to reports/<last data date>')
+    parser.add_argument('--regions', help='comma separated regions for tab 1. defaults to all, and England')
+    parser.add_argument('--bins', action='append', help='comma separated age group edges for tab 1. repeat for '
+                        'several groupings. defaults to 20,40,60')
+    parser.add_argument('--age-groups', help='comma separated admissions age groups. defaults to all')
+    parser.add_argument('--lags', default='7,14', help='comma separated admission lags for tab 3')
+    parser.add_argument('--start-date', type=int, default=3, help='index of the first month shown')
+    parser.add_argument('--format', choices=['html', 'png', 'svg'], default='html')
+    parser.add_argument('--workers', type=int, help='pool processes. defaults to the number of cores')
+    args = parser.parse_args()
+
+    if args.format != 'html' and importlib.util.find_spec('kaleido') is None:
+        sys.exit(f'{args.format} images need the kaleido package - pip install kaleido, or use --format html')
+
+    regions = parse_list(args.regions) if args.regions else app_module.region_names
+    unknown = [region for region in regions if region not in app_module.region_names]
+    if unknown:
+        sys.exit(f'unknown regions: {", ".join(unknown)}')
+
+    views = report_grid(regions,
+                        [parse_list(bins, int) for bins in args.bins or ['20,40,60']],
+                        parse_list(args.age_groups) if args.age_groups else app_module.panel.groups['admissions'],
+                        parse_list(args.lags, int),
+                        start_date=args.start_date)
+
+    folder = args.output or os.path.join('reports', f'{app_module.end_date:%Y-%m-%d}')
+    results = generate_report(folder, views, args.format, args.workers)
+    print(f'{len(results)} views written to {os.path.join(folder, "index.html")} in '
+          f'{sum(result[3] for result in results):.1f} seconds of rendering')
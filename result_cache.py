@@ -0,0 +1,96 @@
+# cache of callback results keyed by callback inputs. callbacks are pure functions of their inputs and the data
+# loaded at startup, so repeat requests (eg going back to a previous slider position) can be served directly
+
+import json
+import threading
+from collections import OrderedDict
+from functools import wraps
+from app_config import RESULT_CACHE_SIZE
+from instrumentation import record_cache_result
+
+
+class ResultCache:
+    """
+    thread-safe least recently used cache of callback results
+    """
+
+    def __init__(self, maxsize=RESULT_CACHE_SIZE):
+        """
+        :param maxsize: Int - number of results to keep. 0 disables the cache
+        """
+        self.maxsize = maxsize
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: 2-tuple - (True, result) if key is cached, else (False, None)
+        """
+        with self.lock:
+            if key not in self.results:
+                return False, None
+            self.results.move_to_end(key)
+            return True, self.results[key]
+
+    def put(self, key, result):
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            self.results[key] = result
+            self.results.move_to_end(key)
+            while len(self.results) > self.maxsize:
+                self.results.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+
+    def __len__(self):
+        return len(self.results)
+
+
+# every result cache created, by name, so they can all be reported on or cleared when data changes
+caches = {}
+
+
+def cache_key(*args):
+    """
+    :return: Str - key for a set of callback inputs (lists, numbers and strings)
+    """
+    return json.dumps(args, sort_keys=True, default=str)
+
+
+def cached(name, maxsize=RESULT_CACHE_SIZE):
+    """
+    decorator caching a callback's results by its inputs, and recording hits and misses with instrumentation
+    :param name: Str - cache name, normally the callback name
+    :param maxsize: Int - number of results to keep
+    """
+    cache = caches.setdefault(name, ResultCache(maxsize))
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args):
+            key = cache_key(*args)
+            hit, result = cache.get(key)
+            record_cache_result(hit)
+            if not hit:
+                result = func(*args)
+                cache.put(key, result)
+
+            return result
+
+        wrapper.cache = cache
+
+        return wrapper
+
+    return decorator
+
+
+def clear_caches():
+    """
+    empty every result cache, eg after the data has been refreshed
+    """
+    for cache in caches.values():
+        cache.clear()
@@ -0,0 +1,179 @@
+# single-flight coalescing of callback computations. when a callback is already computing for a set of inputs,
+# further calls with the same inputs wait for it and share its result instead of computing it again, so a burst
+# of identical requests (a shared link, or everyone's browser right after a data refresh) costs one computation.
+# within a worker calls wait on the first thread's computation; across gunicorn workers, if a lock folder is set,
+# the first worker holds a file lock while computing and leaves the result on disk for the others to pick up. as
+# each worker loads its own data, files on disk are named by the data version as well as the inputs
+
+import fcntl
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from functools import wraps
+from app_config import SINGLE_FLIGHT, SINGLE_FLIGHT_DIR, SINGLE_FLIGHT_TTL
+from instrumentation import record_coalesced
+from result_cache import cache_key
+
+
+class Flight:
+    """
+    a computation in progress, which other threads can wait on for its result
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+
+class SingleFlight:
+    """
+    runs at most one computation per key at a time, sharing its result with every caller asking for the same key
+    while it runs
+    """
+
+    def __init__(self, name, lock_dir=SINGLE_FLIGHT_DIR, ttl=SINGLE_FLIGHT_TTL, version=None):
+        """
+        :param name: Str - name of what is computed, used to name lock and result files
+        :param lock_dir: Str - folder shared by the workers for lock and result files. None to only coalesce
+        calls within this process
+        :param ttl: Float - seconds a result left on disk is used by other workers
+        :param version: Str - version of the data the computation uses. workers each load their own data, so
+        results left on disk are only shared between workers with the same version
+        """
+        self.name = name
+        self.version = version
+        self.lock_dir = lock_dir
+        self.ttl = ttl
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """
+        :param key: Str - identifies the computation, eg from result_cache.cache_key
+        :param func: function - the computation
+        :param args: passed on to func
+        :return: 2-tuple - result of func(*args), and whether it was shared from another call ('process' or
+        'worker') or computed by this one (None)
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            return flight.wait(), 'process'
+
+        try:
+            if self.lock_dir is None:
+                flight.result, shared = func(*args), None
+            else:
+                flight.result, shared = self.do_across_workers(key, func, *args)
+            return flight.result, shared
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def paths(self, key):
+        digest = hashlib.sha1(f'{self.version}:{key}'.encode()).hexdigest()
+        base = os.path.join(self.lock_dir, f'{self.name}-{digest}')
+
+        return base + '.lock', base + '.pkl'
+
+    def read_result(self, path):
+        """
+        :return: 2-tuple - (True, result) if another worker left a result at path within the ttl, else (False, None)
+        """
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return False, None
+            with open(path, 'rb') as f:
+                return True, pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+
+    def remove_expired(self):
+        """
+        delete results left on disk which are past the ttl. lock files are left, as another worker may be waiting
+        on them
+        """
+        now = time.time()
+        for entry in os.scandir(self.lock_dir):
+            if entry.name.startswith(f'{self.name}-') and entry.name.endswith('.pkl'):
+                try:
+                    if now - entry.stat().st_mtime > self.ttl:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def do_across_workers(self, key, func, *args):
+        """
+        compute under a file lock shared by the workers, or pick up the result of a worker which computed it
+        while this one waited for the lock
+        """
+        os.makedirs(self.lock_dir, exist_ok=True)
+        lock_path, result_path = self.paths(key)
+
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                found, result = self.read_result(result_path)
+                if found:
+                    return result, 'worker'
+
+                result = func(*args)
+
+                # write then rename, so other workers never read a partly written result
+                fd, tmp_path = tempfile.mkstemp(dir=self.lock_dir)
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, result_path)
+                self.remove_expired()
+
+                return result, None
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def coalesced(name, enabled=SINGLE_FLIGHT, version=None):
+    """
+    decorator coalescing concurrent calls of a callback with identical inputs. place below @cached, so only
+    cache misses are coalesced
+    :param name: Str - callback name
+    :param enabled: Boolean - False to leave the callback unchanged
+    :param version: Str - version of the data the callback uses, eg data_version
+    """
+    def decorator(func):
+        if not enabled:
+            return func
+
+        flights = SingleFlight(name, version=version)
+
+        @wraps(func)
+        def wrapper(*args):
+            result, shared = flights.do(cache_key(*args), func, *args)
+            if shared is not None:
+                record_coalesced(shared)
+
+            return result
+
+        wrapper.flights = flights
+
+        return wrapper
+
+    return decorator
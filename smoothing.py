@@ -0,0 +1,120 @@
+# smoothing filter bank shared by every tab - trailing and centred means, exponential weighting and
+# savitzky-golay. the fixed length filters are a kernel of weights applied along the date axis of an array of any
+# number of groups at once, through a sliding window view rather than a pandas window object per call. exponential
+# weighting is computed recursively along the date axis instead, so it needs no more memory than its input.
+# kernels are built once per (filter, window). results are not cached here - the callbacks and engine functions
+# smoothing is called from cache their own results by input
+
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+
+# filter name -> label, as offered in the app
+FILTERS = {
+    'trailing': 'trailing mean',
+    'centered': 'centred mean',
+    'ewm': 'exponentially weighted',
+    'savgol': 'Savitzky-Golay (even windows rounded up to odd)',
+}
+
+# polynomial order of savitzky-golay filters
+SAVGOL_ORDER = 2
+
+
+@lru_cache(maxsize=None)
+def kernel(method, window):
+    """
+    :param method: Str - one of FILTERS other than 'ewm'
+    :param window: Int - window length. for 'savgol', an even window is rounded up to the next odd length
+    :return: 2-tuple - weights, oldest date first, and the offset of the date each window's value is given
+    to from the start of the window. read only
+    """
+    if method == 'trailing':
+        weights, offset = np.full(window, 1 / window), window - 1
+    elif method == 'centered':
+        weights, offset = np.full(window, 1 / window), window // 2
+    elif method == 'savgol':
+        # least squares polynomial fit over a window centred on each date, so an even window is rounded up to
+        # the next odd length
+        window += 1 - window % 2
+        half = window // 2
+        order = min(SAVGOL_ORDER, 2 * half)
+        vander = np.vander(np.arange(-half, half + 1), order + 1, increasing=True)
+        weights, offset = np.linalg.pinv(vander)[0], half
+    else:
+        raise ValueError(f'unknown smoothing filter {method}, expected one of {", ".join(FILTERS)}')
+
+    weights.flags.writeable = False
+
+    return weights, offset
+
+
+def ewm(values, span):
+    """
+    exponentially weighted mean along the last axis, as pandas ewm(span=span) - each value weighted by
+    (1 - alpha) ** age, with missing values skipped and the weights of the values present renormalised. running
+    weighted totals are carried from date to date, so memory is that of the input whatever the span
+    :param values: ndarray - values with dates along the last axis
+    :param span: Int - span, so weights decay by 2 / (span + 1) a day
+    :return: ndarray - smoothed values, same shape. NaN until the first value present
+    """
+    decay = 1 - 2 / (span + 1)
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0)
+
+    smoothed = np.empty(values.shape)
+    total = np.zeros(values.shape[:-1])
+    weight = np.zeros(values.shape[:-1])
+    mean = np.full(values.shape[:-1], np.nan)
+    for i in range(values.shape[-1]):
+        total = decay * total + filled[..., i]
+        weight = decay * weight + present[..., i]
+        # the mean carries through missing values unchanged
+        mean = np.where(present[..., i], total / np.where(weight > 0, weight, 1), mean)
+        smoothed[..., i] = mean
+
+    return smoothed
+
+
+def apply_kernel(values, method, window, axis=0):
+    """
+    :param values: ndarray - values with dates along axis
+    :return: ndarray - smoothed values, same shape. NaN where a mean or savitzky-golay window is not full or
+    includes a NaN, as pandas rolling windows. exponential weighting skips NaNs, reweighting the values present
+    """
+    values = np.moveaxis(np.asarray(values, dtype='float64'), axis, -1)
+
+    if method == 'ewm':
+        return np.moveaxis(ewm(values, window), -1, axis)
+
+    weights, offset = kernel(method, window)
+    smoothed = np.full(values.shape, np.nan)
+    if len(weights) <= values.shape[-1]:
+        windows = np.lib.stride_tricks.sliding_window_view(values, len(weights), axis=-1)
+        smoothed[..., offset:offset + windows.shape[-2]] = windows @ weights
+
+    return np.moveaxis(smoothed, -1, axis)
+
+
+def smooth(values, method='trailing', window=7, axis=0):
+    """
+    smooth every series in an array along its date axis
+    :param values: ndarray - values with dates along axis, eg of shape (dates, groups)
+    :param method: Str - one of FILTERS
+    :param window: Int - window length, or span for 'ewm'. savitzky-golay windows are centred on each date, so
+    an even window is rounded up to the next odd length (eg 14 days is fitted over 15)
+    :param axis: Int - date axis
+    :return: ndarray - smoothed values, same shape
+    """
+    return apply_kernel(values, method, window, axis)
+
+
+def smooth_frame(df, method='trailing', window=7):
+    """
+    :param df: DataFrame - datetime index, a column per series
+    :param method: Str - one of FILTERS
+    :param window: Int - window length, or span for 'ewm'
+    :return: DataFrame - smoothed copy, with the same index and columns
+    """
+    return pd.DataFrame(smooth(df.to_numpy(dtype='float64'), method, window), index=df.index, columns=df.columns)
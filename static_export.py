@@ -0,0 +1,467 @@
+# static export of the whole app, for hosting without a server. enumerates the inputs each chart callback can
+# be given from the tab layouts (every dropdown, radio item and slider position, range slider pairs, and
+# checklist combinations up to a limit), renders every figure across a pool of processes, and writes them as
+# content-addressed gzipped json files, an index per callback of inputs -> figure files, a manifest, and a
+# static page which fetches the files directly:
+#
+#   python static_export.py [--output static_site] [--vary Region,start_date,...] [--max-checked 1]
+#                           [--max-figures 50000] [--callbacks update_graphs3] [--workers 8] [--count]
+#
+# components not varied are held at their default value in the layout. unchanged figures keep their file
+# names, so rebuilding after a data update only writes what changed, and files no longer referenced are deleted
+
+import argparse
+import datetime
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+# set before the app is imported - an export is not a deploy, so it doesn't add to the pipeline report, and
+# every figure is rendered once so there is nothing to gain from the result caches
+os.environ.setdefault('PIPELINE_REPORT_FILE', '')
+os.environ.setdefault('RESULT_CACHE_SIZE', '0')
+
+import plotly.offline
+import plotly.utils
+import covid_analysis_app as app_module
+from trace_updates import update_id, rendered_id, update_figure
+
+
+# components varied unless --vary is given. the rest are held at their default
+DEFAULT_VARY = ['Region', 'start_date', 'rate_type', 'age_bins_list1', 'age_bins_list2', 'age_bins_list3',
+                'age_bins_list4', 'age_bins_list5', 'age_gps', 'offset_days', 'resolution', 'date_range',
+                'admission_lag', 'scatter_colour']
+
+# figures rendered per pool task
+CHUNK_SIZE = 50
+
+
+def content_key(values):
+    """
+    :param values: List - callback input values
+    :return: Str - key of the inputs in the callback index. the same as JSON.stringify(values) in the browser
+    """
+    return json.dumps(values, separators=(',', ':'), ensure_ascii=False)
+
+
+def layout_components(tree, found=None, label=None):
+    """
+    :param tree: Dict or List - serialised dash layout
+    :param found: Dict - components found so far
+    :param label: List - holder for the text of the last label seen, which labels the component following it
+    :return: Dict - component id -> dict of type, props and label, for every component with an id
+    """
+    found = {} if found is None else found
+    label = [None] if label is None else label
+
+    if isinstance(tree, list):
+        for child in tree:
+            layout_components(child, found, label)
+    elif isinstance(tree, dict) and 'props' in tree:
+        props = tree['props']
+        if tree.get('type') == 'Label' and isinstance(props.get('children'), str):
+            label[0] = props['children']
+        elif 'id' in props:
+            # a label heads the component following it. the rest (eg the further age group checklists) have none
+            found[props['id']] = {'type': tree['type'], 'props': props, 'label': label[0] or ''}
+            label[0] = None
+        layout_components(props.get('children'), found, label)
+
+    return found
+
+
+def component_options(component):
+    """
+    :param component: Dict - as from layout_components
+    :return: List - of {'label', 'value'} for each value the component can take. checklists give their boxes
+    """
+    props = component['props']
+    if 'options' in props:
+        return [{'label': str(option['label']), 'value': option['value']} for option in props['options']]
+
+    # sliders - every step, labelled by their marks where there are any
+    marks = {str(mark): text for mark, text in (props.get('marks') or {}).items()}
+    values = range(props['min'], props['max'] + 1, props.get('step') or 1)
+
+    return [{'label': str(marks.get(str(value), value)), 'value': value} for value in values]
+
+
+def chart_callbacks():
+    """
+    :return: Dict - callback name -> (function, list of input ids, list of graph ids), for every callback which
+    only updates graphs, with whole figures or a trace at a time through update stores (see trace_updates.py)
+    """
+    callbacks = {}
+    for output, spec in app_module.app.callback_map.items():
+        outputs = [part.rsplit('.', 1) for part in output.strip('.').split('...')]
+        graphs = [id_ if prop == 'figure' else id_[:-len(update_id(''))] for id_, prop in outputs]
+        if any(prop != 'figure' and (prop, id_) != ('data', update_id(graph))
+               for (id_, prop), graph in zip(outputs, graphs)):
+            continue
+        if any(item['id'] not in [rendered_id(graph) for graph in graphs] for item in spec.get('state', [])):
+            continue
+
+        # the function as decorated for the app, under dash's own wrapper which needs a request
+        func = spec['callback'].__wrapped__
+        callbacks[func.__name__] = (func, [item['id'] for item in spec['inputs']], graphs)
+
+    return callbacks
+
+
+def tab_layouts():
+    """
+    :return: List - of (tab value, tab label, components by id) for each tab, rendered by the app's own callback
+    """
+    tabs = app_module.app.layout['tabs'].children
+    render = app_module.render_content.__wrapped__
+    tabs = [(tab.value, tab.label, render(tab.value)) for tab in tabs]
+
+    return [(value, label, layout_components(json.loads(json.dumps(layout, cls=plotly.utils.PlotlyJSONEncoder))))
+            for value, label, layout in tabs]
+
+
+def input_grid(inputs, components, vary, max_checked):
+    """
+    every combination of input values for a callback
+    :param inputs: List - input ids, in order
+    :param components: Dict - component id -> component, for the callback's tab
+    :param vary: Set - ids of components to vary. others are held at their default
+    :param max_checked: Int - most boxes checked across all of the callback's checklists together
+    :return: 2-tuple - dict of id -> number of values taken, and generator of input value lists
+    """
+    choices = {}
+    checklists = [id_ for id_ in inputs if components[id_]['type'] == 'Checklist' and id_ in vary]
+
+    for id_ in inputs:
+        component = components[id_]
+        if id_ not in vary:
+            choices[id_] = [component['props'].get('value')]
+        elif component['type'] == 'RangeSlider':
+            values = [option['value'] for option in component_options(component)]
+            choices[id_] = [[low, high] for low, high in itertools.combinations_with_replacement(values, 2)]
+        elif component['type'] != 'Checklist':
+            choices[id_] = [option['value'] for option in component_options(component)]
+
+    # checklists are combined, as callbacks take their boxes together (eg the age group edges on tab 1)
+    boxes = [(id_, option['value']) for id_ in checklists for option in component_options(components[id_])]
+    selections = [[[value for box_id, value in checked if box_id == id_] for id_ in checklists]
+                  for k in range(max_checked + 1) for checked in itertools.combinations(boxes, k)]
+
+    counts = {id_: len(values) for id_, values in choices.items()}
+    if checklists:
+        counts[' + '.join(checklists)] = len(selections)
+
+    def grid():
+        for values in itertools.product(*[choices[id_] for id_ in inputs if id_ in choices],
+                                        selections or [[]]):
+            fixed, checked = iter(values[:-1]), iter(values[-1])
+            yield [next(checked) if id_ in checklists else next(fixed) for id_ in inputs]
+
+    return counts, grid()
+
+
+def write_content(folder, data, subfolder, extension='json.gz'):
+    """
+    gzip and write data under its content hash, unless already written
+    :param data: Bytes - uncompressed content
+    :return: Str - path of the file, relative to folder
+    """
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    path = os.path.join(subfolder, digest[:2], f'{digest}.{extension}')
+    full_path = os.path.join(folder, path)
+
+    if not os.path.exists(full_path):
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(gzip.compress(data, mtime=0))
+        os.replace(tmp_path, full_path)
+
+    return path
+
+
+def remove_unreferenced(folder, referenced, subfolders=('figures', 'index')):
+    """
+    delete content files an export no longer references (eg figures superseded by a data update), and any
+    folders left empty
+    :param referenced: Set - paths of the files in use, relative to folder
+    :return: Int - number of files deleted
+    """
+    removed = 0
+    for subfolder in subfolders:
+        top = os.path.join(folder, subfolder)
+        for root, _, files in os.walk(top, topdown=False):
+            for file in files:
+                path = os.path.join(root, file)
+                if os.path.relpath(path, folder) not in referenced:
+                    os.remove(path)
+                    removed += 1
+            if root != top and not os.listdir(root):
+                os.rmdir(root)
+
+    return removed
+
+
+def render_chunk(name, folder, chunk):
+    """
+    render the figures for a chunk of input combinations of a callback. runs in a pool process
+    :param chunk: List - of input value lists
+    :return: List - of (key, list of figure file paths, one per output)
+    """
+    func = chart_callbacks()[name][0]
+    results = []
+    for values in chunk:
+        figures = func(*values)
+        if not isinstance(figures, (list, tuple)):
+            figures = [figures]
+        figures = [update_figure(figure) if isinstance(figure, dict) else figure for figure in figures]
+        results.append((content_key(values), [write_content(folder, figure.to_json().encode(), 'figures')
+                                              for figure in figures]))
+
+    return results
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_site(folder, vary=DEFAULT_VARY, max_checked=1, max_figures=50000, names=None, workers=None,
+                count_only=False):
+    """
+    enumerate and render every chart callback's figures, and write the index files, manifest and static page
+    :param folder: Str - folder to write the site to
+    :param vary: List - component ids to vary
+    :param max_checked: Int - most boxes checked across a callback's checklists
+    :param max_figures: Int - most input combinations per callback, as a guard against an unintended size
+    :param names: List - callbacks to export. all chart callbacks if None
+    :param workers: Int - pool processes. defaults to the number of cores
+    :param count_only: Boolean - only report the number of combinations per callback
+    :return: Dict - the manifest
+    """
+    callbacks = chart_callbacks()
+    tabs = tab_layouts()
+    names = list(callbacks) if names is None else names
+
+    # the tab each callback's inputs are on, and its grid of inputs
+    plan = {}
+    for name in names:
+        func, inputs, outputs = callbacks[name]
+        tab, _, components = next(tab for tab in tabs if all(id_ in tab[2] for id_ in inputs + outputs))
+        counts, grid = input_grid(inputs, components, set(vary), max_checked)
+        total = int(np.prod(list(counts.values())))
+        print(f'{name}: {total} combinations ({", ".join(f"{id_} {n}" for id_, n in counts.items())})')
+        if total > max_figures and not count_only:
+            sys.exit(f'{name} has more than --max-figures {max_figures} combinations - vary fewer components or '
+                     f'check fewer boxes')
+        plan[name] = (tab, inputs, outputs, components, grid, total)
+
+    if count_only:
+        return None
+
+    os.makedirs(folder, exist_ok=True)
+    manifest = {'generated': f'{datetime.datetime.now():%Y-%m-%d %H:%M}',
+                'data_end_date': f'{app_module.end_date:%Y-%m-%d}',
+                'max_checked': max_checked,
+                'tabs': [], 'callbacks': {}}
+
+    # every figure and index file the new manifest refers to
+    referenced = set()
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for name, (tab, inputs, outputs, components, grid, total) in plan.items():
+            start = time.perf_counter()
+            futures = [pool.submit(render_chunk, name, folder, chunk) for chunk in chunked(grid, CHUNK_SIZE)]
+            index = dict(item for future in futures for item in future.result())
+            print(f'{name}: {len(index)} figure sets in {time.perf_counter() - start:.0f} seconds')
+
+            manifest['callbacks'][name] = {
+                'tab': tab, 'inputs': inputs, 'outputs': outputs,
+                'index': write_content(folder, json.dumps(index, separators=(',', ':')).encode(), 'index')}
+            referenced.update(path for paths in index.values() for path in paths)
+            referenced.add(manifest['callbacks'][name]['index'])
+
+    # controls for each tab's inputs, with the values they can take in the export
+    for tab, label, components in tabs:
+        tab_callbacks = [name for name in manifest['callbacks'] if manifest['callbacks'][name]['tab'] == tab]
+        if not tab_callbacks:
+            continue
+        ids = list(dict.fromkeys(id_ for name in tab_callbacks for id_ in manifest['callbacks'][name]['inputs']))
+        manifest['tabs'].append({
+            'value': tab, 'label': label, 'callbacks': tab_callbacks,
+            'controls': [{'id': id_, 'type': components[id_]['type'], 'label': components[id_]['label'],
+                          'options': component_options(components[id_]),
+                          'value': components[id_]['props'].get('value'), 'varied': id_ in vary}
+                         for id_ in ids]})
+
+    with open(os.path.join(folder, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    with open(os.path.join(folder, 'plotly.min.js'), 'w') as f:
+        f.write(plotly.offline.get_plotlyjs())
+    with open(os.path.join(folder, 'static_app.js'), 'w') as f:
+        f.write(STATIC_APP_JS)
+    with open(os.path.join(folder, 'index.html'), 'w') as f:
+        f.write(INDEX_HTML)
+
+    # only once the new manifest is written, so the site in the folder stays whole throughout
+    print(f'removed {remove_unreferenced(folder, referenced)} files no longer referenced')
+
+    return manifest
+
+
+INDEX_HTML = '''<html><head><meta charset="utf-8"><title>Analysis of England COVID data</title>
+<script src="plotly.min.js"></script><script src="static_app.js"></script>
+<style>body{font-family:Arial} .controls{width:30%;float:left} .graphs{width:68%;float:left}
+label{display:block;margin-top:12px;font-size:15px} #message{color:#a00}</style>
+</head><body><h3>Analysis of England COVID data</h3><p id="generated"></p><div id="tabs"></div>
+<p id="message"></p><div class="controls" id="controls"></div><div class="graphs" id="graphs"></div>
+</body></html>
+'''
+
+# the page - reads the manifest, draws controls for the chosen tab, and on each change looks up the figure files
+# for the inputs in the callback indexes and draws them
+STATIC_APP_JS = r'''
+let manifest = null;
+const indexes = {};
+const state = {};
+
+async function fetchJson(path) {
+  const bytes = new Uint8Array(await (await fetch(path)).arrayBuffer());
+  // hosts may serve .gz files already decoded
+  if (bytes[0] === 0x1f && bytes[1] === 0x8b) {
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+    return JSON.parse(await new Response(stream).text());
+  }
+  return JSON.parse(new TextDecoder().decode(bytes));
+}
+
+function control(spec) {
+  const box = document.createElement('div');
+  if (spec.label) {
+    const label = document.createElement('label');
+    label.textContent = spec.label;
+    box.appendChild(label);
+  }
+  state[spec.id] = spec.value;
+
+  if (spec.type === 'Checklist') {
+    spec.options.forEach(option => {
+      const input = document.createElement('input');
+      input.type = 'checkbox';
+      input.checked = (spec.value || []).includes(option.value);
+      input.disabled = !spec.varied;
+      input.onchange = () => {
+        const checked = Array.from(box.querySelectorAll('input')).map((el, i) => el.checked ? spec.options[i].value : null);
+        state[spec.id] = checked.filter(value => value !== null);
+        update();
+      };
+      box.appendChild(input);
+      box.appendChild(document.createTextNode(option.label + ' '));
+    });
+  } else {
+    const ends = spec.type === 'RangeSlider' ? [0, 1] : [null];
+    ends.forEach(end => {
+      const select = document.createElement('select');
+      select.disabled = !spec.varied;
+      spec.options.forEach((option, i) => {
+        const el = document.createElement('option');
+        el.value = i;
+        el.textContent = option.label;
+        el.selected = (end === null ? spec.value : spec.value[end]) === option.value;
+        select.appendChild(el);
+      });
+      select.onchange = () => {
+        const value = spec.options[select.value].value;
+        if (end === null) { state[spec.id] = value; } else { state[spec.id] = state[spec.id].slice(); state[spec.id][end] = value; }
+        update();
+      };
+      box.appendChild(select);
+    });
+  }
+  return box;
+}
+
+async function update() {
+  const tab = manifest.tabs.find(tab => tab.value === state.tab);
+  const missing = [];
+  for (const name of tab.callbacks) {
+    const callback = manifest.callbacks[name];
+    indexes[name] = indexes[name] || await fetchJson(callback.index);
+    const files = indexes[name][JSON.stringify(callback.inputs.map(id => state[id]))];
+    if (!files) { missing.push(name); continue; }
+    const figures = await Promise.all(files.map(fetchJson));
+    figures.forEach((figure, i) => Plotly.react(callback.outputs[i], figure.data, figure.layout));
+  }
+  document.getElementById('message').textContent = missing.length ?
+    `Not precomputed for this combination of options (at most ${manifest.max_checked} boxes checked)` : '';
+}
+
+function showTab(value) {
+  state.tab = value;
+  const tab = manifest.tabs.find(tab => tab.value === value);
+  const controls = document.getElementById('controls');
+  const graphs = document.getElementById('graphs');
+  controls.innerHTML = '';
+  graphs.innerHTML = '';
+  tab.controls.forEach(spec => controls.appendChild(control(spec)));
+  tab.callbacks.forEach(name => manifest.callbacks[name].outputs.forEach(id => {
+    const div = document.createElement('div');
+    div.id = id;
+    graphs.appendChild(div);
+  }));
+  update();
+}
+
+window.onload = async () => {
+  manifest = await (await fetch('manifest.json')).json();
+  document.getElementById('generated').textContent = `Data to ${manifest.data_end_date}, generated ${manifest.generated}`;
+  manifest.tabs.forEach(tab => {
+    const button = document.createElement('button');
+    button.textContent = tab.label;
+    button.onclick = () => showTab(tab.value);
+    document.getElementById('tabs').appendChild(button);
+  });
+  showTab(manifest.tabs[0].value);
+};
+'''
+
+
+def parse_list(text):
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='precompute every figure of the app into a static site')
+    parser.add_argument('--output', default='static_site', help='folder to write the site to')
+    parser.add_argument('--vary', help=f'comma separated components to vary. defaults to {",".join(DEFAULT_VARY)}')
+    parser.add_argument('--max-checked', type=int, default=1,
+                        help='most boxes checked across the checklists of a callback')
+    parser.add_argument('--max-figures', type=int, default=50000, help='most input combinations per callback')
+    parser.add_argument('--callbacks', help='comma separated callbacks to export. defaults to every chart')
+    parser.add_argument('--workers', type=int, help='pool processes. defaults to the number of cores')
+    parser.add_argument('--count', action='store_true', help='only report the combinations per callback')
+    args = parser.parse_args()
+
+    names = parse_list(args.callbacks) if args.callbacks else None
+    unknown = [name for name in names or [] if name not in chart_callbacks()]
+    if unknown:
+        sys.exit(f'unknown callbacks: {", ".join(unknown)}')
+
+    start = time.perf_counter()
+    manifest = export_site(args.output, parse_list(args.vary) if args.vary else DEFAULT_VARY, args.max_checked,
+                           args.max_figures, names, args.workers, args.count)
+    if manifest is not None:
+        print(f'site written to {os.path.join(args.output, "index.html")} in {time.perf_counter() - start:.0f} '
+              f'seconds')
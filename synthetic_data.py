@@ -0,0 +1,318 @@
+# synthetic versions of the gov.uk api downloads, with the same columns and row order (newest first), and matching
+# population files, for running the app, benchmarks and load tests offline at any scale. numbers follow smooth
+# waves with poisson noise - plausible shapes, not real data. to write data, and to serve it as a local stand-in
+# for the api:
+#
+#   python synthetic_data.py write <folder> [--areas 50] [--days 1000] [--extra-age-bands 4] [--seed 0]
+#   python synthetic_data.py serve <folder> [--port 8060]
+#
+# then run the app with COVID_DATA_DIR=<folder> POPULATION_DIR=<folder>, or with
+# COVID_API_BASE=http://localhost:<port> POPULATION_DIR=<folder> to read through http as from the real api
+
+import argparse
+import os
+import urllib.parse
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from data_sources import SOURCE_FILES, SOURCE_QUERIES
+
+
+# 5 year age bands cases are published in (the api also includes aggregate bands, which the cleaners drop)
+CASE_AGE_BANDS = [f'{5 * i:02d}_{5 * i + 4:02d}' for i in range(18)] + ['90+']
+CASE_AGGREGATE_BANDS = ['00_59', '60+', 'unassigned']
+
+# bands vaccinations and cumulative admissions are published in
+VAX_AGE_BANDS = ['18_24'] + [f'{5 * i}_{5 * i + 4}' for i in range(5, 18)] + ['90+']
+ADMISSIONS_AGE_BANDS = ['0_to_5', '6_to_17', '18_to_64', '65_to_84', '85+']
+
+ENGLAND_CODE = 'E92000001'
+
+# single year of age population columns, as in '2019_pop_by_region.csv'
+POP_AGE_COLUMNS = [str(age) for age in range(90)] + ['90+']
+
+
+def extra_age_band_labels(n):
+    """
+    :param n: Int - number of extra bands
+    :return: List - labels of overlapping aggregate age bands, such as the api adds over time. the app's
+    cleaners drop them, so they only add to the raw data read and parsed
+    """
+    return [f'{5 * (i % 18):02d}_{5 * (i % 18) + 14 + 5 * (i // 18):02d}' for i in range(n)]
+
+
+def make_population(n_areas, population_file, rng):
+    """
+    create populations for synthetic areas, by splitting the regions of a population file between them with
+    random sizes and age profiles, so the total stays a realistic national population
+    :param n_areas: Int - number of areas. None to keep the regions of the population file
+    :param population_file: Str - regional population file, in the form of '2019_pop_by_region.csv'
+    :param rng: numpy Generator
+    :return: DataFrame - in the layout of '2019_pop_by_region.csv', one row per area
+    """
+    regions = pd.read_csv(population_file)
+    if n_areas is None:
+        return regions
+
+    # each area takes a share of the national population in each age, varying smoothly with age
+    national = regions[POP_AGE_COLUMNS].sum(axis=0).to_numpy(dtype='float64')
+    size = rng.dirichlet(np.full(n_areas, 5.0))
+    tilt = np.exp(rng.normal(0, 0.3, size=(n_areas, 1)) * np.linspace(-1, 1, len(POP_AGE_COLUMNS))[None, :])
+    share = size[:, None] * tilt
+    pops = np.round(national[None, :] * share / share.sum(axis=0, keepdims=True)).astype('int64')
+
+    areas = pd.DataFrame({'Code': [f'E12{i:06d}' for i in range(1, n_areas + 1)],
+                          'Name': [f'Area {i:0{len(str(n_areas))}d}' for i in range(1, n_areas + 1)],
+                          'Geography1': 'Region',
+                          'All ages': pops.sum(axis=1)})
+
+    return pd.concat([areas, pd.DataFrame(pops, columns=POP_AGE_COLUMNS)], axis=1)
+
+
+def write_population_files(folder, regions, year=2019):
+    """
+    write regional and matching national population files, named as population.find_population_files expects
+    :param folder: Str - folder to write to
+    :param regions: DataFrame - in the layout of '2019_pop_by_region.csv'
+    :param year: Int - year the files are named for
+    """
+    regions.to_csv(os.path.join(folder, f'{year}_pop_by_region.csv'), index=False)
+    national = pd.DataFrame({'age': POP_AGE_COLUMNS, 'population': regions[POP_AGE_COLUMNS].sum(axis=0).to_numpy()})
+    national.to_csv(os.path.join(folder, f'{year}_England_pop.csv'), index=False)
+
+
+def wave(days, rng, n_waves=3):
+    """
+    :return: ndarray - smooth positive curve over the days, made of a few randomly placed waves
+    """
+    t = np.arange(days)
+    curve = np.full(days, 0.2)
+    for _ in range(n_waves):
+        centre, width, height = rng.uniform(0, days), rng.uniform(20, 60), rng.uniform(0.5, 2)
+        curve += height * np.exp(-0.5 * ((t - centre) / width) ** 2)
+
+    return curve
+
+
+def long_frame(dates, areas, ages, columns, area_type):
+    """
+    turn (date, area, age) arrays of values into api style long rows, newest date first
+    :param dates: DatetimeIndex
+    :param areas: DataFrame - 'areaCode' and 'areaName' for each area
+    :param ages: List - age band labels
+    :param columns: Dict - column name -> ndarray of shape (dates, areas, ages)
+    :param area_type: Str - 'region' or 'nation'
+    :return: DataFrame - with areaCode, areaName, areaType, date and age columns, plus the value columns
+    """
+    n_dates, n_areas, n_ages = len(dates), len(areas), len(ages)
+    date_idx, area_idx, age_idx = np.meshgrid(np.arange(n_dates)[::-1], np.arange(n_areas), np.arange(n_ages),
+                                              indexing='ij')
+
+    df = pd.DataFrame({'areaCode': areas['areaCode'].to_numpy()[area_idx.ravel()],
+                       'areaName': areas['areaName'].to_numpy()[area_idx.ravel()],
+                       'areaType': area_type,
+                       'date': dates.strftime('%Y-%m-%d').to_numpy()[date_idx.ravel()],
+                       'age': np.array(ages)[age_idx.ravel()]})
+    for name, values in columns.items():
+        df[name] = values[::-1].reshape(-1)
+
+    return df
+
+
+def rolling_sum(values, window=7):
+    """
+    :return: ndarray - trailing rolling sum along the first (date) axis, over however many days are available
+    """
+    cumulative = np.cumsum(values, axis=0)
+    cumulative[window:] = cumulative[window:] - cumulative[:-window]
+
+    return cumulative
+
+
+def make_case_data(regions, dates, rng, extra_age_bands=0):
+    """
+    :param regions: DataFrame - 'areaCode', 'areaName' and population per single year of age ('0' to '90+')
+    :param dates: DatetimeIndex - dates to create cases for
+    :param rng: numpy Generator
+    :param extra_age_bands: Int - number of extra aggregate age bands to add, on top of those the api has
+    :return: 2 DataFrames - cases by age and region, and cases by age for England, in api layout
+    """
+    # population in each 5 year band, to scale cases by
+    band_pops = np.stack([regions[[str(a) for a in range(5 * i, 5 * i + 5)]].sum(axis=1) for i in range(18)]
+                         + [regions['90+']], axis=1)
+
+    # daily rate per person follows a national wave shape, varied by region and age band
+    curve = wave(len(dates), rng)
+    region_factor = rng.uniform(0.7, 1.3, size=len(regions))
+    age_factor = rng.uniform(0.5, 1.5, size=len(CASE_AGE_BANDS))
+    rate = 3e-4 * curve[:, None, None] * region_factor[None, :, None] * age_factor[None, None, :]
+    cases = rng.poisson(rate * band_pops[None, :, :])
+
+    # add the aggregate bands the api includes
+    under_60 = cases[:, :, :12].sum(axis=2, keepdims=True)
+    over_60 = cases[:, :, 12:].sum(axis=2, keepdims=True)
+    unassigned = rng.poisson(0.5, size=under_60.shape)
+    extra = [cases[:, :, i % 18:i % 18 + 3 + i // 18].sum(axis=2, keepdims=True) for i in range(extra_age_bands)]
+    cases = np.concatenate([cases, under_60, over_60, unassigned] + extra, axis=2)
+    ages = CASE_AGE_BANDS + CASE_AGGREGATE_BANDS + extra_age_band_labels(extra_age_bands)
+
+    # cases with 7 day rolling sum and rate columns, as in the api
+    by_region = long_frame(dates, regions, ages, {'cases': cases, 'rollingSum': rolling_sum(cases),
+                                                  'rollingRate': np.zeros(cases.shape)}, 'region')
+
+    england = pd.DataFrame({'areaCode': [ENGLAND_CODE], 'areaName': ['England']})
+    national = cases.sum(axis=1, keepdims=True)
+    by_nation = long_frame(dates, england, ages, {'cases': national, 'rollingSum': rolling_sum(national),
+                                                  'rollingRate': np.zeros(national.shape)}, 'nation')
+
+    return by_region, by_nation
+
+
+def make_vax_data(dates, national_pop, rng):
+    """
+    :param dates: DatetimeIndex - dates of vaccination data (from start of vaccination programme)
+    :param national_pop: ndarray - national population by single year of age, 0 to 90+
+    :param rng: numpy Generator
+    :return: DataFrame - cumulative vaccinations by age in api layout
+    """
+    # older bands are vaccinated first - uptake follows a logistic curve starting later for younger bands
+    t = np.arange(len(dates))[:, None]
+    band_starts = [18] + [5 * i for i in range(5, 18)] + [90]
+    band_pops = np.array([national_pop[start:end].sum() for start, end in
+                          zip(band_starts, band_starts[1:] + [91])])
+    delay = np.linspace(150, 0, len(VAX_AGE_BANDS))[None, :] + rng.uniform(-5, 5, size=(1, len(VAX_AGE_BANDS)))
+    dose1 = band_pops * 0.9 / (1 + np.exp(-(t - delay) / 12))
+    dose2 = band_pops * 0.85 / (1 + np.exp(-(t - delay - 70) / 12))
+
+    england = pd.DataFrame({'areaCode': [ENGLAND_CODE], 'areaName': ['England']})
+
+    return long_frame(dates, england, VAX_AGE_BANDS,
+                      {'cumPeopleVaccinatedFirstDoseByVaccinationDate': dose1[:, None, :].astype('int64'),
+                       'cumPeopleVaccinatedSecondDoseByVaccinationDate': dose2[:, None, :].astype('int64')},
+                      'nation')
+
+
+def make_admissions_data(dates, rng):
+    """
+    :param dates: DatetimeIndex - dates of admissions data
+    :param rng: numpy Generator
+    :return: DataFrame - cumulative admissions by age in api layout
+    """
+    curve = wave(len(dates), rng)
+    scale = np.array([5, 8, 300, 350, 150])
+    cumulative = np.cumsum(rng.poisson(curve[:, None] * scale[None, :]), axis=0)
+
+    england = pd.DataFrame({'areaCode': [ENGLAND_CODE], 'areaName': ['England']})
+    df = long_frame(dates, england, ADMISSIONS_AGE_BANDS, {'value': cumulative[:, None, :]}, 'nation')
+
+    return df[['areaType', 'areaCode', 'areaName', 'date', 'age', 'value']]
+
+
+def write_synthetic_data(folder, days=500, seed=0, end_date='2021-07-20', areas=None, extra_age_bands=0,
+                         population_file='2019_pop_by_region.csv'):
+    """
+    write synthetic versions of every data source to a folder, named as data_sources expects for COVID_DATA_DIR,
+    together with population files for the areas named as population expects for POPULATION_DIR
+    :param folder: Str - folder to write to
+    :param days: Int - number of days of case data, ending at end_date
+    :param seed: Int - random seed
+    :param end_date: Str or Datetime - last date of data
+    :param areas: Int - number of synthetic areas to create cases for. None to use the regions of population_file
+    :param extra_age_bands: Int - number of extra aggregate age bands to add to the case data
+    :param population_file: Str - regional population file, in the form of '2019_pop_by_region.csv', that
+    area populations are taken or split from
+    :return: Dict - source name -> DataFrame written
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+
+    population = make_population(areas, population_file, rng)
+    write_population_files(folder, population)
+    regions = population.rename(columns={'Code': 'areaCode', 'Name': 'areaName'})
+    national_pop = regions[POP_AGE_COLUMNS].sum(axis=0).to_numpy()
+
+    end_date = pd.to_datetime(end_date)
+    case_dates = pd.date_range(end=end_date, periods=days, freq='D')
+    vax_dates = pd.date_range(start=max(pd.Timestamp('2020-12-08'), case_dates[0]), end=end_date, freq='D')
+    admissions_dates = pd.date_range(end=end_date - pd.Timedelta(days=2), periods=days, freq='D')
+
+    cases_by_age_region, cases_by_age = make_case_data(regions, case_dates, rng, extra_age_bands)
+    data = {'cases_by_age_region': cases_by_age_region,
+            'cases_by_age': cases_by_age,
+            'vaccines_by_age': make_vax_data(vax_dates, national_pop, rng),
+            'cum_admissions_by_age': make_admissions_data(admissions_dates, rng)}
+
+    for name, df in data.items():
+        df.to_csv(os.path.join(folder, SOURCE_FILES[name]), index=False)
+
+    return data
+
+
+def api_handler(folder):
+    """
+    :param folder: Str - folder of data files, as written by write_synthetic_data
+    :return: class - http request handler answering the api queries in data_sources.SOURCE_QUERIES with the files
+    """
+    files = {tuple(sorted(urllib.parse.parse_qsl(query))): SOURCE_FILES[name] for name, query in SOURCE_QUERIES.items()}
+
+    class ApiHandler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=folder, **kwargs)
+
+        def translate_path(self, path):
+            url = urllib.parse.urlsplit(path)
+            file = files.get(tuple(sorted(urllib.parse.parse_qsl(url.query))))
+            if url.path.rstrip('/') != '/v2/data' or file is None:
+                return os.path.join(folder, '__not_found__')
+
+            return os.path.join(folder, file)
+
+        def guess_type(self, path):
+            return 'text/csv'
+
+    return ApiHandler
+
+
+def serve_api(folder, host='127.0.0.1', port=8060):
+    """
+    serve data files at the same paths as the coronavirus dashboard api, as a stand-in for it. blocks until
+    interrupted
+    :param folder: Str - folder of data files, as written by write_synthetic_data
+    :param host: Str - address to listen on
+    :param port: Int - port to listen on
+    """
+    server = ThreadingHTTPServer((host, port), api_handler(os.path.abspath(folder)))
+    print(f'serving {folder} as the api - run the app with COVID_API_BASE=http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='write synthetic data in the layout of the gov.uk api')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    write_parser = commands.add_parser('write', help='write synthetic data files and population files')
+    write_parser.add_argument('folder')
+    write_parser.add_argument('--days', type=int, default=500, help='days of case data')
+    write_parser.add_argument('--areas', type=int, help='number of synthetic areas, instead of the real regions')
+    write_parser.add_argument('--extra-age-bands', type=int, default=0, help='extra aggregate age bands in cases')
+    write_parser.add_argument('--end-date', default='2021-07-20', help='last date of data')
+    write_parser.add_argument('--seed', type=int, default=0, help='random seed')
+
+    serve_parser = commands.add_parser('serve', help='serve data files as a local stand-in for the api')
+    serve_parser.add_argument('folder')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8060)
+
+    args = parser.parse_args()
+    if args.command == 'write':
+        data = write_synthetic_data(args.folder, args.days, args.seed, args.end_date, args.areas,
+                                    args.extra_age_bands)
+        for name, df in data.items():
+            print(f'{SOURCE_FILES[name]}: {len(df)} rows')
+    else:
+        serve_api(args.folder, args.host, args.port)
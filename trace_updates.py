@@ -0,0 +1,129 @@
+# incremental figure updates. dash 1.x sends a callback's outputs whole, so a figure whose traces change a few at
+# a time (eg ticking an age group on tabs 1 and 2) would be rebuilt and resent in full on every change. instead
+# these callbacks send an update message to a store next to the graph, which a clientside callback merges into
+# the figure in the browser. each trace and layout has a uid made from the data version and the inputs it depends
+# on, the browser keeps the uids of what it has in a second store, and only the traces it doesn't have are built
+# and sent - the rest are kept, reordered or dropped in the browser
+
+import hashlib
+import dash_core_components as dcc
+import plotly.graph_objects as go
+from dash.dependencies import Input, Output, State
+from result_cache import cache_key
+
+
+# merges an update message into the figure, and records the uids of the figure now shown. if the figure in the
+# browser is not the one the message was made against (eg the tab was re-rendered while the request was in
+# flight), nothing is merged and the uids are cleared, so the next change sends the whole figure
+MERGE_UPDATE_JS = '''
+function(update, figure, rendered) {
+    if (!update) {
+        return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+    }
+    var traces = {};
+    if (figure && rendered) {
+        rendered.traces.forEach(function(uid, i) { traces[uid] = figure.data[i]; });
+    }
+    Object.assign(traces, update.new_traces);
+    var data = update.traces.map(function(uid) { return traces[uid]; });
+    var layout = update.new_layout || (figure && figure.layout);
+    if (!layout || data.some(function(trace) { return trace === undefined; })) {
+        return [window.dash_clientside.no_update, null];
+    }
+    return [{data: data, layout: layout}, {layout: update.layout, traces: update.traces}];
+}
+'''
+
+
+def update_id(graph_id):
+    return f'{graph_id}-update'
+
+
+def rendered_id(graph_id):
+    return f'{graph_id}-rendered'
+
+
+def update_stores(graph_id):
+    """
+    :param graph_id: Str - id of a graph updated incrementally
+    :return: List - stores for the graph's update messages and the uids of the figure shown, to go in the layout
+    """
+    return [dcc.Store(id=update_id(graph_id)), dcc.Store(id=rendered_id(graph_id))]
+
+
+def register_incremental_graph(app, graph_id):
+    """
+    merge update messages for a graph into its figure in the browser
+    :param app: dash.Dash
+    :param graph_id: Str - graph id, with stores from update_stores in the layout
+    """
+    app.clientside_callback(
+        MERGE_UPDATE_JS,
+        [Output(graph_id, 'figure'), Output(rendered_id(graph_id), 'data')],
+        [Input(update_id(graph_id), 'data')],
+        [State(graph_id, 'figure'), State(rendered_id(graph_id), 'data')])
+
+
+def trace_uid(*args):
+    """
+    :param args: the version of the data loaded and the inputs the trace or layout depends on. the data version
+    keeps a browser left open across a redeploy from keeping traces of the old data
+    :return: Str - uid of a trace or layout
+    """
+    return hashlib.blake2b(cache_key(*args).encode(), digest_size=8).hexdigest()
+
+
+def graph_layout(layout):
+    """
+    :param layout: Dict - layout properties, eg from create_graph_layout
+    :return: go.Layout - the layout of a new figure with them set, including the default template
+    """
+    return go.Figure().update_layout(layout).layout
+
+
+def figure_update(rendered, layout, traces):
+    """
+    update message taking the figure in the browser to a new one. only the layout and traces the browser doesn't
+    have are built
+    :param rendered: Dict - uids of the layout and traces of the figure in the browser, as kept by the clientside
+    callback. None for a graph with no figure yet, giving the whole figure
+    :param layout: 2-tuple - uid of the layout, and a function returning it
+    :param traces: List - of 2-tuples of uid and a function returning the trace, in figure order
+    :return: Dict - uids of the new layout and traces, the layout if it has changed (else None) and new traces by uid
+    """
+    have = set(rendered['traces']) if rendered else set()
+    layout_uid, build_layout = layout
+    changed = rendered is None or rendered['layout'] != layout_uid
+
+    return {'layout': layout_uid,
+            'traces': [uid for uid, _ in traces],
+            'new_layout': build_layout() if changed else None,
+            'new_traces': {uid: build() for uid, build in traces if uid not in have}}
+
+
+def figure_parts(figure, *args):
+    """
+    layout and traces of a figure built whole, for figures which are not worth building a trace at a time (eg
+    the small multiples across regions)
+    :param figure: go.Figure
+    :param args: the data version and inputs the figure depends on, for the uids
+    :return: 2-tuple - layout and traces, as taken by figure_update
+    """
+    return ((trace_uid('layout', *args), lambda: figure.layout),
+            [(trace_uid('trace', i, *args), lambda trace=trace: trace) for i, trace in enumerate(figure.data)])
+
+
+def update_figure(update):
+    """
+    :param update: Dict - update message made for a graph with no figure (rendered None)
+    :return: go.Figure - the whole figure, eg for reports and exports made outside the browser
+    """
+    return go.Figure(data=[update['new_traces'][uid] for uid in update['traces']], layout=update['new_layout'])
+
+
+def rendered_state(update):
+    """
+    :param update: Dict - update message
+    :return: Dict - uids the browser keeps once it has merged the message, as sent back with the next request
+    """
+    return {'layout': update['layout'], 'traces': update['traces']}
@@ -4,30 +4,19 @@
 import numpy as np
 import pandas as pd
 from pandas.tseries.offsets import DateOffset
+from population import population_registry
+from smoothing import smooth_frame
+from age_bands import (CASE_AGE_BANDS, CASES_TO_ADMISSIONS, VAX_TO_ADMISSIONS, ADMISSIONS_TO_ADMISSIONS,
+                       bins_mapping)
 
 
 def create_pop_age_gps():
     """
     function specifically for getting England population split by the age groups that hospital
-    admissions are provided in, from the 2019 population file which is housed in the root folder
+    admissions are provided in, from the population registry (loaded once from the national population file)
     :return: dataframe with a single row of population figures, columns are the age groups
     """
-
-    # read in population file
-    population = pd.read_csv('2019_England_pop.csv')
-
-    # tidy data
-    population.replace(to_replace='90+', value=90, inplace=True)
-    population['age'] = population['age'].astype('int64')
-
-    # create age-group columns for age groups in which the admissions data is provided
-    bins = [0, 17, 64, 84, 90]
-    bin_labels = ['0-17 yrs', '18-64 yrs', '65-84 yrs', '85+ yrs']
-    population['age_group'] = pd.cut(population['age'], bins=bins, labels=bin_labels, include_lowest=True)
-    population.drop(columns='age', axis=1, inplace=True)
-    # as the only cols left are age group and population, a simple groupby and transpose gives us the df in
-    # desired form
-    population = population.groupby(by='age_group').sum().T
+    population = pd.DataFrame(population_registry().admissions_pop).T
 
     return population
 
@@ -45,12 +34,7 @@ def clean_case_data(df):
     df = df[df['date'] > '2020-07-31']
 
     # filter to age values to be kept
-    age_gps = ['00_04', '05_09', '10_14', '15_19',
-               '20_24', '25_29', '30_34', '35_39',
-               '40_44', '45_49', '50_54', '55_59',
-               '60_64', '65_69', '70_74', '75_79',
-               '80_84', '85_89', '90+']
-    df = df[df['age'].isin(age_gps)]
+    df = df[df['age'].isin(CASE_AGE_BANDS)]
 
     # filter to columns to be kept
     cols_to_keep = ['areaName', 'date', 'age', 'cases']
@@ -72,24 +56,9 @@ def get_case_age_gps(df):
     df = df.groupby(by=['date', 'age']).sum().unstack()
     df.columns = df.columns.droplevel()
 
-    # create list of starting cols to drop later
-    starting_cols = df.columns.values.tolist()
-
-    # set age groups to 0-17, 18-64, 65-84 and 85+ (to match only available admissions split)
-    cols_0014 = ['00_04', '05_09', '10_14']
-    cols_2064 = [f'{5 * i}_{5 * (i + 1) - 1}' for i in range(4, 13)]
-    cols_6584 = [f'{5 * i}_{5 * (i + 1) - 1}' for i in range(13, 17)]
-    cols_85plus = ['85_89', '90+']
-    # approximate split of the 15-19 age group given in the case date to 15-17 an 18-19
-    df['0-17 yrs'] = df[cols_0014].sum(axis=1) + 0.6 * df['15_19']
-    df['18-64 yrs'] = 0.4 * df['15_19'] + df[cols_2064].sum(axis=1)
-    df['65-84 yrs'] = df[cols_6584].sum(axis=1)
-    df['85+ yrs'] = df[cols_85plus].sum(axis=1)
-
-    # drop original cols
-    df.drop(starting_cols, axis=1, inplace=True)
-
-    return df
+    # set age groups to 0-17, 18-64, 65-84 and 85+ (to match only available admissions split), with the 15-19
+    # age group split between 15-17 and 18-19
+    return CASES_TO_ADMISSIONS.apply_frame(df)
 
 
 def prepare_case_data(df):
@@ -143,37 +112,18 @@ def set_vax_age_gps(df):
     :return: 2 DataFrames - rows are dates, columns are age_groups for dose 1 cumulative vaccinated
     and dose 2 cumulative vaccinated
     """
-    # create separate first dose and second dose dataframes
-    first_dose = df.drop('cumPeopleVaccinatedSecondDoseByVaccinationDate', axis=1)
-    second_dose = df.drop('cumPeopleVaccinatedFirstDoseByVaccinationDate', axis=1)
+    doses = ['cumPeopleVaccinatedFirstDoseByVaccinationDate', 'cumPeopleVaccinatedSecondDoseByVaccinationDate']
 
-    # helper function to create pivoted vax data by required age groups
-    def group_vax(vax_df):
-        # create first dose pivot by age
-        vax_df = vax_df.groupby(by=['date', 'age']).sum().unstack()
-        vax_df.columns = vax_df.columns.droplevel()
+    # pivot both doses by age, as a dates x doses x age bands array
+    vax_df = df.groupby(by=['date', 'age'])[doses].sum().unstack()
+    vax_df = vax_df.reindex(columns=pd.MultiIndex.from_product([doses, VAX_TO_ADMISSIONS.sources]))
+    values = np.nan_to_num(vax_df.to_numpy(dtype='float64')).reshape(len(vax_df), len(doses), -1)
 
-        starting_cols = vax_df.columns.values.tolist()
-
-        # set age groups to 0-17, 18-64, 65-84 and 85+ (to match only available admissions split)
-        vax_df['0-17 yrs'] = 0
-        cols_1864 = ['18_24'] + [f'{5*i}_{5*(i+1) - 1}' for i in range(5,13)]
-        cols_6584 = [f'{5*i}_{5*(i+1) - 1}' for i in range(13,17)]
-        cols_85plus = ['85_89', '90+']
-        vax_df['18-64 yrs'] = vax_df[cols_1864].sum(axis=1)
-        vax_df['65-84 yrs'] = vax_df[cols_6584].sum(axis=1)
-        vax_df['85+ yrs'] = vax_df[cols_85plus].sum(axis=1)
-
-        # drop original cols
-        vax_df.drop(starting_cols, axis=1, inplace=True)
-
-        return vax_df
-
-    # create first dose pivot by age
-    first_dose = group_vax(first_dose)
-
-    # create second dose pivot by age
-    second_dose = group_vax(second_dose)
+    # set age groups to 0-17, 18-64, 65-84 and 85+ (to match only available admissions split), for both doses
+    # in one product
+    grouped = VAX_TO_ADMISSIONS.apply(values)
+    first_dose, second_dose = [pd.DataFrame(grouped[:, i], index=vax_df.index, columns=VAX_TO_ADMISSIONS.targets)
+                               for i in range(len(doses))]
 
     return first_dose, second_dose
 
@@ -246,17 +196,7 @@ def set_admissions_age_gps(df):
     :return: DataFrames - rows are dates, columns are age_groups
     """
     # admissions already essentially in the right age groups - just need to combine the 2 youngest age groups
-    df['0-17 yrs'] = df['0_to_5'] + df['6_to_17']
-
-    # rename columns for consistency and drop unnecessary ones
-    col_name_map = {'18_to_64' : '18-64 yrs',
-                    '65_to_84' : '65-84 yrs',
-                    '85+' : '85+ yrs'}
-    df.rename(columns=col_name_map, inplace=True)
-    cols_to_drop = ['0_to_5', '6_to_17']
-    df.drop(cols_to_drop, axis=1, inplace=True)
-
-    return df
+    return ADMISSIONS_TO_ADMISSIONS.apply_frame(df, skipna=False)
 
 
 def prepare_admissions_data(df):
@@ -317,12 +257,16 @@ def bin_ages_from_list(df, bin_list):
     age group label
     """
     # expecting age labels to be in a form where the first 2 characters are the starting age for that band
-    # eg 05to10.
-    df['start_age'] = df['age'].apply(lambda x: int(x[:2]))
+    # eg 05to10. work on the distinct bands, then look up each row's band
+    bands = pd.Categorical(df['age'])
+    start_ages = np.array([int(band[:2]) for band in bands.categories])
+    df['start_age'] = start_ages[bands.codes]
 
-    # create full bin list and labels, and create age_group column using pd.cut
+    # create full bin list and labels, and create age_group column from the age band mapping
     bins, bin_labels = create_bins_labels(bin_list)
-    df['age_group'] = pd.cut(x=df['start_age'], bins=bins, right=False, labels=bin_labels)
+    mapping = bins_mapping(tuple(bands.categories), tuple(bins))
+    df['age_group'] = pd.Categorical.from_codes(mapping.group_codes(df['age']), categories=mapping.targets,
+                                                 ordered=True)
 
     return df
 
@@ -360,7 +304,7 @@ def backfill_start(df, start_date):
     return df
 
 
-def get_ratio(df1, df2, start_date, rolling=7):
+def get_ratio(df1, df2, start_date, rolling=7, smoothing='trailing'):
     """
     takes ratio of 2 dataframes with identical shape and column order, after first taking a rolling average,
     and then slices to begin at start_date
@@ -369,13 +313,14 @@ def get_ratio(df1, df2, start_date, rolling=7):
     :param start_date: DateTime - needs to be later than the start date of the dfs, which is currently set to
     1 August 2020
     :param rolling: Int - length of window for rolling average
+    :param smoothing: Str - smoothing filter, one of smoothing.FILTERS
     :return: DataFrame - same columns as df1 and df2, with values being ratio of the rolling avges, sliced to
     begin at passed start_date
     """
 
     # create rolling avge dfs
-    df1 = df1.rolling(rolling).mean()
-    df2 = df2.rolling(rolling).mean()
+    df1 = smooth_frame(df1, smoothing, rolling)
+    df2 = smooth_frame(df2, smoothing, rolling)
     
     # create ratio df
     ratio = df1 / df2
@@ -387,42 +332,18 @@ def get_ratio(df1, df2, start_date, rolling=7):
     return ratio
 
 
-def get_region_pop(df, region, age_bins_list):
+def get_region_pop(region, age_bins_list):
     """
-    from population by single and and region df, create df by given age groups for given region
-    :param df: dataframe containing population data. expected to be in the form loaded from '2019_pop_by_region.csv'
+    create population df by given age groups for given region, from the population registry
     :param region: chosen England region to filter population by. if set to 'England', sums all regions
     :param age_bins_list: list of integer age group dividers - expected to be in the form from the age_group checklist
     :return: df with single row for required region, and a column for eag required age group, containing population
     """
-    # allow for special case of region being England, requiring a sum of all regions, else just slice to region
-    if region == 'England':
-        region_pop = pd.DataFrame(df.sum(axis=0)).T
-    else:
-        region_pop = df[df['Name'] == region].copy()
-
-    # new cols will be created which will be the ones to keep, after which the starting columns can all be dropped
-    cols_to_drop = region_pop.copy().columns
-
-    # create bins and bin labels for age groups
+    # create bins and bin labels for age groups, and look up populations for them
     bins, bin_labels = create_bins_labels(age_bins_list)
+    group_pops = population_registry().groups(region, bins)
 
-    # create new columns with population for age groups
-    for i in range(len(bins)-2):
-        sum_cols = [str(j) for j in range(bins[i], bins[i+1])]
-        region_pop[bin_labels[i]] = region_pop[sum_cols].sum(axis=1)
-
-    #special case for last age group, to allow for it possibly being 90
-    if bins[-2] == 90:
-        region_pop[bin_labels[-1]] = region_pop['90+']
-    else:
-        sum_cols = [str(j) for j in range(bins[-2], 90)]
-        sum_cols.append('90+')
-        region_pop[bin_labels[-1]] = region_pop[sum_cols].sum(axis=1)
-
-    # turn region name column into index. don't drop as it is in the list of cols to drop in the next step
-    region_pop.set_index('Name', drop=False, inplace=True)
-    region_pop.drop(columns=cols_to_drop, axis=1, inplace=True)
+    region_pop = pd.DataFrame([group_pops], columns=bin_labels, index=pd.Index([region], name='Name'))
 
     return region_pop
 
@@ -442,18 +363,19 @@ def get_df_per_pop(df, pop_df, per=10000):
     return df_per_pop
 
 
-def get_rolling_total(df, start_date, end_date, rolling=1):
+def get_rolling_total(df, start_date, end_date, rolling=1, smoothing='trailing'):
     """
     apply rolling average and then sum df cols, cut df to between start and end date
     :param df: dataframe - datetime index and only columns you want to sum
     :param start_date: datetime - start date to cut index by
     :param end_date: datetime - end date to cut index by
     :param rolling: int - rolling average window length
+    :param smoothing: str - smoothing filter, one of smoothing.FILTERS
     :return:
     """
 
     # create rolling avge dfs
-    df = pd.DataFrame(df.rolling(rolling).mean())
+    df = smooth_frame(pd.DataFrame(df), smoothing, rolling)
 
     # create sum column
     df['total'] = df.sum(axis=1)
@@ -465,6 +387,39 @@ def get_rolling_total(df, start_date, end_date, rolling=1):
     return pd.DataFrame(df['total'])
 
 
+def get_lag_correlations(df1, df2, start_date, end_date, lags, rolling=7, progress=None):
+    """
+    sweep over lags between cases and admissions, finding how well cases predict admissions that many days later
+    :param df1: DataFrame - admissions, datetime index and only columns you want to sum
+    :param df2: DataFrame - cases, same columns as df1
+    :param start_date: datetime - start of period to compare over
+    :param end_date: datetime - end of period to compare over
+    :param lags: List - lags (in days) to try
+    :param rolling: int - rolling average window length
+    :param progress: function - called as progress(fraction done, message) after each lag, eg to report the
+    progress of a background job
+    :return: DataFrame - index is lag, columns are 'correlation' of admissions with lagged cases and 'ratio' of
+    total admissions to total cases
+    """
+    cases = get_rolling_total(df2, start_date=start_date, end_date=end_date, rolling=rolling)['total']
+
+    rows = []
+    for i, lag in enumerate(lags):
+        admissions = get_rolling_total(df1.shift(-lag), start_date=start_date, end_date=end_date,
+                                       rolling=rolling)['total']
+
+        # the last 'lag' days have no admissions yet
+        valid = admissions.notna() & cases.notna()
+        rows.append({'lag': lag,
+                     'correlation': admissions[valid].corr(cases[valid]),
+                     'ratio': admissions[valid].sum() / cases[valid].sum()})
+
+        if progress is not None:
+            progress((i + 1) / len(lags), f'lag {lag} days')
+
+    return pd.DataFrame(rows).set_index('lag')
+
+
 def get_month_starts(start_date, end_date):
     """
     get list of dates which will be the 1st of every month from the start-date month to end-date month
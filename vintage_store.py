@@ -0,0 +1,304 @@
+# store of every daily release of the raw gov.uk data, so analysis can be re-run as it would have looked at the
+# time of an earlier release. specimen date cases and admissions get revised after publication, so each release
+# is stored as a delta against the release before it (rows added, changed or removed), with a full checkpoint
+# every so often to bound the work needed to rebuild a vintage.
+#
+# data is held columnar - one compressed numpy array per column - in one .npz file per release, with a
+# manifest.json per dataset listing the releases and the dictionaries used to encode text key columns
+
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from data_sources import read_source
+
+
+# raw source name -> (key columns, value columns). 'date' must be the first key column. only the columns
+# used by the cleaners in utilities.py are kept
+VINTAGE_DATASETS = {
+    'cases_by_age_region': (['date', 'areaName', 'age'], ['cases']),
+    'cases_by_age': (['date', 'areaName', 'age'], ['cases']),
+    'vaccines_by_age': (['date', 'age'], ['cumPeopleVaccinatedFirstDoseByVaccinationDate',
+                                          'cumPeopleVaccinatedSecondDoseByVaccinationDate']),
+    'cum_admissions_by_age': (['date', 'age'], ['value']),
+}
+
+# keys are packed into a single int64 - days since 1970 for the date, then 16 bits per text key column
+KEY_BITS = 16
+
+EPOCH = pd.Timestamp('1970-01-01')
+
+
+def diff_vintages(prev_keys, prev_values, keys, values):
+    """
+    find the delta between two vintages held as sorted unique keys and matching value arrays
+    :param prev_keys: ndarray - sorted int64 keys of the earlier vintage
+    :param prev_values: ndarray - 2d float values of the earlier vintage, one row per key
+    :param keys: ndarray - sorted int64 keys of the later vintage
+    :param values: ndarray - 2d float values of the later vintage, one row per key
+    :return: 3 ndarrays - keys and values of rows added or changed in the later vintage, and keys removed
+    """
+    _, prev_idx, idx = np.intersect1d(prev_keys, keys, assume_unique=True, return_indices=True)
+
+    old, new = prev_values[prev_idx], values[idx]
+    unchanged = np.all((old == new) | (np.isnan(old) & np.isnan(new)), axis=1)
+
+    upsert = ~np.isin(keys, prev_keys, assume_unique=True)
+    upsert[idx[~unchanged]] = True
+    removed = ~np.isin(prev_keys, keys, assume_unique=True)
+
+    return keys[upsert], values[upsert], prev_keys[removed]
+
+
+def apply_delta(keys, values, upsert_keys, upsert_values, delete_keys):
+    """
+    apply a delta (from diff_vintages) to a vintage
+    :return: 2 ndarrays - sorted keys and matching values of the resulting vintage
+    """
+    drop = np.isin(keys, np.concatenate([upsert_keys, delete_keys]))
+    keys = np.concatenate([keys[~drop], upsert_keys])
+    values = np.concatenate([values[~drop], upsert_values])
+
+    order = np.argsort(keys, kind='stable')
+
+    return keys[order], values[order]
+
+
+class VintageStore:
+    """
+    delta-encoded store of daily releases of the raw datasets, with an 'as of release' query
+    """
+
+    def __init__(self, root, checkpoint_every=30):
+        """
+        :param root: Str - folder to keep the store in
+        :param checkpoint_every: Int - store a full copy rather than a delta every n releases
+        """
+        self.root = root
+        self.checkpoint_every = checkpoint_every
+
+        # vintages are rebuilt from files, so can be cached per instance
+        self.as_of_arrays = lru_cache(maxsize=16)(self._as_of_arrays)
+
+    def dataset_dir(self, name):
+        return os.path.join(self.root, name)
+
+    def manifest(self, name):
+        """
+        :param name: Str - dataset name (key of VINTAGE_DATASETS)
+        :return: Dict - 'releases' list (oldest first) of {'release', 'kind', 'rows'} and 'dictionaries' of
+        the values of each text key column, in code order
+        """
+        path = os.path.join(self.dataset_dir(name), 'manifest.json')
+        if not os.path.exists(path):
+            key_cols = VINTAGE_DATASETS[name][0]
+            return {'releases': [], 'dictionaries': {col: [] for col in key_cols[1:]}}
+
+        with open(path) as f:
+            return json.load(f)
+
+    def save_manifest(self, name, manifest):
+        os.makedirs(self.dataset_dir(name), exist_ok=True)
+        path = os.path.join(self.dataset_dir(name), 'manifest.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+    @contextmanager
+    def locked(self, name):
+        """
+        hold an exclusive lock on a dataset, so workers starting together record their releases one at a time
+        :param name: Str - dataset name (key of VINTAGE_DATASETS)
+        """
+        os.makedirs(self.dataset_dir(name), exist_ok=True)
+        with open(os.path.join(self.dataset_dir(name), '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def release_path(self, name, release):
+        return os.path.join(self.dataset_dir(name), f'{release}.npz')
+
+    def releases(self, name):
+        """
+        :param name: Str - dataset name (key of VINTAGE_DATASETS)
+        :return: List - release dates (as 'YYYY-MM-DD' strings) held for the dataset, oldest first
+        """
+        return [entry['release'] for entry in self.manifest(name)['releases']]
+
+    def encode(self, name, df, manifest):
+        """
+        turn raw rows into sorted packed keys and a 2d array of values, adding any new text values to the
+        dictionaries in manifest
+        """
+        key_cols, value_cols = VINTAGE_DATASETS[name]
+        df = df.drop_duplicates(subset=key_cols, keep='last')
+
+        keys = ((pd.to_datetime(df['date']) - EPOCH).dt.days.to_numpy()).astype('int64')
+        for col in key_cols[1:]:
+            dictionary = manifest['dictionaries'][col]
+            codes = {value: code for code, value in enumerate(dictionary)}
+            for value in df[col].astype(str).unique():
+                if value not in codes:
+                    codes[value] = len(dictionary)
+                    dictionary.append(value)
+            keys = (keys << KEY_BITS) | df[col].astype(str).map(codes).to_numpy().astype('int64')
+
+        values = df[value_cols].to_numpy(dtype='float64')
+
+        order = np.argsort(keys, kind='stable')
+
+        return keys[order], values[order]
+
+    def key_days(self, name, keys):
+        """
+        :return: ndarray - date of each packed key, as days since 1970
+        """
+        return keys >> (KEY_BITS * (len(VINTAGE_DATASETS[name][0]) - 1))
+
+    def decode(self, name, keys, values, manifest):
+        """
+        turn packed keys and values back into a dataframe in the raw column layout
+        """
+        key_cols, value_cols = VINTAGE_DATASETS[name]
+
+        columns = {}
+        for col in reversed(key_cols[1:]):
+            dictionary = np.array(manifest['dictionaries'][col], dtype=object)
+            columns[col] = dictionary[keys & ((1 << KEY_BITS) - 1)]
+            keys = keys >> KEY_BITS
+        columns['date'] = EPOCH + pd.to_timedelta(keys, unit='D')
+
+        df = pd.DataFrame({col: columns[col] for col in key_cols})
+        for i, col in enumerate(value_cols):
+            df[col] = values[:, i]
+
+        return df
+
+    def record(self, name, df, release=None, since=None):
+        """
+        add a release of a dataset to the store. recording the latest release again replaces it
+        :param name: Str - dataset name (key of VINTAGE_DATASETS)
+        :param df: DataFrame - raw data in the form downloaded from the .gov website
+        :param release: Str or Datetime - release date. defaults to today
+        :param since: Datetime - if given, df only holds rows dated after this, and earlier rows are taken to be
+        unchanged from the previous release, which must exist
+        """
+        release = pd.to_datetime(release if release is not None else 'today').strftime('%Y-%m-%d')
+
+        with self.locked(name):
+            # another worker may have recorded since this one last read the store
+            self.as_of_arrays.cache_clear()
+            manifest = self.manifest(name)
+            entries = manifest['releases']
+
+            if entries and release < entries[-1]['release']:
+                raise ValueError(f'cannot record release {release} of {name} before latest release '
+                                 f'{entries[-1]["release"]}')
+            if entries and release == entries[-1]['release']:
+                entries.pop()
+
+            if since is not None and not entries:
+                raise ValueError(f'cannot record rows of {name} since {since} with no earlier release to take the '
+                                 f'rows before it from - record a full read first')
+
+            keys, values = self.encode(name, df, manifest)
+
+            if entries:
+                prev_keys, prev_values = self.as_of_arrays(name, entries[-1]['release'])
+                if since is not None:
+                    # rows up to 'since' weren't re-read, so carry them over from the previous release
+                    keep = self.key_days(name, prev_keys) <= (pd.to_datetime(since) - EPOCH).days
+                    keys, values = apply_delta(prev_keys[keep], prev_values[keep], keys, values, keys[:0])
+
+            full = not entries or len(entries) % self.checkpoint_every == 0
+            if full:
+                arrays = {'keys': keys}
+                arrays.update({f'value_{i}': values[:, i] for i in range(values.shape[1])})
+            else:
+                upsert_keys, upsert_values, delete_keys = diff_vintages(prev_keys, prev_values, keys, values)
+                arrays = {'upsert_keys': upsert_keys, 'delete_keys': delete_keys}
+                arrays.update({f'value_{i}': upsert_values[:, i] for i in range(upsert_values.shape[1])})
+
+            # write then rename, so readers never open a partly written release
+            fd, tmp_path = tempfile.mkstemp(dir=self.dataset_dir(name))
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, self.release_path(name, release))
+
+            entries.append({'release': release, 'kind': 'full' if full else 'delta', 'rows': int(len(keys))})
+            self.save_manifest(name, manifest)
+            self.as_of_arrays.cache_clear()
+
+    def _as_of_arrays(self, name, release):
+        """
+        rebuild a vintage as packed keys and values, starting at the latest full checkpoint at or before it
+        """
+        entries = [entry for entry in self.manifest(name)['releases'] if entry['release'] <= release]
+        if not entries:
+            raise KeyError(f'no release of {name} on or before {release}')
+
+        start = max(i for i, entry in enumerate(entries) if entry['kind'] == 'full')
+
+        keys = values = None
+        for entry in entries[start:]:
+            with np.load(self.release_path(name, entry['release'])) as arrays:
+                n_values = len(VINTAGE_DATASETS[name][1])
+                release_values = np.column_stack([arrays[f'value_{i}'] for i in range(n_values)])
+                if entry['kind'] == 'full':
+                    keys, values = arrays['keys'], release_values
+                else:
+                    keys, values = apply_delta(keys, values, arrays['upsert_keys'], release_values,
+                                               arrays['delete_keys'])
+
+        return keys, values
+
+    def as_of(self, name, release):
+        """
+        rebuild a dataset as it was published in a given release
+        :param name: Str - dataset name (key of VINTAGE_DATASETS)
+        :param release: Str or Datetime - release date. the latest release on or before it is used
+        :return: DataFrame - raw data in the column layout of the .gov download
+        """
+        release = pd.to_datetime(release).strftime('%Y-%m-%d')
+        keys, values = self.as_of_arrays(name, release)
+
+        return self.decode(name, keys, values, self.manifest(name))
+
+    def recording_reader(self, release=None):
+        """
+        :param release: Str or Datetime - release date to record reads under. defaults to today
+        :return: function - reads like data_sources.read_source, recording everything read as a release
+        """
+        def reader(name, since=None):
+            recorded_release = pd.to_datetime(release if release is not None else 'today').strftime('%Y-%m-%d')
+            if since is not None and not [r for r in self.releases(name) if r < recorded_release]:
+                # nothing earlier to take the rows up to since from, so record a full read
+                df = read_source(name)
+                self.record(name, df, release=release)
+                return df[pd.to_datetime(df['date']) > pd.to_datetime(since)]
+
+            df = read_source(name, since=since)
+            self.record(name, df, release=release, since=since)
+            return df
+
+        return reader
+
+    def as_of_reader(self, release):
+        """
+        :param release: Str or Datetime - release date to read
+        :return: function - reads like data_sources.read_source, but from the given release in the store
+        """
+        def reader(name, since=None):
+            df = self.as_of(name, release)
+            if since is not None:
+                df = df[df['date'] > pd.to_datetime(since)]
+            return df
+
+        return reader